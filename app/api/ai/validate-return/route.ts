@@ -3,6 +3,7 @@ import { getSession } from "@/lib/auth";
 import { connectDB } from "@/lib/mongodb";
 import Return from "@/models/Return";
 import { predictWithLocalModel } from "@/lib/mlPredictionService";
+import { recordFraudFlagChange } from "@/lib/returnAggregateStore";
 
 export async function POST(req: NextRequest) {
   try {
@@ -62,7 +63,8 @@ export async function POST(req: NextRequest) {
     // Update the return request with AI analysis results
     // Note: We only update validationStatus and fraudFlag, not the main status
     // The main status is controlled by admin approval process
-    await Return.findByIdAndUpdate(returnId, {
+    // (findByIdAndUpdate returns the document as it was before this update)
+    const previous = await Return.findByIdAndUpdate(returnId, {
       validationStatus: validationStatus,
       fraudFlag: fraudFlag,
       mlAnalysisResult: {
@@ -75,6 +77,12 @@ export async function POST(req: NextRequest) {
       }
     });
 
+    if (previous) {
+      await recordFraudFlagChange(previous.userId, previous.fraudFlag, fraudFlag).catch(error => {
+        console.error('Failed to update return aggregate:', error);
+      });
+    }
+
     // Log the validation for audit purposes
     try {
       const { default: AutomationLog } = await import("@/models/AutomationLog");
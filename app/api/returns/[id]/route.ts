@@ -5,6 +5,7 @@ import Return from "@/models/Return";
 import AutomationLog from "@/models/AutomationLog";
 import QRCode from "qrcode";
 import { processReturnWithML } from "@/lib/mlPredictionService";
+import { recordStatusChange } from "@/lib/returnAggregateStore";
 
 export async function PATCH(req: NextRequest, { params }: { params: Promise<{ id: string }> }) {
   try {
@@ -71,9 +72,14 @@ export async function PATCH(req: NextRequest, { params }: { params: Promise<{ id
     }
 
     // Update the status
+    const previousStatus = returnRequest.status;
     returnRequest.status = status;
     const updated = await returnRequest.save();
 
+    await recordStatusChange(returnRequest.userId, previousStatus, status).catch(error => {
+      console.error('Failed to update return aggregate:', error);
+    });
+
     await AutomationLog.create({
       workflowId: `return_status_${status}`,
       returnId: id,
@@ -6,6 +6,7 @@ import AutomationLog from "@/models/AutomationLog";
 import Order from "@/models/Order";
 import QRCode from "qrcode";
 import { processReturnWithML } from "@/lib/mlPredictionService";
+import { recordReturnCreated } from "@/lib/returnAggregateStore";
 
 // Async function to trigger AI validation
 async function triggerAIValidation(returnId: string, imageUrl: string, description: string) {
@@ -132,11 +133,6 @@ export async function POST(req: NextRequest) {
       console.log("Starting Python ML validation for:", { reason, description });
 
       try {
-        // Get user's return history for ML analysis
-        const userReturns = await Return.find({ userId: session.userId })
-          .sort({ createdAt: -1 })
-          .limit(10); // Get last 10 returns for ML analysis
-
         // Create new return object for ML prediction
         const newReturnData = {
           reason,
@@ -191,6 +187,11 @@ export async function POST(req: NextRequest) {
       validationStatus: "pending",
     });
 
+    // Keep the user's return aggregate (used for fraud scoring) current
+    await recordReturnCreated(returnRequest).catch(error => {
+      console.error('Failed to update return aggregate:', error);
+    });
+
     // Log automation event
     await AutomationLog.create({
       workflowId: "return_request_created",
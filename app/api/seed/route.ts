@@ -1,4 +1,5 @@
 import { NextResponse } from "next/server";
+import mongoose from "mongoose";
 import bcrypt from "bcryptjs";
 import { connectDB } from "@/lib/mongodb";
 import User from "@/models/User";
@@ -6,6 +7,7 @@ import Order from "@/models/Order";
 import Return from "@/models/Return";
 import Inventory from "@/models/Inventory";
 import AutomationLog from "@/models/AutomationLog";
+import { recordReturnCreated } from "@/lib/returnAggregateStore";
 
 export async function POST(request: Request) {
   try {
@@ -42,6 +44,7 @@ export async function POST(request: Request) {
       await Order.deleteMany({});
       await Return.deleteMany({});
       await AutomationLog.deleteMany({});
+      await mongoose.connection.db!.collection("returnaggregates").deleteMany({});
       console.log("Cleared existing data for reseeding");
     }
 
@@ -189,6 +192,10 @@ export async function POST(request: Request) {
       },
     ]);
 
+    for (const returnDoc of returns) {
+      await recordReturnCreated(returnDoc);
+    }
+
     // Create demo inventory for all products
     await Inventory.insertMany([
       { 
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the fraud scoring hot path
+
+Times feature extraction (pandas and NumPy paths), scaling, prediction and
+end-to-end score_return against synthetic histories of growing size, and
+reports p50/p95/p99 latency plus peak memory per stage.
+
+Runs offline: when the model artifacts can't be loaded (e.g. no
+return_fraud_model.pkl), a stub linear NumPy kernel is used instead.
+
+Usage:
+    python benchmark_fraud_predictor.py
+    python benchmark_fraud_predictor.py --sizes 0 10 100 --repeats 500 --output bench.json
+    python benchmark_fraud_predictor.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from return_feature_store import utc_now
+from return_fraud_predictor import FEATURE_COLUMNS, ReturnFraudPredictor
+
+DEFAULT_SIZES = [0, 10, 100, 1000, 10000]
+
+REASONS = ['wrong_size', 'wrong_color', 'defective', 'wrong_item', 'damaged_shipping',
+           'quality_issue', 'not_as_described', 'changed_mind']
+STATUSES = ['pending', 'approved', 'rejected', 'completed', 'refund_initiated']
+
+def make_history(size: int, seed: int) -> List[Dict[str, Any]]:
+    """Synthetic return history shaped like getUserHistoricalReturns output"""
+    rng = random.Random(seed)
+    now = utc_now()
+    return [{
+        'price': rng.randint(299, 14999),
+        'reason': rng.choice(REASONS),
+        'description': 'x' * rng.randint(0, 120),
+        'imageUrl': rng.choice(['', 'https://example.com/return.jpg']),
+        'status': rng.choice(STATUSES),
+        'fraudFlag': rng.random() < 0.1,
+        'createdAt': (now - timedelta(days=rng.uniform(0, 720))).isoformat(),
+    } for _ in range(size)]
+
+def write_stub_kernel(path: str):
+    """Linear NumPy kernel with fixed weights, so no sklearn or pickles are needed"""
+    rng = np.random.default_rng(0)
+    n_features = len(FEATURE_COLUMNS)
+    np.savez(
+        path,
+        kind=np.asarray("linear"),
+        version=np.asarray("benchmark-stub"),
+        feature_columns=np.asarray(FEATURE_COLUMNS),
+        scaler_mean=np.zeros(n_features),
+        scaler_scale=np.full(n_features, 1000.0),
+        coef=rng.normal(0, 0.1, n_features),
+        intercept=np.asarray(-1.0),
+    )
+
+def load_predictor(force_stub: bool, stub_dir: str):
+    """Real artifacts when available, otherwise the stub kernel"""
+    predictor, model_kind = None, "real"
+    if not force_stub:
+        try:
+            predictor = ReturnFraudPredictor()
+        except Exception as e:
+            print(f"⚠️  Real model unavailable ({e}); using stub model", file=sys.stderr)
+
+    if predictor is None:
+        kernel_path = os.path.join(stub_dir, "stub_kernel.npz")
+        write_stub_kernel(kernel_path)
+        predictor, model_kind = ReturnFraudPredictor(kernel_path=kernel_path), "stub"
+
+    # Measure the real work, not FRAUD_SCORE_CACHE hits
+    predictor.score_cache = None
+    return predictor, model_kind
+
+def time_calls(func: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    """Latency percentiles in milliseconds over `repeats` calls"""
+    func()  # warm up caches and lazy imports
+    samples = np.empty(repeats)
+    for i in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples[i] = time.perf_counter() - started
+    samples *= 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples, 95)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+    }
+
+def peak_memory_kb(func: Callable[[], Any]) -> float:
+    """Peak Python heap allocated by one call"""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+def benchmark_size(predictor: ReturnFraudPredictor, size: int, repeats: int) -> Dict[str, Any]:
+    new_return = {'price': 2499, 'reason': 'defective',
+                  'description': 'Seam split on first wear', 'imageUrl': 'https://example.com/r.jpg'}
+    history = make_history(size, seed=size)
+    features = predictor.extract_feature_vector(new_return, history).reshape(1, -1)
+    scaled = predictor.scale_features(features)
+
+    # Big histories make the pandas path slow; fewer repeats keep runs short
+    pandas_repeats = max(10, repeats // 10) if size >= 1000 else repeats
+    stages = {
+        "extract_pandas": (lambda: predictor.extract_features(new_return, history), pandas_repeats),
+        "extract_numpy": (lambda: predictor.extract_feature_vector(new_return, history), repeats),
+        "scale": (lambda: predictor.scale_features(features), repeats),
+        "predict": (lambda: predictor.model.predict_proba(scaled), repeats),
+        "score_return": (lambda: predictor.score_return(new_return, history), repeats),
+    }
+
+    results = {}
+    for stage, (func, stage_repeats) in stages.items():
+        results[stage] = time_calls(func, stage_repeats)
+        results[stage]["repeats"] = stage_repeats
+        results[stage]["peak_memory_kb"] = peak_memory_kb(func)
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> int:
+    """Print p50 ratios against a baseline run; returns the number of regressions"""
+    regressions = 0
+    print(f"\n📊 Comparison with {baseline.get('commit', 'baseline')} (p50, regression if > {threshold:.2f}x):")
+    for size, stages in current["results"].items():
+        for stage, stats in stages.items():
+            before = baseline.get("results", {}).get(size, {}).get(stage)
+            if not before or not before.get("p50_ms"):
+                continue
+            ratio = stats["p50_ms"] / before["p50_ms"]
+            marker = "❌" if ratio > threshold else "  "
+            regressions += ratio > threshold
+            print(f" {marker} history={size:>6} {stage:<15} {before['p50_ms']:>10.4f} -> {stats['p50_ms']:>10.4f} ms ({ratio:.2f}x)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fraud scoring hot path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="History sizes to benchmark")
+    parser.add_argument("--repeats", type=int, default=200, help="Timed calls per stage (default: 200)")
+    parser.add_argument("--stub", action="store_true", help="Always use the stub model")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="With --compare, p50 slowdown ratio counted as a regression (default: 1.2)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as stub_dir:
+        predictor, model_kind = load_predictor(args.stub, stub_dir)
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "model": model_kind,
+            "model_version": predictor.model_version,
+            "results": {},
+        }
+
+        print(f"🚀 Benchmarking fraud scoring ({model_kind} model, commit {report['commit']})")
+        print("-" * 50)
+        for size in args.sizes:
+            results = benchmark_size(predictor, size, args.repeats)
+            report["results"][str(size)] = results
+            print(f"\nHistory size {size}:")
+            for stage, stats in results.items():
+                print(f"   {stage:<15} p50 {stats['p50_ms']:>9.4f} ms   p95 {stats['p95_ms']:>9.4f} ms   "
+                      f"p99 {stats['p99_ms']:>9.4f} ms   peak {stats['peak_memory_kb']:>9.1f} KB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Shared summary reports for the data generation and migration scripts
+
+A CollectionSummary is built in one streaming pass over the documents a
+script writes (worker processes build their own and merge them), or read
+back afterwards with a single $facet aggregation, so reports never need
+extra full-collection scans. Both produce the same JSON-ready dict:
+
+    {
+        "collection": "inventories",
+        "count": 1000000,
+        "sums": {"price": 4211337151},
+        "groups": {"category": {"jeans": 70312, ...}, "brand": {...}}
+    }
+
+Usage from a script:
+    summary = CollectionSummary("orders", sum_fields=["totalAmount"], group_fields=["status"])
+    summary.add(order)
+    report = summary.to_dict()
+    write_report("orders_report.json", report, run={"seed": 42})
+"""
+
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+class CollectionSummary:
+    """Document count, per-field sums and per-field value counts, built incrementally"""
+
+    def __init__(self, collection: str, sum_fields: Iterable[str] = (), group_fields: Iterable[str] = ()):
+        self.collection = collection
+        self.count = 0
+        self.sums: Dict[str, float] = {field: 0 for field in sum_fields}
+        self.groups: Dict[str, Counter] = {field: Counter() for field in group_fields}
+
+    def add(self, doc: Dict[str, Any]):
+        self.count += 1
+        for field in self.sums:
+            value = doc.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.sums[field] += value
+        for field, counts in self.groups.items():
+            counts[_group_key(doc.get(field))] += 1
+
+    def merge(self, other: "CollectionSummary") -> "CollectionSummary":
+        """Fold in a summary built elsewhere (e.g. by a worker process)"""
+        self.count += other.count
+        for field, value in other.sums.items():
+            self.sums[field] = self.sums.get(field, 0) + value
+        for field, counts in other.groups.items():
+            self.groups.setdefault(field, Counter()).update(counts)
+        return self
+
+    def to_dict(self, top: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Report dict; `top` limits a group to its N most common values"""
+        top = top or {}
+        return {
+            "collection": self.collection,
+            "count": self.count,
+            "sums": dict(self.sums),
+            "groups": {field: dict(counts.most_common(top.get(field))) for field, counts in self.groups.items()},
+        }
+
+def _group_key(value: Any) -> str:
+    return "null" if value is None else str(value)
+
+def facet_summary(collection, sum_fields: Iterable[str] = (), group_fields: Iterable[str] = (),
+                  top: Optional[Dict[str, int]] = None, match: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Same report as CollectionSummary.to_dict, from one $facet aggregation"""
+    sum_fields, group_fields, top = list(sum_fields), list(group_fields), top or {}
+
+    totals = {"_id": None, "count": {"$sum": 1}}
+    totals.update({f"sum_{i}": {"$sum": f"${field}"} for i, field in enumerate(sum_fields)})
+    facets: Dict[str, List[Dict[str, Any]]] = {"totals": [{"$group": totals}]}
+    for i, field in enumerate(group_fields):
+        stages = [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+        if top.get(field):
+            stages.append({"$limit": top[field]})
+        facets[f"group_{i}"] = stages
+
+    pipeline = ([{"$match": match}] if match else []) + [{"$facet": facets}]
+    result = next(iter(collection.aggregate(pipeline, allowDiskUse=True)), {})
+    row = (result.get("totals") or [{}])[0]
+
+    return {
+        "collection": collection.name,
+        "count": row.get("count", 0),
+        "sums": {field: row.get(f"sum_{i}", 0) for i, field in enumerate(sum_fields)},
+        "groups": {
+            field: {_group_key(group["_id"]): group["count"] for group in result.get(f"group_{i}", [])}
+            for i, field in enumerate(group_fields)
+        },
+    }
+
+def write_report(path: str, report: Dict[str, Any], run: Optional[Dict[str, Any]] = None):
+    """Atomically write a report as JSON, with optional run metadata"""
+    document = {"generatedAt": datetime.now().isoformat(), **({"run": run} if run else {}), **report}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, default=str)
+    os.replace(tmp_path, path)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Create the indexes the hot query paths need, and check that they are used
+
+INDEXES declares the indexes per collection and TARGET_QUERIES the queries
+they exist for: SKU lookups, a user's returns and orders by date (fraud
+scoring, trust scores, order history), unpriced returns in _id order (price
+migration) and order lookups by _id. Creating is idempotent; an index whose
+keys already exist is left alone. Each target query is then explained and
+reported as an index scan or a collection scan.
+
+Usage:
+    python create_indexes.py              # create missing indexes, then check the queries
+    python create_indexes.py --check      # only explain the target queries
+    python create_indexes.py --dry-run    # list the indexes that would be created
+Exits with status 1 if a target query would scan a whole collection.
+"""
+
+import argparse
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from mongo_pool import MONGODB_URI, close_client, get_db
+from update_returns_prices import UNPRICED_QUERY
+
+# Key lists plus IndexModel options, per collection
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "inventories": [
+        {"key": [("sku", ASCENDING)], "unique": True},
+    ],
+    "returns": [
+        # A user's returns in either date order, and the rescoring scan (userId, createdAt)
+        {"key": [("userId", ASCENDING), ("createdAt", ASCENDING)]},
+        # Unpriced returns: UNPRICED_QUERY matches missing, null and 0 prices
+        {"key": [("price", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "orders": [
+        {"key": [("userId", ASCENDING), ("orderDate", ASCENDING)]},
+    ],
+}
+
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+
+# (description, collection, filter, sort)
+TARGET_QUERIES: List[Tuple[str, str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ("inventory item by SKU", "inventories", {"sku": "SAMPLE-SKU"}, None),
+    ("active inventory in SKU order", "inventories", {"isActive": True, "stock": {"$gt": 0}}, [("sku", ASCENDING)]),
+    ("user's returns, newest first", "returns", {"userId": _SAMPLE_ID}, [("createdAt", DESCENDING)]),
+    ("all returns by user and date", "returns", {}, [("userId", ASCENDING), ("createdAt", ASCENDING)]),
+    ("unpriced returns in _id order", "returns", UNPRICED_QUERY, [("_id", ASCENDING)]),
+    ("user's orders, newest first", "orders", {"userId": _SAMPLE_ID}, [("orderDate", DESCENDING)]),
+    ("orders by _id batch", "orders", {"_id": {"$in": [_SAMPLE_ID]}}, None),
+]
+
+INDEX_SCAN_STAGES = {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_IDHACK", "EXPRESS_CLUSTERED_IXSCAN"}
+
+def index_name(key: List[Tuple[str, int]]) -> str:
+    """MongoDB's default name for an index key, e.g. userId_1_createdAt_1"""
+    return "_".join(f"{field}_{direction}" for field, direction in key)
+
+def ensure_indexes(db, collections: Optional[Iterable[str]] = None,
+                   dry_run: bool = False) -> List[Tuple[str, str, str]]:
+    """Create the declared indexes that don't exist yet.
+
+    Returns (collection, index name, status) tuples; status is "created",
+    "exists", "missing" (dry run) or a description of a conflicting index.
+    """
+    results = []
+    for name in collections or INDEXES:
+        collection = db[name]
+        existing = {tuple(tuple(key) for key in info["key"]): info for info in collection.index_information().values()}
+        to_create = []
+        for spec in INDEXES.get(name, []):
+            key = [tuple(key) for key in spec["key"]]
+            options = {option: value for option, value in spec.items() if option != "key"}
+            current = existing.get(tuple(key))
+            if current is not None:
+                differing = {option: value for option, value in options.items() if current.get(option) != value}
+                status = "exists" if not differing else f"exists as {current.get('name', '?')} without {differing}"
+                results.append((name, index_name(key), status))
+            elif dry_run:
+                results.append((name, index_name(key), "missing"))
+            else:
+                to_create.append(IndexModel(key, name=index_name(key), **options))
+        if to_create:
+            collection.create_indexes(to_create)
+            results.extend((name, model.document["name"], "created") for model in to_create)
+    return results
+
+def _plan_stages(plan: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+    """(stage, index name) for every stage of a winning plan, outermost first"""
+    stages = [(plan["stage"], plan.get("indexName"))] if "stage" in plan else []
+    children = [plan[key] for key in ("inputStage", "queryPlan") if key in plan]
+    children += plan.get("inputStages", [])
+    children += [shard.get("winningPlan", shard) for shard in plan.get("shards", [])]
+    for child in children:
+        stages.extend(_plan_stages(child))
+    return stages
+
+def explain_query(collection, query: Dict[str, Any], sort: Optional[List[Tuple[str, int]]] = None) -> Dict[str, Any]:
+    """Winning plan summary: scan ("IXSCAN", "COLLSCAN" or "EOF"), indexes and in-memory sort"""
+    explain = collection.find(query, sort=sort).explain()
+    stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+    names = [stage for stage, _ in stages]
+    if "COLLSCAN" in names:
+        scan = "COLLSCAN"
+    elif INDEX_SCAN_STAGES.intersection(names):
+        scan = "IXSCAN"
+    else:
+        scan = names[-1] if names else "UNKNOWN"
+    return {
+        "scan": scan,
+        "indexes": sorted({index for _, index in stages if index}),
+        "in_memory_sort": "SORT" in names,
+    }
+
+def check_queries(db) -> int:
+    """Explain every target query; returns how many scan a whole collection"""
+    collection_scans = 0
+    for description, name, query, sort in TARGET_QUERIES:
+        plan = explain_query(db[name], query, sort)
+        if plan["scan"] == "COLLSCAN":
+            collection_scans += 1
+            marker = "❌"
+        else:
+            marker = "✅" if plan["scan"] == "IXSCAN" else "⚠️ "
+        detail = f" via {', '.join(plan['indexes'])}" if plan["indexes"] else ""
+        if plan["scan"] == "EOF":
+            detail = " (collection is empty)"
+        sort_note = ", in-memory SORT" if plan["in_memory_sort"] else ""
+        print(f"   {marker} {name}: {description} - {plan['scan']}{detail}{sort_note}")
+    return collection_scans
+
+def main():
+    parser = argparse.ArgumentParser(description="Create indexes for the hot query paths and explain the queries")
+    parser.add_argument("--check", action="store_true", help="Only explain the target queries")
+    parser.add_argument("--dry-run", action="store_true", help="List missing indexes without creating them")
+    parser.add_argument("--collections", nargs="+", choices=sorted(INDEXES),
+                        help="Limit index creation to these collections")
+    args = parser.parse_args()
+
+    try:
+        db = get_db()
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        if not args.check:
+            print(f"\n🔧 Indexes{' (dry run)' if args.dry_run else ''}:")
+            for name, index, status in ensure_indexes(db, args.collections, args.dry_run):
+                marker = {"created": "✅", "exists": "  ", "missing": "➕"}.get(status, "⚠️ ")
+                print(f"   {marker} {name}.{index}: {status}")
+
+        print("\n🔎 Query plans:")
+        collection_scans = check_queries(db)
+        if collection_scans:
+            print(f"\n❌ {collection_scans} target queries scan a whole collection")
+            sys.exit(1)
+        print("\n✅ No target query needs a collection scan")
+
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+if __name__ == "__main__":
+    main()
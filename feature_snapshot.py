@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Columnar feature snapshots of db.returns for bulk scoring and analysis
+
+A snapshot directory holds one .npy file per column: every feature in
+feature_columns order, plus _id and userId (12-byte ObjectIds as uint8
+rows), fraudFlag (the label) and createdAt (datetime64[us]), with a
+manifest.json listing the columns, row count and createdAt watermark.
+Each row holds a return's features as of when it was made (see
+FeatureExtractor.extract_point_in_time_matrix). Rows are grouped by
+user, in createdAt order within each user.
+
+Every column opens with np.load(..., mmap_mode="r"), so slicing millions
+of rows reads only the pages touched, without copies:
+
+    snapshot = FeatureSnapshot("snapshots/features")
+    amounts = snapshot["return_amount"][1_000_000:2_000_000]
+    for start, features in snapshot.iter_feature_blocks(100_000):
+        predictor.score_feature_matrix(features)
+
+`append` adds the returns created at or after the watermark that aren't
+in the snapshot yet (rows at the watermark itself are matched on _id, so
+returns sharing its timestamp are neither lost nor duplicated). Their features
+still use each user's full history. The new rows are appended in place;
+NumPy pads .npy headers so the row count can grow. The manifest is
+written last, so an interrupted append leaves the snapshot at its
+previous row count and is repaired by the next append.
+
+Usage:
+    python feature_snapshot.py export [--dir snapshots/features]
+    python feature_snapshot.py append [--dir snapshots/features]
+    python feature_snapshot.py info [--dir snapshots/features]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from numpy.lib import format as npy_format
+
+from mongo_pool import MONGODB_URI, close_client, get_db
+from rescore_returns import RETURN_PROJECTION, iter_user_chunks
+from return_feature_store import parse_created_at
+from return_fraud_predictor import FEATURE_COLUMNS, FeatureExtractor
+
+DEFAULT_SNAPSHOT_DIR = os.path.join("snapshots", "features")
+MANIFEST_FILENAME = "manifest.json"
+FORMAT_VERSION = 1
+
+# Columns stored next to the features: name -> (dtype, shape of one row)
+KEY_COLUMNS = {
+    "_id": ("u1", (12,)),
+    "userId": ("u1", (12,)),
+    "fraudFlag": ("?", ()),
+    "createdAt": ("M8[us]", ()),
+}
+
+def _column_path(snapshot_dir: str, name: str) -> str:
+    return os.path.join(snapshot_dir, f"{name}.npy")
+
+def _object_ids(values: List[Any], field: str) -> np.ndarray:
+    if not all(isinstance(value, ObjectId) for value in values):
+        raise ValueError(f"every return's {field} must be an ObjectId to be stored in a snapshot")
+    return np.frombuffer(b"".join(value.binary for value in values), dtype=np.uint8).reshape(-1, 12)
+
+def _created_at(values: List[Any]) -> np.ndarray:
+    parsed = [parse_created_at(value) for value in values]
+    return np.array([value if value is not None else "NaT" for value in parsed], dtype="M8[us]")
+
+def append_column(path: str, values: np.ndarray, committed_rows: int):
+    """Append rows to a .npy file in place, dropping anything past committed_rows first"""
+    with open(path, "r+b") as f:
+        if npy_format.read_magic(f) != (1, 0):
+            raise RuntimeError(f"{path}: expected a version 1.0 .npy file")
+        shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        data_offset = f.tell()
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+        values = np.ascontiguousarray(values, dtype=dtype)
+
+        f.seek(data_offset + committed_rows * row_bytes)
+        f.truncate()
+        f.write(values.tobytes())
+
+        f.seek(0)
+        header = {"descr": npy_format.dtype_to_descr(dtype), "fortran_order": fortran_order,
+                  "shape": (committed_rows + len(values),) + tuple(shape[1:])}
+        npy_format.write_array_header_1_0(f, header)
+        if f.tell() != data_offset:
+            raise RuntimeError(f"{path}: the .npy header has no room to grow; re-export the snapshot")
+
+def _create_column(path: str, dtype: str, row_shape: Tuple[int, ...]):
+    np.save(path, np.empty((0,) + row_shape, dtype=dtype))
+
+class FeatureSnapshot:
+    """Read-only, memory-mapped view of a snapshot directory"""
+
+    def __init__(self, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.rows: int = self.manifest["rows"]
+        self.feature_columns: List[str] = self.manifest["feature_columns"]
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """One column as a read-only memmap; rows past the manifest's count are ignored"""
+        if name not in self._columns:
+            if name not in self.manifest["columns"]:
+                raise KeyError(name)
+            self._columns[name] = np.load(_column_path(self.snapshot_dir, name), mmap_mode="r")[:self.rows]
+        return self._columns[name]
+
+    def feature_matrix(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Rows [start, stop) as a (rows, features) matrix in feature_columns order"""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        matrix = np.empty((max(stop - start, 0), len(self.feature_columns)), dtype=np.float64)
+        for position, name in enumerate(self.feature_columns):
+            matrix[:, position] = self[name][start:stop]
+        return matrix
+
+    def iter_feature_blocks(self, block_rows: int = 100000) -> Iterator[Tuple[int, np.ndarray]]:
+        """(first row, feature matrix) blocks, for scoring a snapshot in bounded memory"""
+        for start in range(0, self.rows, block_rows):
+            yield start, self.feature_matrix(start, start + block_rows)
+
+    def object_ids(self, name: str, start: int = 0, stop: Optional[int] = None) -> List[ObjectId]:
+        """Decode an ObjectId column (_id or userId) for a row range"""
+        return [ObjectId(row.tobytes()) for row in self[name][start:stop]]
+
+    def ids_created_at(self, moment: np.datetime64) -> set:
+        """_ids of the rows created at exactly `moment`"""
+        return {ObjectId(self["_id"][row].tobytes()) for row in np.flatnonzero(self["createdAt"] == moment)}
+
+class SnapshotWriter:
+    """Appends row blocks to a snapshot's column files and commits them in the manifest"""
+
+    def __init__(self, snapshot_dir: str, manifest: Dict[str, Any]):
+        self.snapshot_dir = snapshot_dir
+        self.manifest = manifest
+        self.rows = manifest["rows"]
+
+    @classmethod
+    def create(cls, snapshot_dir: str, feature_columns: List[str], source: Dict[str, Any]) -> "SnapshotWriter":
+        os.makedirs(snapshot_dir, exist_ok=True)
+        columns = {name: {"dtype": "f8", "shape": []} for name in feature_columns}
+        columns.update({name: {"dtype": dtype, "shape": list(shape)} for name, (dtype, shape) in KEY_COLUMNS.items()})
+        for name, spec in columns.items():
+            _create_column(_column_path(snapshot_dir, name), spec["dtype"], tuple(spec["shape"]))
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "feature_columns": list(feature_columns),
+            "columns": columns,
+            "rows": 0,
+            "watermark": None,
+            "source": source,
+            "created_at": datetime.now().isoformat(),
+        }
+        writer = cls(snapshot_dir, manifest)
+        writer.commit()
+        return writer
+
+    @classmethod
+    def open(cls, snapshot_dir: str) -> "SnapshotWriter":
+        with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            return cls(snapshot_dir, json.load(f))
+
+    def append(self, features: np.ndarray, returns: List[Dict[str, Any]]):
+        """Append feature rows and the key columns of the returns they came from"""
+        values = {name: features[:, position] for position, name in enumerate(self.manifest["feature_columns"])}
+        values["_id"] = _object_ids([return_doc.get("_id") for return_doc in returns], "_id")
+        values["userId"] = _object_ids([return_doc.get("userId") for return_doc in returns], "userId")
+        values["fraudFlag"] = np.array([bool(return_doc.get("fraudFlag")) for return_doc in returns])
+        values["createdAt"] = _created_at([return_doc.get("createdAt") for return_doc in returns])
+
+        for name in self.manifest["columns"]:
+            append_column(_column_path(self.snapshot_dir, name), values[name], self.rows)
+        self.rows += len(returns)
+
+        created = values["createdAt"][~np.isnat(values["createdAt"])]
+        if len(created):
+            latest = str(created.max())
+            if self.manifest["watermark"] is None or latest > self.manifest["watermark"]:
+                self.manifest["watermark"] = latest
+
+    def commit(self):
+        """Atomically publish the appended rows"""
+        self.manifest["rows"] = self.rows
+        self.manifest["updated_at"] = datetime.now().isoformat()
+        path = os.path.join(self.snapshot_dir, MANIFEST_FILENAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+def _user_histories(returns_collection, user_ids: List[Any]) -> Iterator[List[Dict[str, Any]]]:
+    """Full return histories of some users, one sorted list per user"""
+    cursor = returns_collection.find({"userId": {"$in": user_ids}}, RETURN_PROJECTION,
+                                     sort=[("userId", 1), ("createdAt", 1)])
+    current: List[Dict[str, Any]] = []
+    for return_doc in cursor:
+        if current and return_doc.get("userId") != current[0].get("userId"):
+            yield current
+            current = []
+        current.append(return_doc)
+    if current:
+        yield current
+
+def _is_new(return_doc: Dict[str, Any], watermark_at: datetime, seen_ids: set) -> bool:
+    created_at = parse_created_at(return_doc.get("createdAt"))
+    return created_at is not None and created_at >= watermark_at and return_doc.get("_id") not in seen_ids
+
+def export_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, chunk_size: int = 5000):
+    """Write a new snapshot of every return, replacing snapshot_dir"""
+    try:
+        db = get_db()
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        tmp_dir = snapshot_dir.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        extractor = FeatureExtractor(FEATURE_COLUMNS)
+        writer = SnapshotWriter.create(tmp_dir, extractor.feature_columns, {"database": db.name})
+        started = time.perf_counter()
+
+        for user_groups, _ in iter_user_chunks(db.returns, chunk_size):
+            returns = [return_doc for group in user_groups for return_doc in group]
+            features = np.empty((len(returns), len(extractor.feature_columns)), dtype=np.float64)
+            row = 0
+            for group in user_groups:
+                extractor.extract_point_in_time_matrix(group, out=features[row:row + len(group)])
+                row += len(group)
+            writer.append(features, returns)
+            elapsed = time.perf_counter() - started
+            print(f"   Exported {writer.rows:,} returns - {writer.rows / elapsed:,.0f} returns/sec")
+        writer.commit()
+
+        # Swap the finished snapshot in; readers never see a partial export,
+        # and the old one is only removed once the new one is in place
+        old_dir = snapshot_dir.rstrip(os.sep) + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(snapshot_dir):
+            os.replace(snapshot_dir, old_dir)
+        os.replace(tmp_dir, snapshot_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        print(f"\n✅ Exported {writer.rows} returns to {snapshot_dir} (watermark {writer.manifest['watermark']})")
+
+    except Exception as e:
+        print(f"❌ Error exporting feature snapshot: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+def append_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, chunk_size: int = 5000):
+    """Append the returns created at or after the snapshot's watermark that it doesn't hold yet"""
+    try:
+        db = get_db()
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        writer = SnapshotWriter.open(snapshot_dir)
+        watermark = writer.manifest["watermark"]
+        if watermark is None:
+            print("⚠️  The snapshot has no createdAt watermark; run export instead")
+            return
+        watermark_at = datetime.fromisoformat(watermark)
+        # Returns sharing the watermark's timestamp may have landed after the
+        # last append, so that instant is re-read and deduplicated on _id
+        seen_ids = FeatureSnapshot(snapshot_dir).ids_created_at(np.datetime64(watermark))
+        extractor = FeatureExtractor(writer.manifest["feature_columns"])
+        started = time.perf_counter()
+        rows_before = writer.rows
+
+        new_users = db.returns.distinct("userId", {"createdAt": {"$gte": watermark_at}})
+        for offset in range(0, len(new_users), max(1, chunk_size // 10)):
+            returns, blocks = [], []
+            for history in _user_histories(db.returns, new_users[offset:offset + max(1, chunk_size // 10)]):
+                matrix = extractor.extract_point_in_time_matrix(history)
+                new_rows = [position for position, return_doc in enumerate(history)
+                            if _is_new(return_doc, watermark_at, seen_ids)]
+                returns.extend(history[position] for position in new_rows)
+                blocks.append(matrix[new_rows])
+            if returns:
+                writer.append(np.concatenate(blocks), returns)
+            elapsed = time.perf_counter() - started
+            print(f"   Appended {writer.rows - rows_before:,} returns - "
+                  f"{(writer.rows - rows_before) / elapsed:,.0f} returns/sec")
+        writer.commit()
+
+        print(f"\n✅ Appended {writer.rows - rows_before} returns to {snapshot_dir} "
+              f"({writer.rows} total, watermark {writer.manifest['watermark']})")
+
+    except Exception as e:
+        print(f"❌ Error appending to feature snapshot: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+def print_info(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+    snapshot = FeatureSnapshot(snapshot_dir)
+    size = sum(os.path.getsize(_column_path(snapshot_dir, name)) for name in snapshot.manifest["columns"])
+    labels = snapshot["fraudFlag"]
+    print(f"📦 {snapshot_dir}: {len(snapshot):,} returns, {len(snapshot.feature_columns)} features, "
+          f"{size / (1024 * 1024):.1f} MB")
+    print(f"   Watermark: {snapshot.manifest['watermark']}")
+    print(f"   Fraud flagged: {int(np.count_nonzero(labels)):,}")
+    print(f"   Updated: {snapshot.manifest.get('updated_at')}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export returns' point-in-time features as a columnar snapshot")
+    parser.add_argument("command", choices=["export", "append", "info"],
+                        help="export a new snapshot, append returns after the watermark, or describe a snapshot")
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help=f"Snapshot directory (default: {DEFAULT_SNAPSHOT_DIR})")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Returns read per chunk (default: 5000)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.dir, max(1, args.chunk_size))
+    elif args.command == "append":
+        append_snapshot(args.dir, max(1, args.chunk_size))
+    else:
+        print_info(args.dir)
@@ -1,22 +1,44 @@
 #!/usr/bin/env python3
 """
 Script to generate 500+ fashion inventory items with realistic data
+
+Each product is expanded into its full size x color variant grid, and every
+variant gets a SKU built from the product number, color and size, so SKUs
+never collide. Products are generated from per-product RNGs seeded from
+(seed, product number), and chunks of products are generated and inserted
+in batches by a pool of worker processes. The same --seed and --count
+always produce the same inventory, whatever --workers is.
+
+By default the collection is cleared and refilled. With --sync the
+generated inventory is diffed against the existing collection by SKU and
+only new items, changed fields and deactivations of SKUs that are no
+longer generated are written, so the inventory stays readable throughout.
+
+Usage:
+    python generate_inventory.py
+    python generate_inventory.py --count 1000000 --workers 8 --seed 42
+    python generate_inventory.py --count 1000000 --seed 42 --sync [--dry-run]
+    python generate_inventory.py --count 100000 --report-json inventory_report.json
 """
 
+import argparse
+import bisect
+import hashlib
 import os
 import sys
 import json
 import random
+import time
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from typing import Any, Dict, Iterator, List, Tuple
+from pymongo import UpdateOne
 
-# Load environment variables
-load_dotenv()
-
-# MongoDB connection
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/vector_returns")
-DB_NAME = MONGODB_URI.split("/")[-1] if "/" in MONGODB_URI else "vector_returns"
+from collection_report import CollectionSummary, facet_summary, write_report
+from create_indexes import ensure_indexes
+from mongo_pool import MONGODB_URI, BulkWriter, close_client, get_db, write_with_retry
 
 # Fashion data
 BRANDS = [
@@ -143,42 +165,86 @@ TAGS = [
     "versatile", "essential", "premium", "luxury", "affordable", "popular", "featured"
 ]
 
-def generate_sku(category, brand, color, size):
-    """Generate unique SKU"""
+def _unique_codes(names: List[str], length: int = 3) -> Dict[str, str]:
+    """Short upper-case codes per name, with a digit appended on prefix clashes"""
+    codes, used = {}, set()
+    for name in names:
+        base = name.replace(" ", "").upper()[:length]
+        code, suffix = base, 2
+        while code in used:
+            code, suffix = f"{base}{suffix}", suffix + 1
+        codes[name] = code
+        used.add(code)
+    return codes
+
+COLOR_CODES = _unique_codes(COLORS)
+
+# Colors per product; each product comes in every size of its category
+COLORS_PER_PRODUCT = (2, 4)
+
+DEFAULT_COUNT = 500
+
+# Summary fields, shared by the streamed and $facet reports
+REPORT_SUM_FIELDS = ["price"]
+REPORT_GROUP_FIELDS = ["category", "brand"]
+REPORT_TOP = {"brand": 10}
+
+# Fields compared by --sync; timestamps are excluded
+SYNC_FIELDS = [
+    "productName", "category", "subcategory", "brand", "size", "color", "material",
+    "price", "salePrice", "stock", "minStock", "season", "gender", "style",
+    "imageUrl", "tags", "isActive"
+]
+
+def generate_sku(category, brand, color, size, product_number):
+    """Generate a SKU; unique because (product number, color, size) is unique"""
     brand_code = brand[:3].upper()
     cat_code = category[:3].upper()
-    color_code = color[:3].upper()
+    color_code = COLOR_CODES.get(color, color[:3].upper())
     size_code = str(size).replace(" ", "").upper()
-    random_num = random.randint(1000, 9999)
-    return f"{brand_code}-{cat_code}-{color_code}-{size_code}-{random_num}"
+    return f"{brand_code}-{cat_code}-{color_code}-{size_code}-{product_number:06d}"
 
-def get_size_for_category(category):
+def get_sizes_for_category(category):
     """Get appropriate sizes for category"""
     if category in ["tshirt", "shirt", "hoodie", "sweater", "polo", "tanktop", "cardigan", "jacket", "blazer", "coat"]:
-        return random.choice(SIZES["tops"])
+        return SIZES["tops"]
     elif category in ["pants", "jeans", "shorts"]:
-        return random.choice(SIZES["bottoms"])
+        return SIZES["bottoms"]
     elif category in ["dress", "skirt"]:
-        return random.choice(SIZES["dresses"])
+        return SIZES["dresses"]
     else:
-        return random.choice(SIZES["one_size"])
+        return SIZES["one_size"]
 
-def generate_inventory_item(index):
-    """Generate a single inventory item"""
-    category = random.choice(list(CATEGORIES.keys()))
+def _product_rng(seed, product_number):
+    return random.Random(f"{seed}:{product_number}")
+
+def _draw_grid(rng):
+    """First draws of every product: its category and how many colors it comes in"""
+    category = rng.choice(list(CATEGORIES.keys()))
+    num_colors = rng.randint(*COLORS_PER_PRODUCT)
+    return category, num_colors
+
+def product_variant_count(seed, product_number):
+    """Number of variants a product expands to, without generating them"""
+    category, num_colors = _draw_grid(_product_rng(seed, product_number))
+    return len(get_sizes_for_category(category)) * num_colors
+
+def generate_product_variants(seed, product_number):
+    """Generate every size x color variant of one product"""
+    rng = _product_rng(seed, product_number)
+    category, num_colors = _draw_grid(rng)
     category_data = CATEGORIES[category]
     
-    brand = random.choice(BRANDS)
-    color = random.choice(COLORS)
-    size = get_size_for_category(category)
-    subcategory = random.choice(category_data["subcategory"])
-    material = random.choice(category_data["materials"])
-    style = random.choice(category_data["styles"])
-    gender = random.choice(GENDERS)
-    season = random.choice(SEASONS)
+    brand = rng.choice(BRANDS)
+    colors = rng.sample(COLORS, num_colors)
+    subcategory = rng.choice(category_data["subcategory"])
+    material = rng.choice(category_data["materials"])
+    style = rng.choice(category_data["styles"])
+    gender = rng.choice(GENDERS)
+    season = rng.choice(SEASONS)
     
     base_price_min, base_price_max = category_data["base_price"]
-    base_price = random.randint(base_price_min, base_price_max)
+    base_price = rng.randint(base_price_min, base_price_max)
     
     # Add price variation based on brand and material
     if brand in ["Gucci", "Prada", "Versace", "Tom Ford"]:
@@ -189,108 +255,263 @@ def generate_inventory_item(index):
     if material in ["cashmere", "silk", "leather", "wool"]:
         base_price = int(base_price * 1.3)
     
-    # Sale price (30% of items are on sale)
+    # Sale price (30% of products are on sale)
     sale_price = None
-    if random.random() < 0.3:
+    if rng.random() < 0.3:
         sale_price = int(base_price * 0.7)
     
-    # Stock levels
-    stock = random.randint(0, 200)
-    min_stock = random.randint(5, 20)
-    
     # Tags
-    num_tags = random.randint(2, 5)
-    item_tags = random.sample(TAGS, num_tags)
-    
-    # Product name
-    product_name = f"{brand} {subcategory.title()} {color} {category.title()}"
+    num_tags = rng.randint(2, 5)
+    item_tags = rng.sample(TAGS, num_tags)
     
     # Image URL (placeholder)
-    image_url = f"https://images.unsplash.com/photo-{random.randint(1000000000, 9999999999)}?w=400&h=500&fit=crop"
+    image_url = f"https://images.unsplash.com/photo-{rng.randint(1000000000, 9999999999)}?w=400&h=500&fit=crop"
     
-    return {
-        "productName": product_name,
-        "category": category,
-        "subcategory": subcategory,
-        "brand": brand,
-        "size": size,
-        "color": color,
-        "material": material,
-        "price": base_price,
-        "salePrice": sale_price,
-        "sku": generate_sku(category, brand, color, size),
-        "stock": stock,
-        "minStock": min_stock,
-        "season": season,
-        "gender": gender,
-        "style": style,
-        "imageUrl": image_url,
-        "tags": item_tags,
-        "isActive": stock > 0,
-        "createdAt": datetime.now(),
-        "updatedAt": datetime.now()
-    }
+    now = datetime.now()
+    variants = []
+    for color in colors:
+        # Product name
+        product_name = f"{brand} {subcategory.title()} {color} {category.title()}"
+        
+        for size in get_sizes_for_category(category):
+            # Stock levels
+            stock = rng.randint(0, 200)
+            min_stock = rng.randint(5, 20)
+            
+            variants.append({
+                "productName": product_name,
+                "category": category,
+                "subcategory": subcategory,
+                "brand": brand,
+                "size": size,
+                "color": color,
+                "material": material,
+                "price": base_price,
+                "salePrice": sale_price,
+                "sku": generate_sku(category, brand, color, size, product_number),
+                "stock": stock,
+                "minStock": min_stock,
+                "season": season,
+                "gender": gender,
+                "style": style,
+                "imageUrl": image_url,
+                "tags": item_tags,
+                "isActive": stock > 0,
+                "createdAt": now,
+                "updatedAt": now
+            })
+    
+    return variants
+
+def plan_chunks(seed, count, chunk_size) -> Iterator[Tuple[int, int]]:
+    """Yield (first product number, item count) tasks of whole products.
+
+    Only the very last product may be cut short, so the total is exactly count.
+    """
+    product_number = 0
+    remaining = count
+    while remaining > 0:
+        first_product, size = product_number, 0
+        while size < chunk_size and size < remaining:
+            size += product_variant_count(seed, product_number)
+            product_number += 1
+        size = min(size, remaining)
+        yield first_product, size
+        remaining -= size
 
-def generate_inventory():
-    """Generate 500+ inventory items"""
+# Set once per worker process by _init_worker
+_worker_state: Dict[str, Any] = {}
+
+def _init_worker(seed: int, batch_size: int, sync: bool = False, dry_run: bool = False):
+    """Set up the per-process client"""
+    _worker_state.update({
+        "collection": get_db().inventories,
+        "seed": seed,
+        "batch_size": batch_size,
+        "sync": sync,
+        "dry_run": dry_run,
+    })
+
+def sku_fingerprint(sku: str) -> int:
+    """64-bit hash of a SKU, so a run's SKU set fits in a compact array"""
+    return int.from_bytes(hashlib.blake2b(sku.encode("utf-8"), digest_size=8).digest(), "little")
+
+def sync_batch(collection, batch: List[Dict[str, Any]], dry_run: bool = False) -> Counter:
+    """Upsert only new and changed items of a batch, keyed on SKU.
+
+    Returns counts of inserted, updated and unchanged items.
+    """
+    skus = [item["sku"] for item in batch]
+    projection = {"_id": 0, "sku": 1, **{field: 1 for field in SYNC_FIELDS}}
+    existing = {doc["sku"]: doc for doc in collection.find({"sku": {"$in": skus}}, projection)}
+    
+    counts = Counter()
+    operations = []
+    for item in batch:
+        current = existing.get(item["sku"])
+        if current is None:
+            fields = {key: value for key, value in item.items() if key != "createdAt"}
+            operations.append(UpdateOne({"sku": item["sku"]},
+                                        {"$set": fields, "$setOnInsert": {"createdAt": item["createdAt"]}},
+                                        upsert=True))
+            counts["inserted"] += 1
+            continue
+        
+        changed = {field: item[field] for field in SYNC_FIELDS if current.get(field) != item[field]}
+        if changed:
+            changed["updatedAt"] = item["updatedAt"]
+            operations.append(UpdateOne({"sku": item["sku"]}, {"$set": changed}))
+            counts["updated"] += 1
+        else:
+            counts["unchanged"] += 1
+    
+    if operations and not dry_run:
+        write_with_retry(collection, operations)
+    return counts
+
+def deactivate_missing(collection, fingerprints: array, batch_size: int, dry_run: bool = False) -> int:
+    """Set isActive=false on active SKUs that the run didn't generate"""
+    generated = array("Q", sorted(fingerprints))
+    now = datetime.now()
+    deactivated = 0
+    writer = BulkWriter(collection, max_ops=batch_size)
+    
+    for doc in collection.find({"isActive": True}, {"_id": 0, "sku": 1}, batch_size=batch_size):
+        fingerprint = sku_fingerprint(doc["sku"])
+        position = bisect.bisect_left(generated, fingerprint)
+        if position < len(generated) and generated[position] == fingerprint:
+            continue
+        deactivated += 1
+        if not dry_run:
+            writer.update_one({"sku": doc["sku"]}, {"$set": {"isActive": False, "updatedAt": now}})
+    writer.flush()
+    return deactivated
+
+def generate_chunk(first_product: int, item_count: int) -> Tuple[Counter, array, CollectionSummary]:
+    """Generate item_count variants starting at first_product and write them.
+
+    Returns (change counts, SKU fingerprints, summary of the generated
+    items); fingerprints are only collected with --sync.
+    """
+    state = _worker_state
+    counts = Counter()
+    summary = CollectionSummary("inventories", REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+    fingerprints = array("Q")
+    writer = BulkWriter(state["collection"], max_ops=state["batch_size"])
+    batch = []
+    product_number = first_product
+    remaining = item_count
+    
+    while remaining > 0:
+        variants = generate_product_variants(state["seed"], product_number)[:remaining]
+        product_number += 1
+        remaining -= len(variants)
+        batch.extend(variants)
+        for item in variants:
+            summary.add(item)
+        
+        if len(batch) >= state["batch_size"] or (remaining <= 0 and batch):
+            if state["sync"]:
+                counts.update(sync_batch(state["collection"], batch, state["dry_run"]))
+                fingerprints.extend(sku_fingerprint(item["sku"]) for item in batch)
+            else:
+                for item in batch:
+                    writer.insert(item)
+            batch = []
+    
+    writer.flush()
+    counts["inserted"] += writer.counts["inserted"]
+    return counts, fingerprints, summary
+
+def generate_inventory(count: int = DEFAULT_COUNT, seed: int = None, workers: int = 1,
+                       chunk_size: int = 10000, batch_size: int = 1000, sync: bool = False, dry_run: bool = False,
+                       report_from: str = None, report_json: str = None):
+    """Generate `count` inventory items, replacing or (with sync) reconciling the collection.
+
+    The summary comes from the generated items (report_from="stream", the
+    default without sync) or from one $facet pass over the collection
+    ("facet", the default with sync).
+    """
+    report_from = report_from or ("facet" if sync else "stream")
     try:
         # Connect to MongoDB
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
+        db = get_db()
         
         print(f"Connected to MongoDB: {MONGODB_URI}")
         
-        # Clear existing inventory data
         inventory_collection = db.inventories
-        inventory_collection.delete_many({})
-        print("Cleared existing inventory data")
+        if sync:
+            print(f"Syncing inventory by SKU{' (dry run, nothing is written)' if dry_run else ''}")
+        else:
+            # Clear existing inventory data
+            inventory_collection.delete_many({})
+            print("Cleared existing inventory data")
+        if not dry_run:
+            ensure_indexes(db, ["inventories"])
         
-        # Generate inventory items
-        inventory_items = []
-        num_items = 500 + random.randint(0, 100)  # 500-600 items
+        if seed is None:
+            if sync:
+                print("⚠️  No --seed given; a random seed will replace most of the inventory")
+            seed = random.randrange(2 ** 32)
+        print(f"🎲 Seed: {seed} (rerun with --seed {seed} to reproduce)")
+        print(f"Generating {count} fashion inventory items...")
         
-        print(f"Generating {num_items} fashion inventory items...")
+        changes = Counter()
+        fingerprints = array("Q")
+        summary = CollectionSummary("inventories", REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+        started = time.perf_counter()
+        # Chunks in flight; bounded so memory doesn't grow with --count
+        in_flight = deque()
         
-        for i in range(num_items):
-            item = generate_inventory_item(i)
-            inventory_items.append(item)
-            
-            if (i + 1) % 100 == 0:
-                print(f"Generated {i + 1} items...")
+        def collect(future):
+            chunk_changes, chunk_fingerprints, chunk_summary = future.result()
+            changes.update(chunk_changes)
+            fingerprints.extend(chunk_fingerprints)
+            summary.merge(chunk_summary)
+            processed = sum(changes.values())
+            elapsed = time.perf_counter() - started
+            print(f"{'Synced' if sync else 'Inserted'} {processed:,}/{count:,} items - {processed / elapsed:,.0f} items/sec")
         
-        # Insert items in batches
-        batch_size = 100
-        for i in range(0, len(inventory_items), batch_size):
-            batch = inventory_items[i:i + batch_size]
-            inventory_collection.insert_many(batch)
-            print(f"Inserted batch {i//batch_size + 1}/{(len(inventory_items) + batch_size - 1)//batch_size}")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(seed, batch_size, sync, dry_run)) as pool:
+            for first_product, item_count in plan_chunks(seed, count, chunk_size):
+                in_flight.append(pool.submit(generate_chunk, first_product, item_count))
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
         
-        # Get statistics
-        total_items = inventory_collection.count_documents({})
-        total_value = list(inventory_collection.aggregate([
-            {"$group": {"_id": None, "totalValue": {"$sum": "$price"}}}
-        ]))[0]["totalValue"]
+        if sync:
+            changes["deactivated"] = deactivate_missing(inventory_collection, fingerprints, batch_size, dry_run)
+            print(f"\n🔄 Sync changes{' (dry run)' if dry_run else ''}:")
+            for kind in ["inserted", "updated", "unchanged", "deactivated"]:
+                print(f"   {kind}: {changes[kind]:,}")
         
-        category_counts = inventory_collection.aggregate([
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ])
+        elapsed = time.perf_counter() - started
         
-        brand_counts = inventory_collection.aggregate([
-            {"$group": {"_id": "$brand", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ])
+        # Get statistics
+        if report_from == "facet":
+            report = facet_summary(inventory_collection, REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS, REPORT_TOP)
+        else:
+            report = summary.to_dict(REPORT_TOP)
         
-        print(f"\n✅ Successfully generated {total_items} fashion inventory items!")
-        print(f"💰 Total inventory value: Rs.{total_value:,}")
+        print(f"\n✅ Successfully generated {report['count']} fashion inventory items!")
+        print(f"💰 Total inventory value: Rs.{report['sums']['price']:,}")
         print(f"\n📊 Category Distribution:")
-        for cat in category_counts:
-            print(f"   {cat['_id']}: {cat['count']} items")
+        for category, category_count in report["groups"]["category"].items():
+            print(f"   {category}: {category_count} items")
         
         print(f"\n🏷️ Top Brands:")
-        for brand in brand_counts:
-            print(f"   {brand['_id']}: {brand['count']} items")
+        for brand, brand_count in report["groups"]["brand"].items():
+            print(f"   {brand}: {brand_count} items")
+        
+        if report_json:
+            write_report(report_json, report, run={
+                "seed": seed, "count": count, "workers": workers, "sync": sync, "dryRun": dry_run,
+                "changes": dict(changes), "elapsedSeconds": round(elapsed, 3),
+                "itemsPerSecond": round(sum(changes.values()) / elapsed if elapsed else 0, 1),
+            })
+            print(f"\n💾 Report saved to {report_json}")
         
         print(f"\n🎉 Fashion inventory generation completed successfully!")
         
@@ -299,13 +520,33 @@ def generate_inventory():
         sys.exit(1)
     
     finally:
-        if 'client' in locals():
-            client.close()
+        close_client()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate fashion inventory items")
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT,
+                        help=f"Number of inventory items (variants) to generate (default: {DEFAULT_COUNT})")
+    parser.add_argument("--seed", type=int, help="Random seed; the same seed and count give the same inventory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Items generated per worker task (default: 10000)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Items per bulk write (default: 1000)")
+    parser.add_argument("--sync", action="store_true",
+                        help="Upsert changes by SKU instead of clearing and reinserting (use with --seed)")
+    parser.add_argument("--dry-run", action="store_true", help="With --sync, report the changes without writing them")
+    parser.add_argument("--report-from", choices=["stream", "facet"],
+                        help="Summarize the generated items as they stream, or the whole collection with one "
+                             "$facet query (default: stream, or facet with --sync)")
+    parser.add_argument("--report-json", metavar="PATH", help="Also write the summary report as JSON")
+    args = parser.parse_args()
+    
+    if args.dry_run and not args.sync:
+        parser.error("--dry-run requires --sync")
+    
     print("🚀 Starting fashion inventory generation...")
-    print(f"📅 Generating 500+ fashion inventory items")
+    print(f"📅 Generating {args.count} fashion inventory items")
     print(f"📍 MongoDB URI: {MONGODB_URI}")
     print("-" * 50)
     
-    generate_inventory()
+    generate_inventory(max(1, args.count), args.seed, max(1, args.workers),
+                       max(1, args.chunk_size), max(1, args.batch_size), args.sync, args.dry_run,
+                       args.report_from, args.report_json)
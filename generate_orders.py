@@ -1,23 +1,40 @@
 #!/usr/bin/env python3
 """
-Script to generate 100 random orders for all customers
+Script to generate random orders for all customers
+
+Orders are generated in blocks of SEED_BLOCK_SIZE, each with its own RNG
+seeded from (seed, block number), and chunks of whole blocks are streamed
+into unordered bulk insert batches from a pool of worker processes. The
+same --seed and --count always produce the same orders, whatever --workers
+and --chunk-size are.
+
+With --source inventory, products are drawn from the active SKUs in
+db.inventories (weighted by popularity tags, stock or uniformly) instead of
+the built-in catalog, and each chunk's sold quantities are decremented
+from stock with one bulk_write.
+
+Usage:
+    python generate_orders.py
+    python generate_orders.py --count 2000000 --workers 8 --seed 42
+    python generate_orders.py --count 50000 --start-date 2025-07-01 --end-date 2026-01-01
+    python generate_orders.py --count 100000 --source inventory --weight-by stock
+    python generate_orders.py --count 100000 --report-json orders_report.json
 """
 
+import argparse
 import os
 import sys
 import json
 import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from typing import Any, Dict, List, Tuple
 from bson import ObjectId
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
-
-# MongoDB connection
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/vector_returns")
-DB_NAME = MONGODB_URI.split("/")[-1] if "/" in MONGODB_URI else "vector_returns"
+from collection_report import CollectionSummary, facet_summary, write_report
+from mongo_pool import MONGODB_URI, BulkWriter, close_client, get_db
 
 # Product catalog
 PRODUCT_CATALOG = [
@@ -95,17 +112,107 @@ PRODUCT_CATALOG = [
     }
 ]
 
+DEFAULT_START_DATE = datetime(2026, 1, 15)  # January 15, 2026
+DEFAULT_DAYS = 180
+
+# Orders drawn from one RNG; each block's RNG is seeded from (seed, block number)
+SEED_BLOCK_SIZE = 1000
+
+# Summary fields, shared by the streamed and $facet reports
+REPORT_SUM_FIELDS = ["totalAmount"]
+REPORT_GROUP_FIELDS = ["status", "userId"]
+
+# Sampling weight multipliers for inventory tags (--weight-by popularity)
+POPULARITY_TAG_WEIGHTS = {
+    "bestseller": 5.0,
+    "popular": 3.0,
+    "trending": 3.0,
+    "featured": 2.0,
+    "new arrival": 1.5,
+    "sale": 1.5,
+    "limited edition": 0.5,
+    "luxury": 0.5,
+}
+
+# Only the inventory fields an order product needs
+INVENTORY_PROJECTION = {
+    "_id": 0, "sku": 1, "productName": 1, "category": 1, "size": 1, "color": 1,
+    "price": 1, "salePrice": 1, "imageUrl": 1, "stock": 1, "tags": 1,
+}
+
+class AliasSampler:
+    """Vose's alias method: O(n) setup, O(1) weighted draws"""
+    
+    def __init__(self, weights: List[float]):
+        n = len(weights)
+        if n == 0:
+            raise ValueError("AliasSampler needs at least one weight")
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("AliasSampler weights must sum to a positive value")
+        
+        self.n = n
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        
+        # Whatever is left is 1.0 up to rounding error
+        for i in large + small:
+            self.prob[i] = 1.0
+    
+    def sample(self, rng=random) -> int:
+        column = int(rng.random() * self.n)
+        return column if rng.random() < self.prob[column] else self.alias[column]
+
+def inventory_weight(item: Dict[str, Any], weight_by: str) -> float:
+    if weight_by == "stock":
+        return float(item.get("stock") or 0)
+    if weight_by == "popularity":
+        weight = 1.0
+        for tag in item.get("tags") or []:
+            weight *= POPULARITY_TAG_WEIGHTS.get(tag, 1.0)
+        return weight
+    return 1.0
+
+def load_inventory_index(db, weight_by: str = "popularity") -> Tuple[List[Tuple], List[float]]:
+    """Load active, in-stock inventory once as compact product tuples plus weights.
+
+    Each tuple is (sku, name, category, size, color, price, imageUrl), sorted
+    by SKU so a given seed samples the same products on every run.
+    """
+    products, weights = [], []
+    cursor = db.inventories.find({"isActive": True, "stock": {"$gt": 0}}, INVENTORY_PROJECTION,
+                                 sort=[("sku", 1)], batch_size=10000)
+    for item in cursor:
+        weight = inventory_weight(item, weight_by)
+        if weight <= 0:
+            continue
+        price = item.get("salePrice") or item.get("price") or 0
+        products.append((item["sku"], item.get("productName", item["sku"]), item.get("category", ""),
+                         str(item.get("size", "")), item.get("color", ""), price, item.get("imageUrl") or ""))
+        weights.append(weight)
+    return products, weights
+
 def get_customer_users(db):
-    """Get all customer users from database"""
+    """Get all customer users from database, in _id order so a seed picks the same customers"""
     users_collection = db.users
-    return list(users_collection.find({"role": "customer"}))
-
-def generate_random_product():
-    """Generate a random product with variations"""
-    product = random.choice(PRODUCT_CATALOG)
-    size = random.choice(product["sizes"])
-    color = random.choice(product["colors"])
-    price = product["basePrice"] + random.randint(-250, 500)
+    return list(users_collection.find({"role": "customer"}, {"name": 1}, sort=[("_id", 1)]))
+
+def generate_random_product(rng=random):
+    """Generate a random product with variations from the built-in catalog"""
+    product = rng.choice(PRODUCT_CATALOG)
+    size = rng.choice(product["sizes"])
+    color = rng.choice(product["colors"])
+    price = product["basePrice"] + rng.randint(-250, 500)
     
     return {
         "productId": product["productId"],
@@ -117,22 +224,35 @@ def generate_random_product():
         "imageUrl": ""
     }
 
-def generate_random_order(customer, order_date):
+def sample_inventory_product(inventory: List[Tuple], sampler: AliasSampler, rng=random):
+    """Draw one product from the inventory index"""
+    sku, name, category, size, color, price, image_url = inventory[sampler.sample(rng)]
+    return {
+        "productId": sku,
+        "name": name,
+        "category": category,
+        "size": size,
+        "color": color,
+        "price": price,
+        "imageUrl": image_url
+    }
+
+def generate_random_order(customer, order_date, rng=random, pick_product=generate_random_product):
     """Generate a random order for a customer"""
     # 40% chance of multiple products
-    num_products = 2 if random.random() > 0.6 else 1
+    num_products = 2 if rng.random() > 0.6 else 1
     
     products = []
     total_amount = 0
     
     for _ in range(num_products):
-        product = generate_random_product()
+        product = pick_product(rng)
         products.append(product)
         total_amount += product["price"]
     
     # Most orders are delivered
     statuses = ["delivered", "delivered", "delivered", "shipped", "processing", "cancelled"]
-    status = random.choice(statuses)
+    status = rng.choice(statuses)
     
     return {
         "userId": customer["_id"],
@@ -144,12 +264,81 @@ def generate_random_order(customer, order_date):
         "updatedAt": order_date
     }
 
-def generate_orders():
-    """Generate 100 random orders for all customers"""
+# Set once per worker process by _init_worker
+_worker_state: Dict[str, Any] = {}
+
+def _init_worker(customer_ids: List[ObjectId], start_date: datetime, days: int, seed: int, batch_size: int,
+                 inventory: List[Tuple] = None, weights: List[float] = None, update_stock: bool = True):
+    """Set up the per-process client and product sampler"""
+    db = get_db()
+    if inventory:
+        sampler = AliasSampler(weights)
+        pick_product = lambda rng: sample_inventory_product(inventory, sampler, rng)
+    else:
+        pick_product = generate_random_product
+    _worker_state.update({
+        "collection": db.orders,
+        "inventories": db.inventories,
+        "pick_product": pick_product,
+        "update_stock": bool(inventory) and update_stock,
+        "customers": [{"_id": customer_id} for customer_id in customer_ids],
+        "start_date": start_date,
+        "days": days,
+        "seed": seed,
+        "batch_size": batch_size,
+    })
+
+def decrement_stock(inventories, sold: Counter, batch_size: int) -> int:
+    """Subtract sold quantities per SKU, clamping at zero; returns SKUs updated"""
+    with BulkWriter(inventories, max_ops=batch_size) as writer:
+        for sku, quantity in sold.items():
+            writer.update_one({"sku": sku}, [
+                {"$set": {"stock": {"$max": [0, {"$subtract": ["$stock", quantity]}]}}},
+                {"$set": {"isActive": {"$gt": ["$stock", 0]}, "updatedAt": "$$NOW"}},
+            ])
+    return writer.counts["modified"]
+
+def generate_chunk(first_order: int, count: int) -> Tuple[int, CollectionSummary]:
+    """Generate and insert count orders from first_order on; returns (inserted, summary of the chunk)"""
+    state = _worker_state
+    customers = state["customers"]
+    summary = CollectionSummary("orders", REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+    sold = Counter()
+    writer = BulkWriter(state["collection"], max_ops=state["batch_size"])
+    
+    for order_number in range(first_order, first_order + count):
+        # Seeded per block, so the output doesn't depend on which worker or chunk runs it
+        if order_number % SEED_BLOCK_SIZE == 0 or order_number == first_order:
+            rng = random.Random(f"{state['seed']}:{order_number // SEED_BLOCK_SIZE}")
+        customer_index = rng.randrange(len(customers))
+        days_ago = rng.randint(0, state["days"])
+        order_date = state["start_date"] + timedelta(days=days_ago)
+        
+        order = generate_random_order(customers[customer_index], order_date, rng, state["pick_product"])
+        writer.insert(order)
+        summary.add(order)
+        if order["status"] != "cancelled":
+            for product in order["products"]:
+                sold[product["productId"]] += 1
+    writer.flush()
+    
+    if state["update_stock"] and sold:
+        decrement_stock(state["inventories"], sold, state["batch_size"])
+    
+    return writer.counts["inserted"], summary
+
+def generate_orders(count: int = 100, start_date: datetime = DEFAULT_START_DATE, days: int = DEFAULT_DAYS,
+                    seed: int = None, workers: int = 1, chunk_size: int = 10000, batch_size: int = 1000,
+                    source: str = "catalog", weight_by: str = "popularity", update_stock: bool = True,
+                    report_from: str = "stream", report_json: str = None):
+    """Generate `count` random orders for all customers.
+
+    The summary comes from the generated orders (report_from="stream") or
+    from one $facet pass over the whole orders collection ("facet").
+    """
     try:
         # Connect to MongoDB
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
+        db = get_db()
         
         print(f"Connected to MongoDB: {MONGODB_URI}")
         
@@ -163,50 +352,79 @@ def generate_orders():
         
         print(f"Found {len(customers)} customer users")
         
-        # Generate 100 orders
-        orders = []
-        start_date = datetime(2026, 1, 15)  # January 15, 2026
+        inventory, weights = None, None
+        if source == "inventory":
+            inventory, weights = load_inventory_index(db, weight_by)
+            if not inventory:
+                print("No active, in-stock inventory found in database!")
+                print("Please generate inventory first using generate_inventory.py")
+                return
+            print(f"Loaded {len(inventory)} active SKUs (weighted by {weight_by})")
+        
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        print(f"🎲 Seed: {seed} (rerun with --seed {seed} to reproduce)")
+        
+        summary = CollectionSummary("orders", REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+        inserted = 0
+        started = time.perf_counter()
+        # Chunks are whole seed blocks, so no block is split between two chunks
+        chunk_size = -(-chunk_size // SEED_BLOCK_SIZE) * SEED_BLOCK_SIZE
+        chunks = [(first_order, min(chunk_size, count - first_order))
+                  for first_order in range(0, count, chunk_size)]
+        workers = max(1, min(workers, len(chunks)))
+        
+        # Chunks in flight; bounded so memory doesn't grow with --count
+        in_flight = deque()
+        
+        def collect(future):
+            nonlocal inserted
+            chunk_inserted, chunk_summary = future.result()
+            inserted += chunk_inserted
+            summary.merge(chunk_summary)
+            elapsed = time.perf_counter() - started
+            print(f"   Inserted {inserted:,}/{count:,} orders - {inserted / elapsed:,.0f} orders/sec")
         
-        for i in range(100):
-            # Random customer
-            customer = random.choice(customers)
-            
-            # Random order date within the last 6 months
-            days_ago = random.randint(0, 180)
-            order_date = start_date + timedelta(days=days_ago)
-            
-            # Generate order
-            order = generate_random_order(customer, order_date)
-            orders.append(order)
+        customer_ids = [customer["_id"] for customer in customers]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(customer_ids, start_date, days, seed, batch_size,
+                                           inventory, weights, update_stock)) as pool:
+            for first_order, chunk_count in chunks:
+                in_flight.append(pool.submit(generate_chunk, first_order, chunk_count))
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
         
-        # Insert orders into database
-        orders_collection = db.orders
-        result = orders_collection.insert_many(orders)
+        elapsed = time.perf_counter() - started
+        print(f"\n✅ Successfully generated {inserted} orders!")
+        print(f"   ⚡ {inserted / elapsed if elapsed else 0:,.0f} orders/sec ({elapsed:.1f}s, {workers} workers)")
         
-        print(f"\n✅ Successfully generated {len(result.inserted_ids)} orders!")
+        if report_from == "facet":
+            report = facet_summary(db.orders, REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+        else:
+            report = summary.to_dict()
         
         # Print summary
-        status_counts = {}
-        customer_order_counts = {}
-        
-        for order in orders:
-            status = order["status"]
-            user_id = str(order["userId"])
-            
-            status_counts[status] = status_counts.get(status, 0) + 1
-            customer_order_counts[user_id] = customer_order_counts.get(user_id, 0) + 1
-        
-        print(f"\n📊 Order Summary:")
-        print(f"   Total Orders: {len(orders)}")
-        print(f"   Total Customers: {len(customer_order_counts)}")
+        customer_names = {str(c["_id"]): c.get("name", "Unknown") for c in customers}
+        print(f"\n📊 Order Summary{' (whole collection)' if report_from == 'facet' else ''}:")
+        print(f"   Total Orders: {report['count']}")
+        print(f"   Total Customers: {len(report['groups']['userId'])}")
+        print(f"   Total Amount: Rs.{report['sums']['totalAmount']:,}")
         print(f"\n📈 Status Distribution:")
-        for status, count in sorted(status_counts.items()):
-            print(f"   {status}: {count}")
+        for status, status_count in sorted(report["groups"]["status"].items()):
+            print(f"   {status}: {status_count}")
         
         print(f"\n👥 Orders per Customer:")
-        for user_id, count in sorted(customer_order_counts.items()):
-            customer_name = next((c["name"] for c in customers if str(c["_id"]) == user_id), "Unknown")
-            print(f"   {customer_name}: {count} orders")
+        for user_id, order_count in sorted(report["groups"]["userId"].items()):
+            print(f"   {customer_names.get(user_id, 'Unknown')}: {order_count} orders")
+        
+        if report_json:
+            write_report(report_json, report, run={
+                "seed": seed, "count": count, "inserted": inserted, "workers": workers, "source": source,
+                "elapsedSeconds": round(elapsed, 3), "ordersPerSecond": round(inserted / elapsed if elapsed else 0, 1),
+            })
+            print(f"\n💾 Report saved to {report_json}")
         
         print(f"\n🎉 Order generation completed successfully!")
         
@@ -215,13 +433,46 @@ def generate_orders():
         sys.exit(1)
     
     finally:
-        if 'client' in locals():
-            client.close()
+        close_client()
+
+def parse_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected YYYY-MM-DD")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate random orders for all customers")
+    parser.add_argument("--count", type=int, default=100, help="Number of orders to generate (default: 100)")
+    parser.add_argument("--start-date", type=parse_date, default=DEFAULT_START_DATE,
+                        help="Earliest order date, YYYY-MM-DD (default: 2026-01-15)")
+    parser.add_argument("--end-date", type=parse_date,
+                        help=f"Latest order date, YYYY-MM-DD (default: {DEFAULT_DAYS} days after --start-date)")
+    parser.add_argument("--seed", type=int, help="Random seed; the same seed and count give the same orders")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help=f"Orders generated per worker task, rounded up to whole blocks of {SEED_BLOCK_SIZE} (default: 10000)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Orders per bulk write (default: 1000)")
+    parser.add_argument("--source", choices=["catalog", "inventory"], default="catalog",
+                        help="Draw products from the built-in catalog or from db.inventories (default: catalog)")
+    parser.add_argument("--weight-by", choices=["popularity", "stock", "uniform"], default="popularity",
+                        help="With --source inventory, how SKUs are weighted (default: popularity tags)")
+    parser.add_argument("--no-stock-update", action="store_true",
+                        help="With --source inventory, don't decrement stock for generated orders")
+    parser.add_argument("--report-from", choices=["stream", "facet"], default="stream",
+                        help="Summarize the generated orders as they stream (default) or the whole collection with one $facet query")
+    parser.add_argument("--report-json", metavar="PATH", help="Also write the summary report as JSON")
+    args = parser.parse_args()
+    
+    days = (args.end_date - args.start_date).days if args.end_date else DEFAULT_DAYS
+    if days < 0:
+        parser.error("--end-date must not be before --start-date")
+    
     print("🚀 Starting order generation...")
-    print(f"📅 Generating 100 random orders for all customers")
+    print(f"📅 Generating {args.count} random orders for all customers")
     print(f"📍 MongoDB URI: {MONGODB_URI}")
     print("-" * 50)
     
-    generate_orders()
+    generate_orders(args.count, args.start_date, days, args.seed,
+                    max(1, args.workers), max(1, args.chunk_size), max(1, args.batch_size),
+                    args.source, args.weight_by, not args.no_stock_update,
+                    args.report_from, args.report_json)
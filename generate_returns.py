@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Script to generate returns from existing delivered orders
+
+Every customer gets a behavior pattern: most are normal, and configurable
+shares are abusive:
+
+- high_frequency: returns most of what they buy, within days of delivery
+- high_value: returns nearly every expensive item, rarely anything else
+- reason_cycling: rotates through every return reason, with no description
+
+The fields the fraud predictor reads (price, reason, description, imageUrl,
+status, fraudFlag, createdAt) follow the pattern, and each return records
+it in "syntheticPattern" as ground truth. Orders are streamed by
+(userId, orderDate) and each user's returns come from an RNG seeded with
+(seed, userId), so the same seed and orders always give the same returns.
+Returns are written in unordered bulk batches, or with --output-file as
+MongoDB Extended JSON lines (loadable with mongoimport) instead.
+
+Usage:
+    python generate_returns.py --seed 42
+    python generate_returns.py --seed 42 --high-frequency-rate 0.1 --reason-cycling-rate 0.05
+    python generate_returns.py --seed 42 --output-file returns.jsonl.gz
+    python generate_returns.py --clear --seed 42 --report-json returns_report.json
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from bson import json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+
+from collection_report import CollectionSummary, write_report
+from mongo_pool import MONGODB_URI, BulkWriter, close_client, get_db
+from return_feature_store import rebuild_aggregates
+
+REASONS = ['wrong_size', 'wrong_color', 'defective', 'wrong_item', 'damaged_shipping',
+           'quality_issue', 'not_as_described', 'changed_mind']
+
+# Reason weights of ordinary returns, in REASONS order
+NORMAL_REASON_WEIGHTS = [30, 12, 12, 6, 5, 12, 8, 15]
+
+DESCRIPTIONS = {
+    'wrong_size': "The fit is too tight around the shoulders, I need one size up.",
+    'wrong_color': "The color looks quite different from the product photos.",
+    'defective': "The zipper broke the first time I used it.",
+    'wrong_item': "I received a different item from the one I ordered.",
+    'damaged_shipping': "The package arrived torn and the item was stained.",
+    'quality_issue': "The fabric started pilling after a single wash.",
+    'not_as_described': "The material is not cotton as stated in the description.",
+    'changed_mind': "I found something I like better, the item is unused.",
+}
+
+# Return statuses with weights; abusive returns are rejected more often
+NORMAL_STATUSES = (["completed", "approved", "refund_initiated", "pending", "pickup_scheduled",
+                    "warehouse_received", "rejected"], [40, 20, 10, 15, 5, 5, 5])
+ABUSIVE_STATUSES = (["rejected", "pending", "approved", "completed", "pickup_scheduled"], [35, 25, 15, 15, 10])
+
+# Per-pattern behavior: chance of returning an item, days from order to
+# return, chance of a fraud flag, of a photo and of a description
+PATTERNS: Dict[str, Dict[str, Any]] = {
+    "normal": {"return_rate": 0.08, "delay_days": (3, 25), "fraud_flag_rate": 0.01,
+               "image_rate": 0.7, "description_rate": 0.9},
+    "high_frequency": {"return_rate": 0.75, "delay_days": (1, 5), "fraud_flag_rate": 0.45,
+                       "image_rate": 0.3, "description_rate": 0.5},
+    "high_value": {"return_rate": 0.9, "delay_days": (5, 28), "fraud_flag_rate": 0.4,
+                   "image_rate": 0.2, "description_rate": 0.6},
+    "reason_cycling": {"return_rate": 0.5, "delay_days": (2, 14), "fraud_flag_rate": 0.35,
+                       "image_rate": 0.4, "description_rate": 0.0},
+}
+HIGH_VALUE_REASONS = ['defective', 'not_as_described', 'damaged_shipping', 'quality_issue']
+# Below the threshold high_value users return like everyone else
+DEFAULT_HIGH_VALUE_THRESHOLD = 4000
+
+DEFAULT_PATTERN_RATES = {"high_frequency": 0.05, "high_value": 0.03, "reason_cycling": 0.02}
+
+ORDER_PROJECTION = {"userId": 1, "orderDate": 1, "products.productId": 1, "products.price": 1}
+
+REPORT_SUM_FIELDS = ["price"]
+REPORT_GROUP_FIELDS = ["syntheticPattern", "reason", "status", "fraudFlag"]
+
+def choose_pattern(rng: random.Random, pattern_rates: Dict[str, float]) -> str:
+    draw = rng.random()
+    for pattern, rate in pattern_rates.items():
+        if draw < rate:
+            return pattern
+        draw -= rate
+    return "normal"
+
+def iter_user_orders(orders_collection, batch_size: int) -> Iterator[Tuple[Any, List[Dict[str, Any]]]]:
+    """Yield (userId, delivered orders by date) from one sorted orders cursor"""
+    cursor = orders_collection.find({"status": "delivered"}, ORDER_PROJECTION,
+                                    sort=[("userId", 1), ("orderDate", 1)], batch_size=batch_size)
+    user_id, orders = None, []
+    for order in cursor:
+        if orders and order["userId"] != user_id:
+            yield user_id, orders
+            orders = []
+        user_id = order["userId"]
+        orders.append(order)
+    if orders:
+        yield user_id, orders
+
+def generate_user_returns(user_id: Any, orders: List[Dict[str, Any]], seed: int,
+                          pattern_rates: Dict[str, float],
+                          high_value_threshold: float = DEFAULT_HIGH_VALUE_THRESHOLD) -> List[Dict[str, Any]]:
+    """Returns for one user's delivered orders, in order date order"""
+    rng = random.Random(f"{seed}:{user_id}")
+    pattern = choose_pattern(rng, pattern_rates)
+    behavior = PATTERNS[pattern]
+    abusive = pattern != "normal"
+    cycle_start = rng.randrange(len(REASONS))
+
+    returns = []
+    for order in orders:
+        for product in order.get("products", []):
+            price = product.get("price") or 0
+            return_rate = behavior["return_rate"]
+            if pattern == "high_value" and price < high_value_threshold:
+                return_rate = PATTERNS["normal"]["return_rate"]
+            if rng.random() >= return_rate:
+                continue
+
+            if pattern == "reason_cycling":
+                reason = REASONS[(cycle_start + len(returns)) % len(REASONS)]
+            elif pattern == "high_value":
+                reason = rng.choice(HIGH_VALUE_REASONS)
+            else:
+                reason = rng.choices(REASONS, NORMAL_REASON_WEIGHTS)[0]
+
+            statuses, weights = ABUSIVE_STATUSES if abusive else NORMAL_STATUSES
+            status = rng.choices(statuses, weights)[0]
+            fraud_flag = rng.random() < behavior["fraud_flag_rate"]
+            created_at = order["orderDate"] + timedelta(days=rng.randint(*behavior["delay_days"]),
+                                                        minutes=rng.randrange(24 * 60))
+            returns.append({
+                "orderId": order["_id"],
+                "userId": user_id,
+                "productId": product.get("productId", ""),
+                "reason": reason,
+                "description": DESCRIPTIONS[reason] if rng.random() < behavior["description_rate"] else "",
+                "imageUrl": f"https://example.com/returns/{order['_id']}-{len(returns)}.jpg"
+                            if rng.random() < behavior["image_rate"] else "",
+                "price": price,
+                "aiAnalysisResult": None,
+                "fraudFlag": fraud_flag,
+                "validationStatus": "manual_review" if fraud_flag else ("rejected_ai" if status == "rejected" else "approved"),
+                "status": status,
+                "returnMethod": rng.choice(["pickup", "dropbox"]),
+                "qrCodeData": "",
+                "dropboxLocation": "",
+                "syntheticPattern": pattern,
+                "createdAt": created_at,
+                "updatedAt": created_at + timedelta(days=rng.randint(0, 10)),
+            })
+    return returns
+
+class ReturnsFileWriter:
+    """Writes returns as Extended JSON lines; gzip-compressed for *.gz paths"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        opener = gzip.open if path.endswith(".gz") else open
+        self.file = opener(self.tmp_path, "wt", encoding="utf-8")
+        self.written = 0
+
+    def insert(self, doc: Dict[str, Any]):
+        self.file.write(json_util.dumps(doc, json_options=RELAXED_JSON_OPTIONS) + "\n")
+        self.written += 1
+
+    def close(self):
+        """Finish the file; it only appears at `path` once complete"""
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+def generate_returns(seed: int = None, pattern_rates: Optional[Dict[str, float]] = None,
+                     high_value_threshold: float = DEFAULT_HIGH_VALUE_THRESHOLD, batch_size: int = 1000,
+                     output_file: str = None, clear: bool = False, report_json: str = None):
+    """Generate returns for every user's delivered orders, into db.returns or output_file"""
+    pattern_rates = pattern_rates or DEFAULT_PATTERN_RATES
+    try:
+        # Connect to MongoDB
+        db = get_db()
+
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        if clear and not output_file:
+            deleted = db.returns.delete_many({"syntheticPattern": {"$exists": True}}).deleted_count
+            print(f"Cleared {deleted} previously generated returns")
+
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        print(f"🎲 Seed: {seed} (rerun with --seed {seed} to reproduce)")
+
+        if output_file:
+            writer = ReturnsFileWriter(output_file)
+        else:
+            writer = BulkWriter(db.returns, max_ops=batch_size)
+
+        summary = CollectionSummary("returns", REPORT_SUM_FIELDS, REPORT_GROUP_FIELDS)
+        users = 0
+        started = time.perf_counter()
+        for user_id, orders in iter_user_orders(db.orders, batch_size):
+            for return_doc in generate_user_returns(user_id, orders, seed, pattern_rates, high_value_threshold):
+                writer.insert(return_doc)
+                summary.add(return_doc)
+            users += 1
+            if users % 1000 == 0:
+                elapsed = time.perf_counter() - started
+                print(f"   {users:,} users, {summary.count:,} returns - {summary.count / elapsed:,.0f} returns/sec")
+
+        if output_file:
+            writer.close()
+        else:
+            writer.flush()
+            # Bulk inserts bypass the per-return aggregate updates
+            aggregated_users = rebuild_aggregates(db, batch_size)
+            print(f"   Rebuilt return aggregates for {aggregated_users} users")
+        elapsed = time.perf_counter() - started
+
+        if users == 0:
+            print("No delivered orders found in database!")
+            print("Please generate orders first using generate_orders.py")
+            return
+
+        report = summary.to_dict()
+        destination = output_file or "db.returns"
+        print(f"\n✅ Generated {report['count']} returns for {users} users into {destination}")
+        print(f"   ⚡ {report['count'] / elapsed if elapsed else 0:,.0f} returns/sec ({elapsed:.1f}s)")
+        print(f"   Total Amount: Rs.{report['sums']['price']:,}")
+        print(f"\n🕵️  Returns by Pattern:")
+        for pattern, pattern_count in sorted(report["groups"]["syntheticPattern"].items()):
+            print(f"   {pattern}: {pattern_count}")
+        print(f"\n📈 Status Distribution:")
+        for status, status_count in sorted(report["groups"]["status"].items()):
+            print(f"   {status}: {status_count}")
+        print(f"\n🚩 Fraud flagged: {report['groups']['fraudFlag'].get('True', 0)}")
+
+        if report_json:
+            write_report(report_json, report, run={
+                "seed": seed, "users": users, "patternRates": pattern_rates,
+                "highValueThreshold": high_value_threshold, "output": destination,
+                "elapsedSeconds": round(elapsed, 3),
+            })
+            print(f"\n💾 Report saved to {report_json}")
+
+        print(f"\n🎉 Return generation completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Error generating returns: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate returns, including abusive patterns, from delivered orders")
+    parser.add_argument("--seed", type=int, help="Random seed; the same seed and orders give the same returns")
+    for pattern, rate in DEFAULT_PATTERN_RATES.items():
+        parser.add_argument(f"--{pattern.replace('_', '-')}-rate", type=float, default=rate,
+                            help=f"Share of users with the {pattern} pattern (default: {rate})")
+    parser.add_argument("--high-value-threshold", type=float, default=DEFAULT_HIGH_VALUE_THRESHOLD,
+                        help=f"Price from which high_value users return items (default: {DEFAULT_HIGH_VALUE_THRESHOLD})")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Returns per bulk write (default: 1000)")
+    parser.add_argument("--output-file", metavar="PATH",
+                        help="Write Extended JSON lines (gzip if PATH ends in .gz) instead of inserting into db.returns")
+    parser.add_argument("--clear", action="store_true", help="First delete returns from earlier runs of this script")
+    parser.add_argument("--report-json", metavar="PATH", help="Also write the summary report as JSON")
+    args = parser.parse_args()
+
+    pattern_rates = {pattern: getattr(args, f"{pattern}_rate") for pattern in DEFAULT_PATTERN_RATES}
+    if any(rate < 0 for rate in pattern_rates.values()) or sum(pattern_rates.values()) > 1:
+        parser.error("pattern rates must be non-negative and add up to at most 1")
+
+    print("🚀 Starting return generation...")
+    print(f"📍 MongoDB URI: {MONGODB_URI}")
+    print("-" * 50)
+
+    generate_returns(args.seed, pattern_rates, args.high_value_threshold, max(1, args.batch_size),
+                     args.output_file, args.clear, args.report_json)
@@ -5,10 +5,12 @@
  * integrates with the Node.js backend via subprocess calls.
  */
 
-import { spawn } from 'child_process';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import { createInterface } from 'readline';
 import { promisify } from 'util';
 import * as fs from 'fs/promises';
 import * as path from 'path';
+import { getReturnAggregate } from '@/lib/returnAggregateStore';
 
 export interface MLPredictionResult {
   risk_score: number;
@@ -16,6 +18,7 @@ export interface MLPredictionResult {
   prediction: "LEGITIMATE" | "SUSPICIOUS" | "FRAUD";
   confidence: number;
   features_used?: string[];
+  model_version?: string;
   error?: string;
 }
 
@@ -28,19 +31,141 @@ export interface UserBehaviorScore {
   riskLevel: "low" | "medium" | "high";
 }
 
+const DAEMON_REQUEST_TIMEOUT_MS = 10000;
+
+/**
+ * The user's return history for a prediction: passed along, the user's
+ * per-return aggregate (see returnAggregateStore.ts), or looked up by the
+ * predictor itself from userId.
+ */
+type PredictionHistory = { historicalReturns: any[] } | { aggregate: Record<string, any> } | { userId: string };
+
+interface PendingPrediction {
+  resolve: (result: MLPredictionResult) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+  daemon: ChildProcessWithoutNullStreams;
+}
+
+/**
+ * Long-running `return_fraud_predictor.py --serve` process.
+ *
+ * The model is loaded once when the daemon starts; each prediction is one
+ * JSON line on stdin answered by one JSON line on stdout, matched by id.
+ */
+class PredictorDaemon {
+  private process: ChildProcessWithoutNullStreams | null = null;
+  private pending = new Map<number, PendingPrediction>();
+  private nextId = 1;
+
+  private start(): ChildProcessWithoutNullStreams {
+    const pythonScript = path.join(process.cwd(), 'return_fraud_predictor.py');
+    const python = spawn('python', [pythonScript, '--serve']);
+
+    createInterface({ input: python.stdout }).on('line', (line) => {
+      let response: any;
+      try {
+        response = JSON.parse(line);
+      } catch {
+        console.error('Failed to parse Python daemon output:', line);
+        return;
+      }
+
+      const entry = this.pending.get(response.id);
+      if (!entry) return;
+
+      this.pending.delete(response.id);
+      clearTimeout(entry.timer);
+      delete response.id;
+      entry.resolve(response);
+    });
+
+    python.stderr.on('data', (data) => {
+      console.error('Python daemon:', data.toString().trim());
+    });
+
+    const shutdown = (error: Error) => {
+      if (this.process === python) {
+        this.process = null;
+      }
+      // Requests already sent to a respawned daemon are not affected
+      for (const [id, entry] of this.pending) {
+        if (entry.daemon !== python) continue;
+        clearTimeout(entry.timer);
+        entry.reject(error);
+        this.pending.delete(id);
+      }
+    };
+
+    python.on('error', (error) => shutdown(error));
+    // Writing to a daemon that has exited but not yet closed fails with EPIPE;
+    // without a listener that would be an uncaught exception
+    python.stdin.on('error', (error) => shutdown(error));
+    python.on('close', (code) => shutdown(new Error(`Python daemon exited with code ${code}`)));
+
+    return python;
+  }
+
+  predict(newReturn: any, history: PredictionHistory): Promise<MLPredictionResult> {
+    if (!this.process) {
+      this.process = this.start();
+    }
+    const python = this.process;
+
+    return new Promise((resolve, reject) => {
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error(`Python daemon timed out after ${DAEMON_REQUEST_TIMEOUT_MS}ms`));
+        // A hung daemon would stall every later request too; the next call respawns it
+        if (this.process === python) {
+          this.process = null;
+        }
+        python.kill();
+      }, DAEMON_REQUEST_TIMEOUT_MS);
+
+      this.pending.set(id, { resolve, reject, timer, daemon: python });
+
+      const request = JSON.stringify('aggregate' in history
+        ? { id, new_return: newReturn, aggregate: history.aggregate }
+        : 'userId' in history
+          ? { id, new_return: newReturn, userId: history.userId }
+          : { id, new_return: newReturn, historical_returns: history.historicalReturns });
+      python.stdin.write(request + '\n');
+    });
+  }
+}
+
+let predictorDaemon: PredictorDaemon | null = null;
+
+/**
+ * Score through the shared predictor daemon, starting it on first use.
+ * Set ML_PREDICTOR_DAEMON=false to always spawn one process per return.
+ */
+async function executeWithDaemon(newReturn: any, history: PredictionHistory): Promise<MLPredictionResult> {
+  if (!predictorDaemon) {
+    predictorDaemon = new PredictorDaemon();
+  }
+  return predictorDaemon.predict(newReturn, history);
+}
+
 /**
  * Execute Python script for ML prediction
  */
-async function executePythonScript(newReturn: any, historicalReturns: any[]): Promise<MLPredictionResult> {
+async function executePythonScript(newReturn: any, history: PredictionHistory): Promise<MLPredictionResult> {
   return new Promise((resolve, reject) => {
     const pythonScript = path.join(process.cwd(), 'return_fraud_predictor.py');
     
-    // Prepare arguments
+    // Prepare arguments; with a userId the script fetches the history itself
     const newReturnJson = JSON.stringify(newReturn);
-    const historicalReturnsJson = JSON.stringify(historicalReturns);
+    const args = 'aggregate' in history
+      ? [pythonScript, '--aggregate', JSON.stringify(history.aggregate), newReturnJson]
+      : 'userId' in history
+        ? [pythonScript, '--user-id', history.userId, newReturnJson]
+        : [pythonScript, newReturnJson, JSON.stringify(history.historicalReturns)];
     
     // Spawn Python process
-    const python = spawn('python', [pythonScript, newReturnJson, historicalReturnsJson]);
+    const python = spawn('python', args);
     
     let output = '';
     let errorOutput = '';
@@ -83,6 +208,21 @@ export async function predictWithPythonML(
   newReturn: any,
   historicalReturns: any[] = []
 ): Promise<MLPredictionResult> {
+  return runPrediction(newReturn, { historicalReturns });
+}
+
+/**
+ * Predict fraud for a user's return; the predictor fetches the user's
+ * history from MongoDB, so it never passes through Node or argv
+ */
+export async function predictWithPythonMLForUser(
+  newReturn: any,
+  userId: string
+): Promise<MLPredictionResult> {
+  return runPrediction(newReturn, { userId });
+}
+
+async function runPrediction(newReturn: any, history: PredictionHistory): Promise<MLPredictionResult> {
   try {
     console.log('Starting Python ML prediction for return:', newReturn._id || 'new');
     
@@ -95,8 +235,18 @@ export async function predictWithPythonML(
       return getFallbackResult('Python script not found');
     }
     
-    // Execute Python script
-    const result = await executePythonScript(newReturn, historicalReturns);
+    // Prefer the persistent daemon; fall back to a one-off process if it fails
+    let result: MLPredictionResult;
+    if (process.env.ML_PREDICTOR_DAEMON !== 'false') {
+      try {
+        result = await executeWithDaemon(newReturn, history);
+      } catch (daemonError) {
+        console.error('Python daemon prediction failed, falling back to subprocess:', daemonError);
+        result = await executePythonScript(newReturn, history);
+      }
+    } else {
+      result = await executePythonScript(newReturn, history);
+    }
     
     console.log('Python ML prediction result:', result);
     
@@ -210,11 +360,17 @@ export async function processReturnWithML(
   trustScoreUpdated: boolean;
 }> {
   try {
-    // Get user's historical returns
-    const historicalReturns = await getUserHistoricalReturns(userId);
-    
-    // Run ML prediction
-    const mlResult = await predictWithPythonML(newReturn, historicalReturns);
+    // A new return is scored from the user's aggregate, one small document.
+    // A stored return is already counted in it, so the predictor fetches the
+    // history itself and leaves that return out; so it does for users whose
+    // aggregate hasn't been built yet.
+    const aggregate = newReturn._id ? null : await getReturnAggregate(userId).catch((error) => {
+      console.error('Failed to load return aggregate:', error);
+      return null;
+    });
+    const mlResult = aggregate
+      ? await runPrediction(newReturn, { aggregate })
+      : await predictWithPythonMLForUser(newReturn, userId);
     
     // Update user trust score based on ML result
     await updateUserTrustScoreWithML(userId, mlResult);
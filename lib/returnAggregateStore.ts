@@ -0,0 +1,136 @@
+/**
+ * Per-user Return Aggregate Store
+ *
+ * Keeps the `returnaggregates` collection in step with returns as they are
+ * created and change status or fraudFlag, with one atomic O(1) update each.
+ * The document layout and update rules are the same as MongoAggregateStore
+ * in return_feature_store.py, which the fraud predictor scores from
+ * (`python return_feature_store.py rebuild` recomputes every aggregate).
+ */
+
+import mongoose from 'mongoose';
+import { connectDB } from '@/lib/mongodb';
+
+const AGGREGATE_COLLECTION = 'returnaggregates';
+
+// Statuses that have their own running count
+const STATUS_COUNT_FIELDS: Record<string, string> = {
+  approved: 'approvedReturns',
+  rejected: 'rejectedReturns'
+};
+
+// Python's date(1970, 1, 1).toordinal(); day buckets are keyed by UTC date ordinal
+const EPOCH_DAY_ORDINAL = 719163;
+const MS_PER_DAY = 24 * 60 * 60 * 1000;
+
+export interface AggregatedReturn {
+  userId: mongoose.Types.ObjectId | string;
+  status?: string | null;
+  fraudFlag?: boolean | null;
+  createdAt?: Date | string | null;
+  price?: number | null;
+}
+
+function toUserId(userId: mongoose.Types.ObjectId | string): mongoose.Types.ObjectId | string {
+  if (typeof userId === 'string' && mongoose.Types.ObjectId.isValid(userId)) {
+    return new mongoose.Types.ObjectId(userId);
+  }
+  return userId;
+}
+
+function dayOrdinal(date: Date): number {
+  return Math.floor(date.getTime() / MS_PER_DAY) + EPOCH_DAY_ORDINAL;
+}
+
+async function aggregates() {
+  const connection = await connectDB();
+  return connection.connection.db!.collection(AGGREGATE_COLLECTION);
+}
+
+/**
+ * Add changes to an existing aggregate's counts, clamping each at zero.
+ * Never creates a document: a user without one has nothing to adjust.
+ */
+async function applyDeltas(userId: mongoose.Types.ObjectId | string, deltas: Record<string, number>): Promise<void> {
+  const fields = Object.entries(deltas).filter(([, delta]) => delta !== 0);
+  if (fields.length === 0) return;
+
+  const set: Record<string, any> = {};
+  for (const [field, delta] of fields) {
+    set[field] = { $max: [0, { $add: [{ $ifNull: [`$${field}`, 0] }, delta] }] };
+  }
+  await (await aggregates()).updateOne({ _id: toUserId(userId) as any }, [{ $set: set }]);
+}
+
+/**
+ * Fold a newly created return into its user's aggregate
+ */
+export async function recordReturnCreated(returnDoc: AggregatedReturn): Promise<void> {
+  const inc: Record<string, number> = { totalReturns: 1 };
+  const min: Record<string, any> = {};
+  const max: Record<string, any> = {};
+
+  const statusField = returnDoc.status ? STATUS_COUNT_FIELDS[returnDoc.status] : undefined;
+  if (statusField) {
+    inc[statusField] = 1;
+  }
+  if (returnDoc.fraudFlag === true) {
+    inc.fraudFlags = 1;
+  }
+
+  if (returnDoc.createdAt) {
+    const createdAt = new Date(returnDoc.createdAt);
+    inc.createdCount = 1;
+    inc[`dayBuckets.${dayOrdinal(createdAt)}`] = 1;
+    min.firstCreatedAt = createdAt;
+    max.lastCreatedAt = createdAt;
+  }
+
+  if (typeof returnDoc.price === 'number' && !Number.isNaN(returnDoc.price)) {
+    inc.priceCount = 1;
+    inc.priceSum = returnDoc.price;
+    max.priceMax = returnDoc.price;
+  }
+
+  const update: Record<string, any> = { $inc: inc };
+  if (Object.keys(min).length) update.$min = min;
+  if (Object.keys(max).length) update.$max = max;
+
+  await (await aggregates()).updateOne({ _id: toUserId(returnDoc.userId) as any }, update, { upsert: true });
+}
+
+/**
+ * Move a return between the approved/rejected/other counts
+ */
+export async function recordStatusChange(
+  userId: mongoose.Types.ObjectId | string,
+  oldStatus: string | null | undefined,
+  newStatus: string | null | undefined
+): Promise<void> {
+  const deltas: Record<string, number> = {};
+  for (const [status, delta] of [[oldStatus, -1], [newStatus, 1]] as const) {
+    const field = status ? STATUS_COUNT_FIELDS[status] : undefined;
+    if (field) {
+      deltas[field] = (deltas[field] || 0) + delta;
+    }
+  }
+  await applyDeltas(userId, deltas);
+}
+
+/**
+ * Apply a fraudFlag change on an existing return
+ */
+export async function recordFraudFlagChange(
+  userId: mongoose.Types.ObjectId | string,
+  oldFlag: boolean | null | undefined,
+  newFlag: boolean | null | undefined
+): Promise<void> {
+  await applyDeltas(userId, { fraudFlags: Number(Boolean(newFlag)) - Number(Boolean(oldFlag)) });
+}
+
+/**
+ * The user's aggregate document, or null if none has been recorded yet
+ */
+export async function getReturnAggregate(userId: mongoose.Types.ObjectId | string): Promise<Record<string, any> | null> {
+  return (await aggregates()).findOne({ _id: toUserId(userId) as any });
+}
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Shared MongoDB access for the Python scripts
+
+One place for connection settings and write batching:
+
+- MONGODB_URI / DB_NAME are read once, from the environment or .env.
+- get_client() returns one pooled, compressed MongoClient per process.
+  The client is recreated after a fork, so process pool workers can call it.
+  get_async_client() creates an AsyncMongoClient with the same settings.
+- BulkWriter buffers write operations. It flushes them as unordered
+  bulk_write calls once a count or byte threshold is reached, retries
+  transient errors, and counts throughput.
+
+Tuning via environment variables:
+    MONGO_MAX_POOL_SIZE   connections per client (default: 50)
+    MONGO_COMPRESSORS     wire compression, in preference order (default: zstd,snappy,zlib;
+                          compressors whose Python module isn't installed are skipped)
+    MONGO_WRITE_CONCERN   w for bulk writes, e.g. 1 or majority (default: 1)
+    MONGO_BULK_RETRIES    retries of a failed bulk write (default: 3)
+"""
+
+import importlib.util
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient, InsertOne, MongoClient, ReplaceOne, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/vector_returns")
+
+def database_name(uri: str, default: str = "vector_returns") -> str:
+    """Database name from the URI path, ignoring any ?options"""
+    path = uri.split("://", 1)[-1].split("/", 1)
+    name = path[1].split("?", 1)[0] if len(path) > 1 else ""
+    return name or default
+
+DB_NAME = database_name(MONGODB_URI)
+
+# Python modules pymongo needs for each wire compressor
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+# Server error codes worth retrying (network blips, elections, throttling)
+RETRYABLE_ERROR_CODES = {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436, 16500}
+DUPLICATE_KEY_ERROR = 11000
+
+_client: Optional[MongoClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+def available_compressors() -> List[str]:
+    """Configured compressors whose Python module is importable"""
+    configured = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+    return [name.strip() for name in configured.split(",")
+            if name.strip() in _COMPRESSOR_MODULES
+            and importlib.util.find_spec(_COMPRESSOR_MODULES[name.strip()]) is not None]
+
+def client_options(**overrides: Any) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "retryWrites": True,
+        "retryReads": True,
+    }
+    compressors = available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    options.update(overrides)
+    return options
+
+def get_client(**overrides: Any) -> MongoClient:
+    """The process-wide client; overrides only apply when it is first created"""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            # A client inherited through fork must not be reused
+            _client = MongoClient(MONGODB_URI, **client_options(**overrides))
+            _client_pid = os.getpid()
+        return _client
+
+def get_db(**overrides: Any):
+    return get_client(**overrides)[DB_NAME]
+
+def get_async_client(**overrides: Any) -> AsyncMongoClient:
+    """A new pooled AsyncMongoClient with the same settings.
+
+    Async clients are bound to the event loop that uses them, so each
+    loop creates and closes its own.
+    """
+    return AsyncMongoClient(MONGODB_URI, **client_options(**overrides))
+
+def close_client():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client, _client_pid = None, None
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ConnectionFailure):
+        return True
+    if isinstance(error, OperationFailure) and not isinstance(error, BulkWriteError):
+        return error.code in RETRYABLE_ERROR_CODES or error.has_error_label("RetryableWriteError")
+    return False
+
+class BulkWriter:
+    """Buffers write operations and sends them as unordered bulk writes.
+
+    Flushes when `max_ops` operations or roughly `max_bytes` of BSON are
+    buffered, on flush(), and when used as a context manager, on exit.
+    Bytes are measured from the arguments of insert(), update_one() and
+    replace_one(); a write model passed to add() only counts towards
+    max_bytes with an explicit `size`.
+    Transient failures are retried with exponential backoff (see
+    write_with_retry). `counts` accumulates the bulk write results, and
+    `rate()` is operations per second.
+    """
+
+    def __init__(self, collection, max_ops: int = 1000, max_bytes: Optional[int] = None,
+                 ordered: bool = False, retries: Optional[int] = None, backoff_seconds: float = 0.5):
+        write_concern = os.getenv("MONGO_WRITE_CONCERN")
+        if write_concern:
+            w = int(write_concern) if write_concern.isdigit() else write_concern
+            collection = collection.with_options(write_concern=WriteConcern(w=w))
+        self.collection = collection
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self.ordered = ordered
+        self.retries = int(os.getenv("MONGO_BULK_RETRIES", "3")) if retries is None else retries
+        self.backoff_seconds = backoff_seconds
+        self.operations: List[Any] = []
+        self.buffered_bytes = 0
+        self.counts = Counter()
+        self.started = time.perf_counter()
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def insert(self, document: Any):
+        self.add(InsertOne(document), self._size(document))
+
+    def update_one(self, filter: Dict[str, Any], update: Any, upsert: bool = False):
+        self.add(UpdateOne(filter, update, upsert=upsert), self._size(filter, update))
+
+    def replace_one(self, filter: Dict[str, Any], replacement: Any, upsert: bool = False):
+        self.add(ReplaceOne(filter, replacement, upsert=upsert), self._size(filter, replacement))
+
+    def add(self, operation: Any, size: int = 0):
+        """Buffer any pymongo write model (InsertOne, UpdateOne, ReplaceOne, ...), `size` bytes of BSON"""
+        self.operations.append(operation)
+        self.buffered_bytes += size
+        if len(self.operations) >= self.max_ops or \
+                (self.max_bytes is not None and self.buffered_bytes >= self.max_bytes):
+            self.flush()
+
+    def flush(self) -> Dict[str, int]:
+        """Write everything buffered; returns this flush's result counts"""
+        if not self.operations:
+            return {}
+        operations, self.operations, self.buffered_bytes = self.operations, [], 0
+        result = write_with_retry(self.collection, operations, self.ordered, self.retries, self.backoff_seconds)
+        self.counts.update(result)
+        self.counts["operations"] += len(operations)
+        self.counts["flushes"] += 1
+        return result
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.counts["operations"] / elapsed if elapsed > 0 else 0.0
+
+    def _size(self, *documents: Any) -> int:
+        if self.max_bytes is None:
+            return 0
+        return sum(_bson_size(document) for document in documents)
+
+def _bson_size(document: Any) -> int:
+    """Encoded size of a document, or of a pipeline's stages"""
+    if isinstance(document, RawBSONDocument):
+        return len(document.raw)
+    if isinstance(document, dict):
+        return len(bson.encode(document))
+    if isinstance(document, list):
+        return sum(_bson_size(stage) for stage in document)
+    return 0
+
+def write_with_retry(collection, operations: List[Any], ordered: bool = False,
+                     retries: int = 3, backoff_seconds: float = 0.5) -> Dict[str, int]:
+    """One bulk_write with retries of transient errors; returns result counts.
+
+    When individual operations fail with a retryable code, only those
+    operations are resent, or, for ordered writes, everything from the
+    first failure on. After a connection error the whole batch is
+    resent. Inserts and $set updates are safe to resend; $inc updates
+    may apply twice after a connection error.
+    """
+    counts = Counter()
+    pending = operations
+    attempt = 0
+    while True:
+        try:
+            result = collection.bulk_write(pending, ordered=ordered)
+            counts.update(_result_counts(result.bulk_api_result))
+            break
+        except BulkWriteError as e:
+            counts.update(_result_counts(e.details))
+            errors = e.details.get("writeErrors", [])
+            if attempt > 0:
+                # Inserts the earlier attempt wrote before the connection dropped
+                duplicates = [error for error in errors if error.get("code") == DUPLICATE_KEY_ERROR]
+                counts["inserted"] += len(duplicates)
+                errors = [error for error in errors if error.get("code") != DUPLICATE_KEY_ERROR]
+            if not errors and not e.details.get("writeConcernErrors"):
+                break
+            if attempt >= retries or e.details.get("writeConcernErrors") or \
+                    any(error.get("code") not in RETRYABLE_ERROR_CODES for error in errors):
+                raise
+            failed = sorted(error["index"] for error in errors)
+            pending = pending[failed[0]:] if ordered else [pending[index] for index in failed]
+        except Exception as e:
+            if attempt >= retries or not _is_retryable(e):
+                raise
+
+        attempt += 1
+        counts["retries"] += 1
+        time.sleep(backoff_seconds * (2 ** (attempt - 1)))
+    return dict(counts)
+
+def _result_counts(details: Dict[str, Any]) -> Dict[str, int]:
+    return {
+        "inserted": details.get("nInserted", 0),
+        "matched": details.get("nMatched", 0),
+        "modified": details.get("nModified", 0),
+        "upserted": details.get("nUpserted", 0),
+        "deleted": details.get("nRemoved", 0),
+    }
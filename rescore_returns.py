@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Script to rescore every return in the database with the current fraud model
+
+Streams db.returns sorted by user, so each user's history is read once,
+scores chunks of users across a process pool and writes the results back
+with unordered bulk writes. Progress is checkpointed per user so an
+interrupted run can be resumed with --resume.
+
+Model artifacts are picked up the same way as return_fraud_predictor.py
+(FRAUD_MODEL_DIR, FRAUD_MODEL_BUNDLE, FRAUD_KERNEL_PATH, ...).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from mongo_pool import MONGODB_URI, BulkWriter, close_client, get_db
+from return_fraud_predictor import ReturnFraudPredictor
+
+# Only the fields the feature extractor reads
+RETURN_PROJECTION = {
+    "userId": 1, "price": 1, "reason": 1, "description": 1, "imageUrl": 1,
+    "status": 1, "fraudFlag": 1, "createdAt": 1,
+}
+
+DEFAULT_CHECKPOINT = ".rescore_checkpoint.json"
+
+# Set once per worker process by _init_worker
+_worker_predictor: Optional[ReturnFraudPredictor] = None
+
+def _init_worker():
+    """Load the model once per worker process"""
+    global _worker_predictor
+    _worker_predictor = ReturnFraudPredictor()
+
+def score_user_groups(user_groups: List[List[Dict[str, Any]]]) -> List[Tuple[Any, Dict[str, Any]]]:
+    """Score every return of each user against the returns that came before it.
+
+    Each group holds one user's returns sorted by createdAt. Returns a list
+    of (return _id, score result) pairs.
+    """
+    predictor = _worker_predictor
+    total = sum(len(returns) for returns in user_groups)
+    features = np.zeros((total, len(predictor.feature_columns)), dtype=np.float64)
+    return_ids = []
+    spans = []  # (first row, end row) of each user whose features were extracted
+    failed = []
+
+    for returns in user_groups:
+        # Each return against the user's earlier returns, in one sweep per user
+        row = len(return_ids)
+        try:
+            predictor.extract_point_in_time_matrix(returns, out=features[row:row + len(returns)])
+            return_ids.extend(return_doc["_id"] for return_doc in returns)
+            spans.append((row, row + len(returns)))
+        except Exception as e:
+            failed.extend((return_doc["_id"], {"error": str(e)}) for return_doc in returns)
+
+    # A user with rows the model can't take fails alone, not the whole chunk
+    features = features[:len(return_ids)]
+    scorable = predictor.scorable_rows(features)
+    keep = np.ones(len(return_ids), dtype=bool)
+    for start, end in spans:
+        if not scorable[start:end].all():
+            keep[start:end] = False
+            error = {"error": str(predictor.invalid_row_error(features[start + np.argmin(scorable[start:end])]))}
+            failed.extend((return_id, error) for return_id in return_ids[start:end])
+
+    return_ids = [return_id for return_id, kept in zip(return_ids, keep) if kept]
+    results = predictor.score_feature_matrix(features[keep]) if return_ids else []
+    return list(zip(return_ids, results)) + failed
+
+def iter_user_chunks(collection, chunk_size: int, after_user_id: Any = None) -> Iterator[Tuple[List[List[Dict[str, Any]]], Any]]:
+    """Yield (user groups, last userId) chunks of roughly chunk_size returns"""
+    query = {"userId": {"$gt": after_user_id}} if after_user_id is not None else {}
+    cursor = collection.find(query, RETURN_PROJECTION,
+                             sort=[("userId", 1), ("createdAt", 1)], batch_size=chunk_size)
+
+    groups: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_user = None
+    size = 0
+
+    for return_doc in cursor:
+        user_id = return_doc.get("userId")
+        if current and user_id != current_user:
+            groups.append(current)
+            size += len(current)
+            current = []
+            # Only cut chunks between users so each history stays whole
+            if size >= chunk_size:
+                yield groups, current_user
+                groups, size = [], 0
+        current_user = user_id
+        current.append(return_doc)
+
+    if current:
+        groups.append(current)
+    if groups:
+        yield groups, current_user
+
+def build_update(return_id: Any, result: Dict[str, Any], scored_at: datetime) -> UpdateOne:
+    return UpdateOne({"_id": return_id}, {"$set": {
+        "mlRiskScore": result["risk_score"],
+        "mlRiskLevel": result["risk_level"],
+        "mlPrediction": result["prediction"],
+        "mlConfidence": result["confidence"],
+        "mlModelVersion": result.get("model_version"),
+        "mlScoredAt": scored_at,
+    }})
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(path: str, last_user_id: Any, scored: int, failed: int):
+    """Atomically record the last fully written user"""
+    checkpoint = {
+        "lastUserId": str(last_user_id),
+        "lastUserIdIsObjectId": isinstance(last_user_id, ObjectId),
+        "scored": scored,
+        "failed": failed,
+        "updatedAt": datetime.now().isoformat(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def rescore_returns(chunk_size: int, workers: int, checkpoint_path: str, resume: bool, dry_run: bool):
+    """Rescore all returns and write the results back to db.returns"""
+    try:
+        # Connect to MongoDB
+        db = get_db()
+        returns_collection = db.returns
+
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        after_user_id = None
+        scored = failed = 0
+        checkpoint = load_checkpoint(checkpoint_path) if resume else None
+        if checkpoint:
+            after_user_id = checkpoint["lastUserId"]
+            if checkpoint.get("lastUserIdIsObjectId"):
+                after_user_id = ObjectId(after_user_id)
+            scored, failed = checkpoint.get("scored", 0), checkpoint.get("failed", 0)
+            print(f"⏩ Resuming after user {after_user_id} ({scored} returns already scored)")
+
+        started = time.perf_counter()
+        run_scored = 0
+        scored_at = datetime.now()
+        # Futures in submission order, so the checkpoint only moves past finished users
+        in_flight = deque()
+        writer = BulkWriter(returns_collection, max_ops=chunk_size)
+
+        def drain(block: bool):
+            nonlocal scored, failed, run_scored
+            while in_flight and (block or in_flight[0][0].done()):
+                future, last_user_id = in_flight.popleft()
+                succeeded = 0
+                for return_id, result in future.result():
+                    if "error" in result:
+                        failed += 1
+                        continue
+                    succeeded += 1
+                    if not dry_run:
+                        writer.add(build_update(return_id, result, scored_at))
+                scored += succeeded
+                run_scored += succeeded
+                if not dry_run:
+                    # Everything before the checkpoint must be written
+                    writer.flush()
+                    save_checkpoint(checkpoint_path, last_user_id, scored, failed)
+
+                elapsed = time.perf_counter() - started
+                print(f"   Scored {scored} returns ({failed} failed) - {run_scored / elapsed:,.0f} returns/sec")
+                block = False
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for user_groups, last_user_id in iter_user_chunks(returns_collection, chunk_size, after_user_id):
+                in_flight.append((pool.submit(score_user_groups, user_groups), last_user_id))
+                # Keep a bounded number of chunks in memory
+                if len(in_flight) >= workers * 2:
+                    drain(block=True)
+                else:
+                    drain(block=False)
+            while in_flight:
+                drain(block=True)
+
+        elapsed = time.perf_counter() - started
+        print(f"\n🎉 Rescoring completed!")
+        print(f"   ✅ Scored: {scored} returns")
+        print(f"   ❌ Failed: {failed} returns")
+        print(f"   ⚡ Throughput: {run_scored / elapsed if elapsed else 0:,.0f} returns/sec ({elapsed:.1f}s)")
+
+        if os.path.exists(checkpoint_path) and not dry_run:
+            os.remove(checkpoint_path)
+
+    except Exception as e:
+        print(f"❌ Error rescoring returns: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore every return with the current fraud model")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Returns per worker task (default: 5000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help=f"Checkpoint file (default: {DEFAULT_CHECKPOINT})")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last checkpointed user")
+    parser.add_argument("--dry-run", action="store_true", help="Score everything but don't write results")
+    args = parser.parse_args()
+
+    print("🚀 Starting bulk return rescoring...")
+    print(f"📍 MongoDB URI: {MONGODB_URI}")
+    print("-" * 50)
+
+    rescore_returns(args.chunk_size, args.workers, args.checkpoint, args.resume, args.dry_run)
@@ -1,27 +1,50 @@
 #!/usr/bin/env python3
 """
 Script to clear and reseed the database
+
+Commands:
+    python reseed_database.py                  # clear and reseed via the /api/seed endpoint
+    python reseed_database.py snapshot         # save collections to snapshots/latest
+    python reseed_database.py restore          # drop and reload collections from snapshots/latest
+
+Snapshots hold one gzip-compressed BSON file per collection plus a
+manifest.json with document counts and index definitions. Restore drops
+each collection, reloads it with parallel unordered bulk insert batches
+(retrying transient errors) and then recreates its indexes, so no web server is needed.
+Restoring returns without their returnaggregates (e.g. from an older
+snapshot) rebuilds the aggregates from the restored returns.
 """
 
+import argparse
+import gzip
+import json
 import os
 import sys
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+from bson import decode_file_iter
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import IndexModel, InsertOne
 import requests
 
-# Load environment variables
-load_dotenv()
+from mongo_pool import DB_NAME, MONGODB_URI, close_client, get_db, write_with_retry
+from return_feature_store import AGGREGATE_COLLECTION, rebuild_aggregates
 
-# MongoDB connection
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/vector_returns")
-DB_NAME = MONGODB_URI.split("/")[-1] if "/" in MONGODB_URI else "vector_returns"
+SNAPSHOT_COLLECTIONS = ["users", "orders", "returns", AGGREGATE_COLLECTION, "inventories", "automationlogs"]
+DEFAULT_SNAPSHOT_DIR = os.path.join("snapshots", "latest")
+MANIFEST_FILENAME = "manifest.json"
+
+# Documents stay as raw BSON bytes; they are never decoded on either side
+RAW_BSON = CodecOptions(document_class=RawBSONDocument)
 
 def clear_and_reseed():
     """Clear database and reseed via API"""
     try:
         # Connect to MongoDB and clear collections
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
+        db = get_db()
         
         print(f"Connected to MongoDB: {MONGODB_URI}")
         
@@ -34,7 +57,7 @@ def clear_and_reseed():
         
         print("✅ Cleared existing data")
         
-        client.close()
+        close_client()
         
         # Call seed API
         print("Calling seed API...")
@@ -48,10 +71,168 @@ def clear_and_reseed():
         else:
             print(f"❌ Failed to reseed: {response.status_code}")
             print(response.text)
+    
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def _index_specs(collection) -> List[Dict[str, Any]]:
+    """Index definitions other than _id, as JSON-safe dicts"""
+    specs = []
+    for name, info in collection.index_information().items():
+        if name == "_id_":
+            continue
+        options = {key: value for key, value in info.items() if key not in ("key", "v", "ns")}
+        specs.append({"name": name, "key": [[field, direction] for field, direction in info["key"]], "options": options})
+    return specs
+
+def _index_keys(spec: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """An index's key as create_indexes takes it.
+
+    The server lists a text index's fields as _fts/_ftsx; they are rebuilt
+    as (field, "text") from its weights, which the spec's options keep.
+    """
+    keys = []
+    for field, direction in spec["key"]:
+        if field == "_fts":
+            keys.extend((text_field, "text") for text_field in spec["options"].get("weights", {}))
+        elif field != "_ftsx":
+            keys.append((field, direction))
+    return keys
+
+def snapshot_collection(db, name: str, snapshot_dir: str) -> Dict[str, Any]:
+    """Stream one collection into <name>.bson.gz; returns its manifest entry"""
+    collection = db.get_collection(name, codec_options=RAW_BSON)
+    path = os.path.join(snapshot_dir, f"{name}.bson.gz")
+    count = 0
+    with gzip.open(path + ".tmp", "wb", compresslevel=1) as f:
+        for doc in collection.find(batch_size=10000):
+            f.write(doc.raw)
+            count += 1
+    os.replace(path + ".tmp", path)
+    return {"file": os.path.basename(path), "count": count, "indexes": _index_specs(collection)}
+
+def snapshot(snapshot_dir: str, collections: List[str], workers: int):
+    """Save collections to a snapshot directory"""
+    try:
+        db = get_db(maxPoolSize=max(workers * 2, 10))
+        
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        started = time.perf_counter()
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            entries = dict(zip(collections, pool.map(lambda name: snapshot_collection(db, name, snapshot_dir),
+                                                     collections)))
+        
+        manifest = {"database": DB_NAME, "createdAt": datetime.now().isoformat(), "collections": entries}
+        manifest_path = os.path.join(snapshot_dir, MANIFEST_FILENAME)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        
+        elapsed = time.perf_counter() - started
+        print(f"\n✅ Snapshot saved to {snapshot_dir} in {elapsed:.1f}s")
+        for name, entry in entries.items():
+            print(f"   {name}: {entry['count']} documents, {len(entry['indexes'])} indexes")
+    
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+    
+    finally:
+        close_client()
+
+def _read_batches(path: str, batch_size: int) -> Iterator[List[RawBSONDocument]]:
+    with gzip.open(path, "rb") as f:
+        batch = []
+        for doc in decode_file_iter(f, codec_options=RAW_BSON):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def restore_collection(db, name: str, entry: Dict[str, Any], snapshot_dir: str,
+                       pool: ThreadPoolExecutor, batch_size: int, workers: int) -> int:
+    """Drop a collection, reload it in parallel batches and rebuild its indexes"""
+    db.drop_collection(name)
+    collection = db.get_collection(name, codec_options=RAW_BSON)
+    
+    inserted = 0
+    in_flight = []
+    for batch in _read_batches(os.path.join(snapshot_dir, entry["file"]), batch_size):
+        in_flight.append(pool.submit(write_with_retry, collection, [InsertOne(doc) for doc in batch]))
+        # Bound the batches held in memory
+        if len(in_flight) >= workers * 2:
+            inserted += in_flight.pop(0).result().get("inserted", 0)
+    for future in in_flight:
+        inserted += future.result().get("inserted", 0)
+    
+    # Building indexes once after the load is cheaper than maintaining them per insert
+    indexes = [IndexModel(_index_keys(spec), name=spec["name"], **spec["options"])
+               for spec in entry.get("indexes", [])]
+    if indexes:
+        collection.create_indexes(indexes)
+    return inserted
+
+def restore(snapshot_dir: str, collections: List[str], workers: int, batch_size: int):
+    """Replace collections with the contents of a snapshot directory"""
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILENAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        
+        db = get_db(maxPoolSize=max(workers * 2, 10))
+        
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+        started = time.perf_counter()
+        
+        names = [name for name in collections if name in manifest["collections"]]
+        for name in set(collections) - set(names):
+            print(f"⚠️  {name} is not in the snapshot; leaving it untouched")
+        
+        with ThreadPoolExecutor(max_workers=workers) as insert_pool, \
+                ThreadPoolExecutor(max_workers=len(names) or 1) as collection_pool:
+            counts = dict(zip(names, collection_pool.map(
+                lambda name: restore_collection(db, name, manifest["collections"][name], snapshot_dir,
+                                                insert_pool, batch_size, workers),
+                names)))
+        
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        print(f"\n✅ Restored {total} documents from {snapshot_dir} in {elapsed:.1f}s "
+              f"({total / elapsed if elapsed else 0:,.0f} docs/sec)")
+        for name, count in counts.items():
+            expected = manifest["collections"][name]["count"]
+            marker = "" if count == expected else f" (expected {expected})"
+            print(f"   {name}: {count} documents{marker}")
         
+        # The app scores new returns from the aggregates, so they must match the restored returns
+        if "returns" in counts and AGGREGATE_COLLECTION not in counts:
+            print(f"   🔄 Rebuilt {AGGREGATE_COLLECTION} for {rebuild_aggregates(db, batch_size)} users")
+    
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         sys.exit(1)
+    
+    finally:
+        close_client()
 
 if __name__ == "__main__":
-    clear_and_reseed()
+    parser = argparse.ArgumentParser(description="Reseed the database, or snapshot and restore collections")
+    parser.add_argument("command", nargs="?", choices=["reseed", "snapshot", "restore"], default="reseed",
+                        help="reseed via /api/seed (default), snapshot collections or restore a snapshot")
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help=f"Snapshot directory (default: {DEFAULT_SNAPSHOT_DIR})")
+    parser.add_argument("--collections", nargs="+", default=SNAPSHOT_COLLECTIONS,
+                        help=f"Collections to snapshot or restore (default: {' '.join(SNAPSHOT_COLLECTIONS)})")
+    parser.add_argument("--workers", type=int, default=8, help="Collections saved in parallel by snapshot, and parallel bulk inserts during restore (default: 8)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per bulk insert (default: 5000)")
+    args = parser.parse_args()
+    
+    if args.command == "snapshot":
+        snapshot(args.dir, args.collections, max(1, args.workers))
+    elif args.command == "restore":
+        restore(args.dir, args.collections, max(1, args.workers), max(1, args.batch_size))
+    else:
+        clear_and_reseed()
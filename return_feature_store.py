@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Per-user return aggregate store
+
+Keeps running totals of a user's return history (counts, amount sums and
+maxima, first/last timestamps and daily buckets for the 30/90-day windows)
+so ReturnFraudPredictor can score a return from one small record instead of
+the full history. Every update is O(1).
+
+Returns created or changed by the app update the aggregates as they happen
+(lib/returnAggregateStore.ts applies the same updates as
+MongoAggregateStore); rebuild recomputes them from db.returns, e.g. after
+a bulk import.
+
+Usage:
+    python return_feature_store.py rebuild            # rebuild from db.returns
+    python return_feature_store.py show <userId>      # print one aggregate
+"""
+
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+# Longest window the predictor looks at; older day buckets are dropped
+WINDOW_DAYS = 90
+
+AGGREGATE_COLLECTION = "returnaggregates"
+
+# Statuses that have their own running count
+STATUS_COUNT_FIELDS = {'approved': 'approvedReturns', 'rejected': 'rejectedReturns'}
+
+def to_float(value: Any) -> float:
+    """Coerce a JSON number (or null) to float, mapping missing values to NaN"""
+    if value is None:
+        return float("nan")
+    return float(value)
+
+def utc_now() -> datetime:
+    """The current time as a naive UTC datetime, like the dates pymongo returns"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def parse_created_at(value: Any) -> Optional[datetime]:
+    """Parse a createdAt value into a naive UTC datetime (None if missing).
+
+    Naive datetimes are taken to be UTC already, as pymongo returns them;
+    aware ones and ISO strings with an offset or "Z" are converted.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)):
+        # JavaScript-style epoch milliseconds
+        return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+class UserReturnAggregate:
+    """Running feature aggregates for one user's returns"""
+
+    def __init__(self):
+        self.total_returns = 0
+        self.approved_returns = 0
+        self.rejected_returns = 0
+        self.fraud_flags = 0
+        self.created_count = 0
+        self.first_created_at: Optional[datetime] = None
+        self.last_created_at: Optional[datetime] = None
+        self.price_count = 0
+        self.price_sum = 0.0
+        self.price_max: Optional[float] = None
+        # UTC date ordinal -> number of returns created that day
+        self.day_buckets: Dict[int, int] = {}
+
+    def add_return(self, return_doc: Dict[str, Any]):
+        """Fold a newly created return into the aggregate"""
+        self.total_returns += 1
+        self._count_status(return_doc.get('status'), 1)
+        if return_doc.get('fraudFlag', False) == True:  # noqa: E712 - same test as the extractors
+            self.fraud_flags += 1
+
+        created_at = parse_created_at(return_doc.get('createdAt'))
+        if created_at is not None:
+            self.created_count += 1
+            if self.first_created_at is None or created_at < self.first_created_at:
+                self.first_created_at = created_at
+            if self.last_created_at is None or created_at > self.last_created_at:
+                self.last_created_at = created_at
+
+            day = created_at.toordinal()
+            self.day_buckets[day] = self.day_buckets.get(day, 0) + 1
+            self.prune_buckets(self.last_created_at)
+
+        price = to_float(return_doc.get('price'))
+        if price == price:  # not NaN
+            self.price_count += 1
+            self.price_sum += price
+            if self.price_max is None or price > self.price_max:
+                self.price_max = price
+
+    def change_status(self, old_status: Optional[str], new_status: Optional[str]):
+        """Move a return between approved/rejected/other counts"""
+        self._count_status(old_status, -1)
+        self._count_status(new_status, 1)
+
+    def change_fraud_flag(self, old_flag: bool, new_flag: bool):
+        """Apply a fraudFlag change on an existing return"""
+        self.fraud_flags = max(0, self.fraud_flags + int(bool(new_flag)) - int(bool(old_flag)))
+
+    def _count_status(self, status: Optional[str], delta: int):
+        # Counts never go negative, even for a change to a return the aggregate missed
+        if status == 'approved':
+            self.approved_returns = max(0, self.approved_returns + delta)
+        elif status == 'rejected':
+            self.rejected_returns = max(0, self.rejected_returns + delta)
+
+    def prune_buckets(self, now: datetime):
+        """Drop day buckets that can no longer fall inside any window"""
+        oldest_day = (now - timedelta(days=WINDOW_DAYS)).toordinal()
+        for day in [day for day in self.day_buckets if day < oldest_day]:
+            del self.day_buckets[day]
+
+    def to_features(self, now: Optional[datetime] = None) -> Dict[str, float]:
+        """History features with the same names and meaning as extract_features.
+
+        Window counts use whole UTC days, so a return created on the cutoff
+        day itself is counted; the raw-history extractors compare exact times.
+        Returns are assumed to carry price and createdAt fields (possibly
+        null), as stored returns do, so missing values give NaN where
+        extract_feature_vector gives NaN.
+        """
+        if self.total_returns == 0:
+            return {}
+
+        now = now or utc_now()
+        cutoff_30 = (now - timedelta(days=30)).toordinal()
+        cutoff_90 = (now - timedelta(days=90)).toordinal()
+        today = now.toordinal()
+
+        features = {
+            'total_returns': self.total_returns,
+            'approved_returns': self.approved_returns,
+            'rejected_returns': self.rejected_returns,
+            'fraud_flags': self.fraud_flags,
+        }
+
+        features['returns_last_30_days'] = sum(
+            count for day, count in self.day_buckets.items() if cutoff_30 <= day <= today)
+        features['returns_last_90_days'] = sum(
+            count for day, count in self.day_buckets.items() if cutoff_90 <= day <= today)
+        if self.total_returns > 1:
+            if self.created_count > 1:
+                span_days = (self.last_created_at - self.first_created_at).total_seconds() / (24 * 3600)
+                features['avg_days_between_returns'] = span_days / (self.created_count - 1)
+            else:
+                features['avg_days_between_returns'] = float('nan')
+
+        if self.price_count:
+            features['avg_return_amount'] = self.price_sum / self.price_count
+            features['max_return_amount'] = self.price_max
+        else:
+            features['avg_return_amount'] = float('nan')
+            features['max_return_amount'] = float('nan')
+        features['total_return_amount'] = self.price_sum
+
+        return features
+
+    def to_document(self) -> Dict[str, Any]:
+        """Serialize to a MongoDB/JSON-friendly document"""
+        return {
+            'totalReturns': self.total_returns,
+            'approvedReturns': self.approved_returns,
+            'rejectedReturns': self.rejected_returns,
+            'fraudFlags': self.fraud_flags,
+            'createdCount': self.created_count,
+            'firstCreatedAt': self.first_created_at,
+            'lastCreatedAt': self.last_created_at,
+            'priceCount': self.price_count,
+            'priceSum': self.price_sum,
+            'priceMax': self.price_max,
+            'dayBuckets': {str(day): count for day, count in self.day_buckets.items()},
+        }
+
+    @classmethod
+    def from_document(cls, document: Optional[Dict[str, Any]]) -> "UserReturnAggregate":
+        """Rebuild an aggregate from to_document output (missing fields default to empty)"""
+        aggregate = cls()
+        if not document:
+            return aggregate
+
+        aggregate.total_returns = document.get('totalReturns', 0)
+        aggregate.approved_returns = document.get('approvedReturns', 0)
+        aggregate.rejected_returns = document.get('rejectedReturns', 0)
+        aggregate.fraud_flags = document.get('fraudFlags', 0)
+        aggregate.created_count = document.get('createdCount', 0)
+        aggregate.first_created_at = parse_created_at(document.get('firstCreatedAt'))
+        aggregate.last_created_at = parse_created_at(document.get('lastCreatedAt'))
+        aggregate.price_count = document.get('priceCount', 0)
+        aggregate.price_sum = document.get('priceSum', 0.0)
+        aggregate.price_max = document.get('priceMax')
+        aggregate.day_buckets = {int(day): count for day, count in (document.get('dayBuckets') or {}).items()}
+        return aggregate
+
+class JsonFileAggregateStore:
+    """Aggregates kept in memory and persisted to one local JSON file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.aggregates: Dict[str, UserReturnAggregate] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for user_id, document in json.load(f).items():
+                    self.aggregates[user_id] = UserReturnAggregate.from_document(document)
+
+    def get(self, user_id: str) -> UserReturnAggregate:
+        return self.aggregates.get(str(user_id)) or UserReturnAggregate()
+
+    def _get_or_create(self, user_id: str) -> UserReturnAggregate:
+        return self.aggregates.setdefault(str(user_id), UserReturnAggregate())
+
+    def record_return(self, user_id: str, return_doc: Dict[str, Any]):
+        self._get_or_create(user_id).add_return(return_doc)
+
+    def record_status_change(self, user_id: str, old_status: Optional[str], new_status: Optional[str]):
+        # A user without an aggregate has no counts to adjust
+        if str(user_id) in self.aggregates:
+            self.aggregates[str(user_id)].change_status(old_status, new_status)
+
+    def record_fraud_flag_change(self, user_id: str, old_flag: bool, new_flag: bool):
+        if str(user_id) in self.aggregates:
+            self.aggregates[str(user_id)].change_fraud_flag(old_flag, new_flag)
+
+    def save(self):
+        """Atomically write every aggregate back to the JSON file"""
+        documents = {user_id: aggregate.to_document() for user_id, aggregate in self.aggregates.items()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(documents, f, default=lambda value: value.isoformat())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+class MongoAggregateStore:
+    """Aggregates kept in a MongoDB collection, updated with atomic operators"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, user_id: Any) -> UserReturnAggregate:
+        document = self.collection.find_one({'_id': user_id})
+        aggregate = UserReturnAggregate.from_document(document)
+
+        # Expired buckets are only ever removed here, so the $inc path stays O(1)
+        if aggregate.last_created_at is not None:
+            expired = [day for day in aggregate.day_buckets
+                       if day < (aggregate.last_created_at - timedelta(days=WINDOW_DAYS)).toordinal()]
+            if expired:
+                self.collection.update_one(
+                    {'_id': user_id},
+                    {'$unset': {f'dayBuckets.{day}': '' for day in expired}}
+                )
+                aggregate.prune_buckets(aggregate.last_created_at)
+        return aggregate
+
+    def record_return(self, user_id: Any, return_doc: Dict[str, Any]):
+        update: Dict[str, Dict[str, Any]] = {'$inc': {'totalReturns': 1}}
+        status_field = STATUS_COUNT_FIELDS.get(return_doc.get('status'))
+        if status_field:
+            update['$inc'][status_field] = 1
+        if return_doc.get('fraudFlag', False) == True:  # noqa: E712
+            update['$inc']['fraudFlags'] = 1
+
+        created_at = parse_created_at(return_doc.get('createdAt'))
+        if created_at is not None:
+            update['$inc']['createdCount'] = 1
+            update['$inc'][f'dayBuckets.{created_at.toordinal()}'] = 1
+            update['$min'] = {'firstCreatedAt': created_at}
+            update['$max'] = {'lastCreatedAt': created_at}
+
+        price = to_float(return_doc.get('price'))
+        if price == price:
+            update['$inc']['priceCount'] = 1
+            update['$inc']['priceSum'] = price
+            update.setdefault('$max', {})['priceMax'] = price
+
+        self.collection.update_one({'_id': user_id}, update, upsert=True)
+
+    def record_status_change(self, user_id: Any, old_status: Optional[str], new_status: Optional[str]):
+        increments: Dict[str, int] = {}
+        for status, delta in ((old_status, -1), (new_status, 1)):
+            field = STATUS_COUNT_FIELDS.get(status)
+            if field:
+                increments[field] = increments.get(field, 0) + delta
+        self._apply_deltas(user_id, increments)
+
+    def record_fraud_flag_change(self, user_id: Any, old_flag: bool, new_flag: bool):
+        self._apply_deltas(user_id, {'fraudFlags': int(bool(new_flag)) - int(bool(old_flag))})
+
+    def _apply_deltas(self, user_id: Any, deltas: Dict[str, int]):
+        """Add to counts of an existing aggregate, clamping each at zero (no upsert)"""
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            self.collection.update_one({'_id': user_id}, clamped_increments(deltas))
+
+def clamped_increments(deltas: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Update pipeline adding each delta to its field without going below zero"""
+    return [{'$set': {field: {'$max': [0, {'$add': [{'$ifNull': [f'${field}', 0]}, delta]}]}
+                      for field, delta in deltas.items()}}]
+
+def rebuild_aggregates(db, batch_size: int = 1000, user_ids: Optional[Iterable[Any]] = None) -> int:
+    """Recompute users' aggregates from db.returns (every user's by default); returns the user count"""
+    from mongo_pool import BulkWriter
+
+    if user_ids is None:
+        queries = [{}]
+    else:
+        user_ids = list(user_ids)
+        queries = [{'userId': {'$in': user_ids[start:start + batch_size]}}
+                   for start in range(0, len(user_ids), batch_size)]
+
+    projection = {'userId': 1, 'status': 1, 'fraudFlag': 1, 'createdAt': 1, 'price': 1}
+    rebuilt = 0
+    with BulkWriter(db[AGGREGATE_COLLECTION], max_ops=batch_size) as writer:
+        for query in queries:
+            aggregates: Dict[Any, UserReturnAggregate] = {}
+            for return_doc in db.returns.find(query, projection):
+                user_id = return_doc.get('userId')
+                aggregates.setdefault(user_id, UserReturnAggregate()).add_return(return_doc)
+            for user_id, aggregate in aggregates.items():
+                writer.replace_one({'_id': user_id}, aggregate.to_document(), upsert=True)
+            rebuilt += len(aggregates)
+
+    return rebuilt
+
+def main():
+    """Main function for CLI usage"""
+    from bson import ObjectId
+
+    from mongo_pool import close_client, get_db
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "show"):
+        print("Usage: python return_feature_store.py rebuild")
+        print("       python return_feature_store.py show <userId>")
+        sys.exit(1)
+
+    try:
+        db = get_db()
+        if sys.argv[1] == "rebuild":
+            users = rebuild_aggregates(db)
+            print(f"✅ Rebuilt return aggregates for {users} users")
+        else:
+            user_id = ObjectId(sys.argv[2]) if ObjectId.is_valid(sys.argv[2]) else sys.argv[2]
+            aggregate = MongoAggregateStore(db[AGGREGATE_COLLECTION]).get(user_id)
+            print(json.dumps(aggregate.to_features(), indent=2))
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+    finally:
+        close_client()
+
+if __name__ == "__main__":
+    main()
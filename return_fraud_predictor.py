@@ -2,37 +2,567 @@
 """
 Return Fraud Detection ML Model
 Uses pickle files to predict return fraud risk
+
+One-shot usage:
+    python return_fraud_predictor.py <new_return_json> <historical_returns_json>
+    python return_fraud_predictor.py --user-id <userId> <new_return_json>
+    python return_fraud_predictor.py --aggregate <aggregate_json> <new_return_json>
+
+Batch usage (one JSON request per line, one JSON result per line):
+    python return_fraud_predictor.py --batch requests.jsonl
+
+Self-check (reports load time per artifact):
+    python return_fraud_predictor.py --warmup
+
+Artifact locations can be set with --model/--scaler/--features, the
+FRAUD_MODEL_PATH/FRAUD_SCALER_PATH/FRAUD_FEATURES_PATH variables or
+FRAUD_MODEL_DIR; --bundle (or FRAUD_MODEL_BUNDLE) loads all three from one
+file written with --build-bundle.
+
+NumPy kernel (scores without scikit-learn installed):
+    python return_fraud_predictor.py --export-kernel model/return_fraud_kernel.npz
+    python return_fraud_predictor.py --kernel model/return_fraud_kernel.npz --serve
+
+Server usage (model is loaded once and reused for every request):
+    python return_fraud_predictor.py --serve
+    python return_fraud_predictor.py --serve --socket /tmp/fraud.sock
+
+In server mode each request is one JSON object per line:
+    {"id": 1, "new_return": {...}, "historical_returns": [...]}
+or, with a per-user aggregate record from return_feature_store.py,
+    {"id": 1, "new_return": {...}, "aggregate": {...}}
+or, to have the history fetched from MongoDB (see user_history.py),
+    {"id": 1, "new_return": {...}, "userId": "..."}
+and each response is one JSON line with the same fields as score_return,
+plus the request "id". {"id": 1, "op": "cache_stats"} reports score cache
+hits and misses, and {"id": 1, "op": "metrics"} returns the Prometheus
+metrics text. Every score result carries the "model_version" that made it.
+
+Hot reload (serve the version a trained artifact directory's LATEST names,
+and switch to new versions without a restart):
+    python return_fraud_predictor.py --serve --versions-dir model/versions
+LATEST is checked every --reload-interval seconds; SIGHUP or
+{"id": 1, "op": "reload"} reloads immediately. A new version is loaded in
+the background and must score a smoke return before it is swapped in.
+
+Instrumentation is off by default; with --instrument (or FRAUD_INSTRUMENT=1)
+each result also carries "timings_ms" per stage (parse, extract,
+cache_lookup, scale, predict, total) and "history_size". With --serve,
+--metrics-port PORT serves the same counters and stage histograms on
+http://127.0.0.1:PORT/metrics (--metrics-host 0.0.0.0 exposes them on
+every interface).
+
+Score caching is off by default; set FRAUD_SCORE_CACHE=memory, or to a
+SQLite file path to share the cache between processes
+(FRAUD_SCORE_CACHE_SIZE and FRAUD_SCORE_CACHE_TTL bound it).
 """
 
+import argparse
+import hashlib
+import os
 import pickle
-import pandas as pd
+import signal
+import socketserver
+import sqlite3
+import threading
+import time
+import warnings
 import numpy as np
 import json
 import sys
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Dict, Any, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from return_feature_store import UserReturnAggregate, parse_created_at, to_float, utc_now
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# The NumPy feature path hands arrays to a scaler that was fitted on a DataFrame
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+# Artifacts are looked up in the working directory (legacy layout), then here
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+MODEL_FILENAME = "return_fraud_model.pkl"
+SCALER_FILENAME = "return_scaler.pkl"
+FEATURES_FILENAME = "feature_columns.pkl"
+
+# Versioned artifact directories (train_fraud_model.py): <dir>/<version>/, named by <dir>/LATEST
+VERSIONS_DIR = os.path.join(MODEL_DIR, "versions")
+LATEST_FILENAME = "LATEST"
+
+# Largest predict_proba difference accepted from an exported NumPy kernel
+KERNEL_TOLERANCE = 1e-6
+
+# Columns produced by extract_features, in its order; what train_fraud_model.py trains on
+FEATURE_COLUMNS = [
+    'return_amount', 'return_reason_encoded', 'description_length', 'has_image',
+    'total_returns', 'approved_returns', 'rejected_returns', 'fraud_flags',
+    'returns_last_30_days', 'returns_last_90_days', 'avg_days_between_returns',
+    'avg_return_amount', 'max_return_amount', 'total_return_amount'
+]
+
+# Return used to check that freshly loaded artifacts can actually score
+SMOKE_RETURN = {
+    "price": 1499,
+    "reason": "defective",
+    "description": "Stitching came apart after the first wash",
+    "imageUrl": "https://example.com/return.jpg",
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _microseconds(value: datetime) -> int:
+    """Naive datetime as integer microseconds, so window comparisons stay exact"""
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+def impute_scaled(features_scaled: np.ndarray) -> np.ndarray:
+    """Replace missing (NaN) scaled features with 0, the training mean.
+
+    Applied after scaling both when training (train_fraud_model.py) and when
+    scoring, so a history with null prices or unparseable dates yields the
+    same valid row in both.
+    """
+    return np.where(np.isnan(features_scaled), 0.0, features_scaled)
+
+def _resolve_artifact_path(explicit: Optional[str], env_var: str, filename: str) -> str:
+    """Pick an artifact path: argument, then env var, then FRAUD_MODEL_DIR, then defaults"""
+    if explicit:
+        return explicit
+    if os.getenv(env_var):
+        return os.getenv(env_var)
+    if os.getenv("FRAUD_MODEL_DIR"):
+        return os.path.join(os.getenv("FRAUD_MODEL_DIR"), filename)
+    if os.path.exists(filename):
+        return filename
+    return os.path.join(MODEL_DIR, filename)
+
+def _load_pickle_bytes(path: str) -> Tuple[Any, bytes]:
+    """Read an artifact in one go; falls back to joblib for joblib-written pickles"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return pickle.loads(data), data
+    except pickle.UnpicklingError:
+        import joblib  # Only needed for artifacts saved with joblib.dump
+        return joblib.load(path), data
+
+def validate_artifacts(model: Any, scaler: Any, feature_columns: List[str]):
+    """Fail fast if the model, scaler and feature order don't fit together"""
+    if not feature_columns or not all(isinstance(name, str) for name in feature_columns):
+        raise ValueError("feature_columns must be a non-empty list of column names")
+    if not hasattr(model, "predict_proba"):
+        raise ValueError(f"model {type(model).__name__} has no predict_proba")
+    if not hasattr(scaler, "transform"):
+        raise ValueError(f"scaler {type(scaler).__name__} has no transform")
+    
+    for name, estimator in [("scaler", scaler), ("model", model)]:
+        expected = getattr(estimator, "n_features_in_", None)
+        if expected is not None and expected != len(feature_columns):
+            raise ValueError(f"{name} expects {expected} features but feature_columns has {len(feature_columns)}")
+
+class NumpyKernel:
+    """Dependency-light evaluator for an exported scaler + model (.npz).
+
+    Acts as both the scaler (transform) and the model (predict_proba), so it
+    can stand in for the sklearn objects without importing sklearn. Supports
+    linear models (LogisticRegression, SGDClassifier) and tree models
+    (DecisionTree, RandomForest, ExtraTrees, binary GradientBoosting).
+    """
+    
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.kind = str(arrays["kind"])
+        self.version = str(arrays["version"])
+        self.feature_columns = [str(name) for name in arrays["feature_columns"]]
+        self.n_features_in_ = len(self.feature_columns)
+        self.mean = arrays["scaler_mean"]
+        self.scale = arrays["scaler_scale"]
+        
+        if self.kind == "linear":
+            self.coef = arrays["coef"]
+            self.intercept = float(arrays["intercept"])
+        else:
+            self.children_left = arrays["children_left"]
+            self.children_right = arrays["children_right"]
+            self.split_feature = arrays["feature"]
+            self.threshold = arrays["threshold"]
+            self.missing_go_to_left = arrays["missing_go_to_left"].astype(bool)
+            self.leaf_value = arrays["value"]
+            self.tree_roots = arrays["tree_roots"]
+            self.init_raw = float(arrays["init_raw"])
+            self.learning_rate = float(arrays["learning_rate"])
+    
+    @classmethod
+    def load(cls, path: str) -> "NumpyKernel":
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+    
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+    
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if self.kind == "linear":
+            fraud = _sigmoid(X @ self.coef + self.intercept)
+        elif self.kind == "forest":
+            fraud = self._sum_tree_values(X) / len(self.tree_roots)
+        else:  # gradient_boosting
+            fraud = _sigmoid(self.init_raw + self.learning_rate * self._sum_tree_values(X))
+        return np.column_stack([1 - fraud, fraud])
+    
+    def _sum_tree_values(self, X: np.ndarray) -> np.ndarray:
+        """Walk every row down every tree at once and add up the leaf values"""
+        # sklearn compares float32 features against the split thresholds
+        X = X.astype(np.float32)
+        rows = np.arange(X.shape[0])
+        total = np.zeros(X.shape[0], dtype=np.float64)
+        
+        for root in self.tree_roots:
+            node = np.full(X.shape[0], root, dtype=np.int64)
+            active = rows[self.children_left[node] != -1]
+            while active.size:
+                current = node[active]
+                values = X[active, self.split_feature[current]]
+                go_left = (values <= self.threshold[current]) | (np.isnan(values) & self.missing_go_to_left[current])
+                node[active] = np.where(go_left, self.children_left[current], self.children_right[current])
+                active = active[self.children_left[node[active]] != -1]
+            total += self.leaf_value[node]
+        
+        return total
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # exp(-log(1 + e^-x)) doesn't overflow for large |x|
+    return np.exp(-np.logaddexp(0.0, -x))
+
+def _flatten_trees(trees: List[Any], leaf_value) -> Dict[str, np.ndarray]:
+    """Concatenate sklearn tree_ arrays, rebasing child indices per tree"""
+    parts = {name: [] for name in ["children_left", "children_right", "feature", "threshold",
+                                   "missing_go_to_left", "value"]}
+    roots = []
+    offset = 0
+    for tree in trees:
+        t = tree.tree_
+        roots.append(offset)
+        is_leaf = t.children_left == -1
+        parts["children_left"].append(np.where(is_leaf, -1, t.children_left + offset))
+        parts["children_right"].append(np.where(is_leaf, -1, t.children_right + offset))
+        parts["feature"].append(np.where(is_leaf, 0, t.feature))
+        parts["threshold"].append(t.threshold)
+        parts["missing_go_to_left"].append(
+            getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8)).astype(np.uint8))
+        parts["value"].append(leaf_value(t.value))
+        offset += t.node_count
+    
+    flat = {name: np.concatenate(arrays) for name, arrays in parts.items()}
+    flat["tree_roots"] = np.asarray(roots, dtype=np.int64)
+    return flat
+
+def export_numpy_kernel(model: Any, scaler: Any, feature_columns: List[str], path: str, version: str):
+    """Convert a fitted scaler and binary classifier into plain .npz arrays"""
+    n_features = len(feature_columns)
+    mean = getattr(scaler, "mean_", None)
+    scale = getattr(scaler, "scale_", None)
+    arrays: Dict[str, Any] = {
+        "version": np.asarray(version),
+        "feature_columns": np.asarray(list(feature_columns)),
+        "scaler_mean": np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64),
+        "scaler_scale": np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64),
+    }
+    
+    if len(getattr(model, "classes_", [])) != 2:
+        raise ValueError("Only binary classifiers can be exported")
+    
+    name = type(model).__name__
+    if name in ("LogisticRegression", "SGDClassifier"):
+        arrays["kind"] = np.asarray("linear")
+        arrays["coef"] = np.asarray(model.coef_, dtype=np.float64).ravel()
+        arrays["intercept"] = np.asarray(model.intercept_, dtype=np.float64).ravel()[0]
+    elif name in ("DecisionTreeClassifier", "RandomForestClassifier", "ExtraTreesClassifier"):
+        trees = [model] if name == "DecisionTreeClassifier" else list(model.estimators_)
+        # Leaf value = fraction of class 1 among the training samples in the leaf
+        class_one = lambda value: value[:, 0, 1] / value[:, 0, :].sum(axis=1)
+        arrays.update(_flatten_trees(trees, class_one))
+        arrays["kind"] = np.asarray("forest")
+        arrays["init_raw"] = np.asarray(0.0)
+        arrays["learning_rate"] = np.asarray(1.0)
+    elif name == "GradientBoostingClassifier":
+        trees = [stage[0] for stage in model.estimators_]
+        arrays.update(_flatten_trees(trees, lambda value: value[:, 0, 0]))
+        arrays["kind"] = np.asarray("gradient_boosting")
+        arrays["learning_rate"] = np.asarray(float(model.learning_rate))
+        # The initial estimator's log-odds is whatever the trees don't explain
+        origin = np.zeros((1, n_features))
+        tree_sum = sum(tree.predict(origin)[0] for tree in trees)
+        arrays["init_raw"] = np.asarray(float(model.decision_function(origin)[0]) - model.learning_rate * tree_sum)
+    else:
+        raise ValueError(f"Don't know how to export a {name}")
+    
+    np.savez(path, **arrays)
+
+class ScoreCache(ABC):
+    """Bounded LRU cache of fraud probabilities with a time-to-live.
+
+    Keys hash the final feature vector together with the model version, so
+    a retrained model never reuses old scores. Hit/miss counters are kept
+    per process.
+    """
+    
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        # Lookups run on the server's thread pool; += on a shared counter isn't atomic
+        self._stats_lock = threading.Lock()
+    
+    @staticmethod
+    def key(features: np.ndarray, model_version: str) -> str:
+        digest = hashlib.sha1(model_version.encode("utf-8"))
+        digest.update(np.ascontiguousarray(features, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[float]:
+        probability = self._get(key)
+        with self._stats_lock:
+            if probability is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return probability
+    
+    @abstractmethod
+    def put(self, key: str, probability: float):
+        """Store a probability under key"""
+    
+    @abstractmethod
+    def _get(self, key: str) -> Optional[float]:
+        """The unexpired probability stored under key, or None"""
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": type(self).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+class MemoryScoreCache(ScoreCache):
+    """In-process cache; fastest, but not shared between worker processes"""
+    
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600):
+        super().__init__(max_entries, ttl_seconds)
+        self._entries: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _get(self, key: str) -> Optional[float]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            probability, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return probability
+    
+    def put(self, key: str, probability: float):
+        with self._lock:
+            self._entries[key] = (probability, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SqliteScoreCache(ScoreCache):
+    """On-disk cache shared by every process that opens the same file"""
+    
+    # Size bound and expiry are enforced every this many writes
+    EVICT_EVERY = 100
+    
+    def __init__(self, path: str, max_entries: int = 100000, ttl_seconds: float = 3600):
+        super().__init__(max_entries, ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "key TEXT PRIMARY KEY, probability REAL NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS scores_accessed_at ON scores (accessed_at)")
+    
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    def _get(self, key: str) -> Optional[float]:
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT probability FROM scores WHERE key = ? AND stored_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE scores SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+    
+    def put(self, key: str, probability: float):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO scores (key, probability, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, probability, now, now)
+            )
+            with self._stats_lock:
+                self._writes += 1
+                evict = self._writes % self.EVICT_EVERY == 0
+            if evict:
+                connection.execute("DELETE FROM scores WHERE stored_at <= ?", (now - self.ttl_seconds,))
+                connection.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
 
-class ReturnFraudPredictor:
+def score_cache_from_env() -> Optional[ScoreCache]:
+    """Build the cache selected by FRAUD_SCORE_CACHE ('memory' or a SQLite file path)"""
+    backend = os.getenv("FRAUD_SCORE_CACHE")
+    if not backend:
+        return None
+    
+    ttl_seconds = float(os.getenv("FRAUD_SCORE_CACHE_TTL", "3600"))
+    if backend == "memory":
+        return MemoryScoreCache(int(os.getenv("FRAUD_SCORE_CACHE_SIZE", "10000")), ttl_seconds)
+    return SqliteScoreCache(backend, int(os.getenv("FRAUD_SCORE_CACHE_SIZE", "100000")), ttl_seconds)
+
+class _Histogram:
+    """Prometheus-style histogram: per-bucket counts plus sum and count"""
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class ScoringMetrics:
+    """Process-wide scoring counters and histograms, rendered for Prometheus"""
+    
+    STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+    HISTORY_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+    
     def __init__(self):
-        """Initialize the model with pickle files"""
-        try:
-            # Load the ML model, scaler, and feature columns
-            with open('return_fraud_model.pkl', 'rb') as f:
-                self.model = pickle.load(f)
-            
-            with open('return_scaler.pkl', 'rb') as f:
-                self.scaler = pickle.load(f)
+        self._lock = threading.Lock()
+        self.scores: Dict[str, int] = {}
+        self.stages: Dict[str, _Histogram] = {}
+        self.history_size = _Histogram(self.HISTORY_BUCKETS)
+    
+    def record_score(self, outcome: str, timings: Dict[str, float], history_size: Optional[int]):
+        with self._lock:
+            self.scores[outcome] = self.scores.get(outcome, 0) + 1
+            for stage, seconds in timings.items():
+                self._observe_stage(stage, seconds)
+            if history_size is not None:
+                self.history_size.observe(history_size)
+    
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self._observe_stage(stage, seconds)
+    
+    def _observe_stage(self, stage: str, seconds: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = _Histogram(self.STAGE_BUCKETS)
+        histogram.observe(seconds)
+    
+    def render(self, score_cache: Optional["ScoreCache"] = None) -> str:
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP fraud_scores_total Returns scored, by outcome.",
+            "# TYPE fraud_scores_total counter",
+        ]
+        with self._lock:
+            for outcome, count in sorted(self.scores.items()):
+                lines.append(f'fraud_scores_total{{outcome="{outcome}"}} {count}')
             
-            with open('feature_columns.pkl', 'rb') as f:
-                self.feature_columns = pickle.load(f)
+            lines += [
+                "# HELP fraud_score_stage_seconds Time spent in each scoring stage.",
+                "# TYPE fraud_score_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stages.items()):
+                lines += _render_histogram("fraud_score_stage_seconds", histogram, f'stage="{stage}"')
             
-            print("Model loaded successfully")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
+            lines += [
+                "# HELP fraud_score_history_size Historical returns per scored request.",
+                "# TYPE fraud_score_history_size histogram",
+            ]
+            lines += _render_histogram("fraud_score_history_size", self.history_size)
+        
+        if score_cache is not None:
+            lines += [
+                "# HELP fraud_score_cache_requests_total Score cache lookups, by result.",
+                "# TYPE fraud_score_cache_requests_total counter",
+                f'fraud_score_cache_requests_total{{result="hit"}} {score_cache.hits}',
+                f'fraud_score_cache_requests_total{{result="miss"}} {score_cache.misses}',
+            ]
+        return "\n".join(lines) + "\n"
+
+def _render_histogram(name: str, histogram: _Histogram, labels: str = "") -> List[str]:
+    prefix = f"{labels}," if labels else ""
+    lines = []
+    cumulative = 0
+    for upper, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{upper}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+# Shared by every predictor in the process
+METRICS = ScoringMetrics()
+
+class FeatureExtractor:
+    """Turns returns into feature vectors in feature_columns order.
+
+    Shared by the predictor (which extracts with its artifact's columns)
+    and the offline jobs that need features without a model, such as
+    train_fraud_model.py and feature_snapshot.py.
+    """
+    
+    def __init__(self, feature_columns: Optional[List[str]] = None):
+        self.feature_columns = list(FEATURE_COLUMNS if feature_columns is None else feature_columns)
+        # Column name -> position, used by the NumPy extractors
+        self._feature_index = {name: i for i, name in enumerate(self.feature_columns)}
     
-    def extract_features(self, new_return: Dict[str, Any], historical_returns: List[Dict[str, Any]]) -> pd.DataFrame:
+    def extract_features(self, new_return: Dict[str, Any], historical_returns: List[Dict[str, Any]],
+                         now: Optional[datetime] = None) -> "pd.DataFrame":
         """Extract features from new return and historical data"""
+        # pandas is only needed on this reference path
+        import pandas as pd
         
         # Basic features from new return
         features = {
@@ -55,7 +585,7 @@ class ReturnFraudPredictor:
             # Time-based features
             if 'createdAt' in returns_df.columns:
                 returns_df['createdAt'] = pd.to_datetime(returns_df['createdAt'])
-                now = datetime.now()
+                now = now or utc_now()
                 
                 # Returns in last 30 days
                 last_30_days = returns_df[returns_df['createdAt'] > now - timedelta(days=30)]
@@ -114,6 +644,250 @@ class ReturnFraudPredictor:
         
         return df
     
+    def extract_feature_vector(self, new_return: Dict[str, Any], historical_returns: List[Dict[str, Any]],
+                               now: Optional[datetime] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Extract the same features as extract_features without pandas.
+
+        Makes a single pass over the history dicts and writes straight into a
+        float vector in feature_columns order. Pass `out` (e.g. a row of a
+        batch matrix) to fill a preallocated buffer instead of allocating.
+
+        Unlike the DataFrame path, records missing `status` or `fraudFlag`
+        simply don't count, and timezone-aware `createdAt` values (as sent by
+        the Node service) are converted to naive UTC instead of failing.
+        """
+        if out is None:
+            out = np.zeros(len(self.feature_columns), dtype=np.float64)
+        else:
+            out.fill(0.0)
+        index = self._feature_index
+        
+        def put(name: str, value: float):
+            position = index.get(name)
+            if position is not None:
+                out[position] = value
+        
+        # Basic features from new return
+        self._put_new_return_features(put, new_return)
+        
+        # New users keep the all-zero history features
+        if not historical_returns:
+            return out
+        
+        now = now or utc_now()
+        cutoff_30 = now - timedelta(days=30)
+        cutoff_90 = now - timedelta(days=90)
+        
+        approved = rejected = fraud_flags = 0
+        last_30_days = last_90_days = 0
+        has_created_at = has_price = False
+        first_created = last_created = None
+        created_count = 0
+        price_count = 0
+        price_sum = 0.0
+        price_max = -np.inf
+        
+        for historical in historical_returns:
+            status = historical.get('status')
+            if status == 'approved':
+                approved += 1
+            elif status == 'rejected':
+                rejected += 1
+            if historical.get('fraudFlag', False) == True:  # noqa: E712 - matches the DataFrame `== True` mask
+                fraud_flags += 1
+            
+            if 'createdAt' in historical:
+                has_created_at = True
+                created_at = parse_created_at(historical['createdAt'])
+                if created_at is not None:
+                    created_count += 1
+                    if first_created is None or created_at < first_created:
+                        first_created = created_at
+                    if last_created is None or created_at > last_created:
+                        last_created = created_at
+                    if created_at > cutoff_30:
+                        last_30_days += 1
+                    if created_at > cutoff_90:
+                        last_90_days += 1
+            
+            if 'price' in historical:
+                has_price = True
+                price = to_float(historical['price'])
+                if not np.isnan(price):
+                    price_count += 1
+                    price_sum += price
+                    if price > price_max:
+                        price_max = price
+        
+        total_returns = len(historical_returns)
+        put('total_returns', total_returns)
+        put('approved_returns', approved)
+        put('rejected_returns', rejected)
+        put('fraud_flags', fraud_flags)
+        
+        if has_created_at:
+            put('returns_last_30_days', last_30_days)
+            put('returns_last_90_days', last_90_days)
+            if total_returns > 1:
+                # Mean of consecutive sorted gaps telescopes to (last - first) / (n - 1)
+                if created_count > 1:
+                    span_days = (last_created - first_created).total_seconds() / (24 * 3600)
+                    put('avg_days_between_returns', span_days / (created_count - 1))
+                else:
+                    put('avg_days_between_returns', np.nan)
+        
+        if has_price:
+            if price_count:
+                put('avg_return_amount', price_sum / price_count)
+                put('max_return_amount', price_max)
+            else:
+                put('avg_return_amount', np.nan)
+                put('max_return_amount', np.nan)
+            put('total_return_amount', price_sum)
+        
+        return out
+    
+    def extract_aggregate_vector(self, new_return: Dict[str, Any],
+                                 aggregate: Union[UserReturnAggregate, Dict[str, Any], None],
+                                 now: Optional[datetime] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Build the feature vector from a per-user aggregate instead of raw history.
+
+        `aggregate` is a UserReturnAggregate or its stored document (see
+        return_feature_store.py), so the cost no longer grows with history length.
+        """
+        if out is None:
+            out = np.zeros(len(self.feature_columns), dtype=np.float64)
+        else:
+            out.fill(0.0)
+        index = self._feature_index
+        
+        def put(name: str, value: float):
+            position = index.get(name)
+            if position is not None:
+                out[position] = value
+        
+        self._put_new_return_features(put, new_return)
+        
+        if not isinstance(aggregate, UserReturnAggregate):
+            aggregate = UserReturnAggregate.from_document(aggregate)
+        for name, value in aggregate.to_features(now).items():
+            put(name, value)
+        
+        return out
+    
+    def extract_point_in_time_matrix(self, returns: List[Dict[str, Any]], as_of: Optional[datetime] = None,
+                                     out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Features of each of one user's returns as of when it was made, in one sweep.
+
+        Row i equals extract_feature_vector(returns[i], <the returns before
+        it>, now=<its createdAt>), where "before" means createdAt order
+        (missing dates first and ties in input order, like a MongoDB sort).
+        `as_of` replaces every row's reference time. Rows keep the input
+        order. The returns are sorted once, then counts and amounts are
+        running sums and the 30/90-day windows two pointers into the sorted
+        timestamps, so a history of n returns costs O(n log n) instead of
+        O(n^2).
+        """
+        n = len(returns)
+        if out is None:
+            out = np.zeros((n, len(self.feature_columns)), dtype=np.float64)
+        else:
+            out.fill(0.0)
+        if n == 0:
+            return out
+        index = self._feature_index
+        row = out[0]
+        
+        def put(name: str, value: float):
+            position = index.get(name)
+            if position is not None:
+                row[position] = value
+        
+        created = [parse_created_at(return_doc.get('createdAt')) for return_doc in returns]
+        order = sorted(range(n), key=lambda i: (created[i] is not None, created[i] or datetime.min))
+        fallback_now = as_of or utc_now()
+        
+        # Running state over the returns already swept (the current row's history)
+        approved = rejected = fraud_flags = 0
+        has_created_at = has_price = False
+        stamps: List[int] = []  # parsed createdAt in microseconds, ascending
+        price_count = 0
+        price_sum = 0.0
+        price_max = -np.inf
+        start_30 = start_90 = 0
+        last_cutoff = None
+        
+        for total_returns, i in enumerate(order):
+            row = out[i]
+            self._put_new_return_features(put, returns[i])
+            
+            if total_returns:
+                put('total_returns', total_returns)
+                put('approved_returns', approved)
+                put('rejected_returns', rejected)
+                put('fraud_flags', fraud_flags)
+                
+                if has_created_at:
+                    now = as_of or created[i] or fallback_now
+                    cutoff_30 = _microseconds(now - timedelta(days=30))
+                    cutoff_90 = _microseconds(now - timedelta(days=90))
+                    if last_cutoff is not None and cutoff_30 < last_cutoff:
+                        # Reference time went backwards; re-find the window starts
+                        start_30 = start_90 = 0
+                    last_cutoff = cutoff_30
+                    while start_30 < len(stamps) and stamps[start_30] <= cutoff_30:
+                        start_30 += 1
+                    while start_90 < len(stamps) and stamps[start_90] <= cutoff_90:
+                        start_90 += 1
+                    put('returns_last_30_days', len(stamps) - start_30)
+                    put('returns_last_90_days', len(stamps) - start_90)
+                    if total_returns > 1:
+                        if len(stamps) > 1:
+                            span_days = (stamps[-1] - stamps[0]) / 10 ** 6 / (24 * 3600)
+                            put('avg_days_between_returns', span_days / (len(stamps) - 1))
+                        else:
+                            put('avg_days_between_returns', np.nan)
+                
+                if has_price:
+                    if price_count:
+                        put('avg_return_amount', price_sum / price_count)
+                        put('max_return_amount', price_max)
+                    else:
+                        put('avg_return_amount', np.nan)
+                        put('max_return_amount', np.nan)
+                    put('total_return_amount', price_sum)
+            
+            # Fold this return into the history of the rows after it
+            return_doc = returns[i]
+            status = return_doc.get('status')
+            if status == 'approved':
+                approved += 1
+            elif status == 'rejected':
+                rejected += 1
+            if return_doc.get('fraudFlag', False) == True:  # noqa: E712 - same test as the extractors
+                fraud_flags += 1
+            if 'createdAt' in return_doc:
+                has_created_at = True
+                if created[i] is not None:
+                    stamps.append(_microseconds(created[i]))
+            if 'price' in return_doc:
+                has_price = True
+                price = to_float(return_doc['price'])
+                if not np.isnan(price):
+                    price_count += 1
+                    price_sum += price
+                    if price > price_max:
+                        price_max = price
+        
+        return out
+    
+    def _put_new_return_features(self, put, new_return: Dict[str, Any]):
+        """Write the features that only depend on the return being scored"""
+        put('return_amount', to_float(new_return.get('price', 0)))
+        put('return_reason_encoded', self._encode_reason(new_return.get('reason', '')))
+        put('description_length', len(new_return.get('description', '')))
+        put('has_image', 1 if new_return.get('imageUrl', '') else 0)
+    
     def _encode_reason(self, reason: str) -> int:
         """Encode return reason to numeric"""
         reason_mapping = {
@@ -127,64 +901,821 @@ class ReturnFraudPredictor:
             'changed_mind': 8
         }
         return reason_mapping.get(reason, 0)
+
+class ReturnFraudPredictor(FeatureExtractor):
+    def __init__(self, model_path: Optional[str] = None, scaler_path: Optional[str] = None,
+                 features_path: Optional[str] = None, bundle_path: Optional[str] = None,
+                 kernel_path: Optional[str] = None, score_cache: Optional["ScoreCache"] = None,
+                 instrument: Optional[bool] = None):
+        """Initialize the model with pickle files.
+
+        Paths come from the arguments, then FRAUD_MODEL_PATH /
+        FRAUD_SCALER_PATH / FRAUD_FEATURES_PATH, then FRAUD_MODEL_DIR, then
+        the working directory or ./model. A consolidated bundle
+        (bundle_path or FRAUD_MODEL_BUNDLE) replaces all three files, and an
+        exported NumPy kernel (kernel_path or FRAUD_KERNEL_PATH) replaces
+        them without needing scikit-learn at all.
+
+        score_cache (or FRAUD_SCORE_CACHE, see score_cache_from_env) reuses
+        fraud probabilities for feature vectors that were already scored.
+
+        With instrument=True (or FRAUD_INSTRUMENT=1) every result also
+        carries per-stage "timings_ms" and "history_size", and the stages
+        are recorded in METRICS.
+        """
+        # Seconds spent loading each artifact, reported by --warmup
+        self.load_times: Dict[str, float] = {}
+        self.artifact_paths: Dict[str, str] = {}
+        
+        try:
+            bundle_path = bundle_path or os.getenv("FRAUD_MODEL_BUNDLE")
+            kernel_path = kernel_path or os.getenv("FRAUD_KERNEL_PATH")
+            if kernel_path:
+                self._load_kernel(kernel_path)
+            elif bundle_path:
+                self._load_bundle(bundle_path)
+            else:
+                self._load_artifacts(
+                    _resolve_artifact_path(model_path, "FRAUD_MODEL_PATH", MODEL_FILENAME),
+                    _resolve_artifact_path(scaler_path, "FRAUD_SCALER_PATH", SCALER_FILENAME),
+                    _resolve_artifact_path(features_path, "FRAUD_FEATURES_PATH", FEATURES_FILENAME),
+                )
+            
+            FeatureExtractor.__init__(self, self.feature_columns)
+            validate_artifacts(self.model, self.scaler, self.feature_columns)
+            
+            self.score_cache = score_cache if score_cache is not None else score_cache_from_env()
+            if instrument is None:
+                instrument = os.getenv("FRAUD_INSTRUMENT", "").lower() in ("1", "true", "yes")
+            self.instrument = instrument
+            
+            # stdout is reserved for results (and the server protocol)
+            print(f"Model loaded successfully (version {self.model_version})", file=sys.stderr)
+        except Exception as e:
+            print(f"Error loading model: {e}", file=sys.stderr)
+            raise
+    
+    def _load_artifacts(self, model_path: str, scaler_path: str, features_path: str):
+        """Load the model, scaler and feature columns from separate pickles"""
+        digest = hashlib.sha256()
+        loaded = {}
+        for name, path in [("model", model_path), ("scaler", scaler_path), ("feature_columns", features_path)]:
+            started = time.perf_counter()
+            loaded[name], data = _load_pickle_bytes(path)
+            self.load_times[name] = time.perf_counter() - started
+            self.artifact_paths[name] = path
+            digest.update(data)
+        
+        self.model = loaded["model"]
+        self.scaler = loaded["scaler"]
+        self.feature_columns = loaded["feature_columns"]
+        # Without an explicit version, identify the artifacts by content
+        self.model_version = digest.hexdigest()[:12]
+    
+    def _load_bundle(self, bundle_path: str):
+        """Load model, scaler, feature order and version from one bundle file"""
+        started = time.perf_counter()
+        bundle, _ = _load_pickle_bytes(bundle_path)
+        self.load_times["bundle"] = time.perf_counter() - started
+        self.artifact_paths["bundle"] = bundle_path
+        
+        self.model = bundle["model"]
+        self.scaler = bundle["scaler"]
+        self.feature_columns = bundle["feature_columns"]
+        self.model_version = str(bundle.get("version", "unversioned"))
+    
+    def _load_kernel(self, kernel_path: str):
+        """Load an exported NumPy kernel; it serves as both scaler and model"""
+        started = time.perf_counter()
+        kernel = NumpyKernel.load(kernel_path)
+        self.load_times["kernel"] = time.perf_counter() - started
+        self.artifact_paths["kernel"] = kernel_path
+        
+        self.model = kernel
+        self.scaler = kernel
+        self.feature_columns = kernel.feature_columns
+        self.model_version = kernel.version
+    
+    def export_kernel(self, kernel_path: str, samples: int = 1000) -> float:
+        """Export the loaded scaler and model as a NumPy kernel.
+
+        Returns the largest absolute difference between the kernel's and
+        the original predict_proba over random inputs.
+        """
+        export_numpy_kernel(self.model, self.scaler, self.feature_columns, kernel_path, self.model_version)
+        kernel = NumpyKernel.load(kernel_path)
+        
+        # Probe around the training distribution the scaler remembers
+        rng = np.random.default_rng(0)
+        X = kernel.mean + kernel.scale * rng.standard_normal((samples, len(self.feature_columns)))
+        X[0] = self.extract_feature_vector(SMOKE_RETURN, [])
+        expected = self.model.predict_proba(self.scale_features(X))[:, 1]
+        actual = kernel.predict_proba(impute_scaled(kernel.transform(X)))[:, 1]
+        return float(np.max(np.abs(expected - actual)))
+    
+    def save_bundle(self, bundle_path: str, version: Optional[str] = None):
+        """Write the loaded artifacts as one consolidated bundle (atomically)"""
+        bundle = {
+            "model": self.model,
+            "scaler": self.scaler,
+            "feature_columns": list(self.feature_columns),
+            "version": version or self.model_version,
+            "created_at": datetime.now().isoformat(),
+        }
+        directory = os.path.dirname(os.path.abspath(bundle_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, bundle_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
     
     def score_return(self, new_return: Dict[str, Any], historical_returns: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Score a new return for fraud risk"""
+        timings = {} if self.instrument else None
+        started = time.perf_counter() if timings is not None else 0.0
         try:
             # Extract features
-            features_df = self.extract_features(new_return, historical_returns)
-            
-            # Scale features
-            features_scaled = self.scaler.transform(features_df)
-            
-            # Make prediction
-            fraud_probability = self.model.predict_proba(features_scaled)[0][1]  # Probability of fraud
-            risk_score = float(fraud_probability)
-            
-            # Determine risk level and prediction
-            if risk_score > 0.7:
-                risk_level = "HIGH"
-                prediction = "FRAUD"
-            elif risk_score > 0.4:
-                risk_level = "MEDIUM"
-                prediction = "SUSPICIOUS"
+            features = self.extract_feature_vector(new_return, historical_returns)
+            if timings is not None:
+                timings["extract"] = time.perf_counter() - started
+            
+            # Scale features and predict (or reuse a cached score)
+            fraud_probability = self._predict_probabilities(features.reshape(1, -1), timings)[0]  # Probability of fraud
+            
+            result = self._build_result(float(fraud_probability), list(self.feature_columns))
+            
+        except Exception as e:
+            print(f"Error scoring return: {e}", file=sys.stderr)
+            result = self._error_result(e)
+        
+        if timings is not None:
+            timings["total"] = time.perf_counter() - started
+            self._attach_timings(result, timings, len(historical_returns or []))
+        return result
+    
+    def score_return_from_aggregate(self, new_return: Dict[str, Any],
+                                    aggregate: Union[UserReturnAggregate, Dict[str, Any], None]) -> Dict[str, Any]:
+        """Score a new return using the user's aggregate record instead of full history"""
+        timings = {} if self.instrument else None
+        started = time.perf_counter() if timings is not None else 0.0
+        try:
+            features = self.extract_aggregate_vector(new_return, aggregate)
+            if timings is not None:
+                timings["extract"] = time.perf_counter() - started
+            
+            fraud_probability = self._predict_probabilities(features.reshape(1, -1), timings)[0]
+            
+            result = self._build_result(float(fraud_probability), list(self.feature_columns))
+            
+        except Exception as e:
+            print(f"Error scoring return: {e}", file=sys.stderr)
+            result = self._error_result(e)
+        
+        if timings is not None:
+            timings["total"] = time.perf_counter() - started
+            self._attach_timings(result, timings, None)
+        return result
+    
+    def score_returns_batch(self, requests: Iterable[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """Score many (new_return, historical_returns) pairs in one pass.
+
+        Features for every item go into a single matrix that is scaled and
+        predicted once. Results come back in input order; an item whose
+        features cannot be built gets its own error result without failing
+        the rest of the batch.
+        """
+        requests = list(requests)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        features = np.zeros((len(requests), len(self.feature_columns)), dtype=np.float64)
+        scored_positions = []
+        timings = {} if self.instrument else None
+        started = time.perf_counter() if timings is not None else 0.0
+        
+        for position, (new_return, historical_returns) in enumerate(requests):
+            try:
+                self.extract_feature_vector(new_return, historical_returns or [],
+                                            out=features[len(scored_positions)])
+                scored_positions.append(position)
+            except Exception as e:
+                results[position] = self._error_result(e)
+        
+        if scored_positions:
+            if timings is not None:
+                timings["extract"] = time.perf_counter() - started
+            scored = self.score_feature_matrix(features[:len(scored_positions)], timings)
+            for position, result in zip(scored_positions, scored):
+                results[position] = result
+        
+        if timings is not None:
+            timings["total"] = time.perf_counter() - started
+            # Stage times cover the whole batch; history_size is per item
+            for result, (_, historical_returns) in zip(results, requests):
+                self._attach_timings(result, timings, len(historical_returns or []), batch_size=len(requests))
+            for stage, seconds in timings.items():
+                METRICS.observe_stage(stage, seconds)
+        return results
+    
+    def score_feature_matrix(self, features: np.ndarray,
+                             timings: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        """Scale and predict a prebuilt feature matrix (rows in feature_columns order).
+
+        Rows the model can't take (see scorable_rows) get their own error
+        result; the others are scaled and predicted together.
+        """
+        scorable = self.scorable_rows(features)
+        results: List[Dict[str, Any]] = [None] * len(features)
+        for position in np.flatnonzero(~scorable):
+            results[position] = self._error_result(self.invalid_row_error(features[position]))
+        
+        positions = np.flatnonzero(scorable)
+        if len(positions):
+            try:
+                fraud_probabilities = self._predict_probabilities(
+                    features if len(positions) == len(features) else features[positions], timings)
+            except Exception as e:
+                print(f"Error scoring return batch: {e}", file=sys.stderr)
+                for position in positions:
+                    results[position] = self._error_result(e)
+            else:
+                features_used = list(self.feature_columns)
+                for position, fraud_probability in zip(positions, fraud_probabilities):
+                    results[position] = self._build_result(float(fraud_probability), features_used)
+        return results
+    
+    def scorable_rows(self, features: np.ndarray) -> np.ndarray:
+        """Mask of the rows without infinite features (NaN is imputed, see impute_scaled)"""
+        return ~np.isinf(features).any(axis=1)
+    
+    def invalid_row_error(self, row: np.ndarray) -> ValueError:
+        """The error reported for a row scorable_rows rejects"""
+        names = [name for name, value in zip(self.feature_columns, row) if np.isinf(value)]
+        return ValueError(f"Input X contains infinity in {', '.join(names)}")
+    
+    def _predict_probabilities(self, features: np.ndarray,
+                               timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Fraud probability per row; cache hits skip both scaling and predict.
+
+        When `timings` is given, seconds spent per stage are added to it.
+        """
+        if self.score_cache is None:
+            return self._scale_and_predict(features, timings)
+        
+        started = time.perf_counter() if timings is not None else 0.0
+        keys = [self.score_cache.key(row, self.model_version) for row in features]
+        probabilities = np.empty(len(features), dtype=np.float64)
+        missing = []
+        for position, key in enumerate(keys):
+            cached = self.score_cache.get(key)
+            if cached is None:
+                missing.append(position)
             else:
-                risk_level = "LOW"
-                prediction = "LEGITIMATE"
+                probabilities[position] = cached
+        
+        if timings is not None:
+            timings["cache_lookup"] = time.perf_counter() - started
+        
+        if missing:
+            predicted = self._scale_and_predict(features[missing], timings)
+            probabilities[missing] = predicted
+            for position, probability in zip(missing, predicted):
+                self.score_cache.put(keys[position], float(probability))
+        
+        return probabilities
+    
+    def scale_features(self, features: np.ndarray) -> np.ndarray:
+        """Scale feature rows and impute missing values, as in training"""
+        return impute_scaled(self.scaler.transform(features))
+    
+    def _scale_and_predict(self, features: np.ndarray, timings: Optional[Dict[str, float]]) -> np.ndarray:
+        if timings is None:
+            return self.model.predict_proba(self.scale_features(features))[:, 1]
+        
+        started = time.perf_counter()
+        features_scaled = self.scale_features(features)
+        scaled = time.perf_counter()
+        probabilities = self.model.predict_proba(features_scaled)[:, 1]
+        timings["scale"] = scaled - started
+        timings["predict"] = time.perf_counter() - scaled
+        return probabilities
+    
+    def _attach_timings(self, result: Dict[str, Any], timings: Dict[str, float],
+                        history_size: Optional[int], batch_size: Optional[int] = None):
+        """Add instrumentation to a result and record it in METRICS"""
+        result["timings_ms"] = {stage: round(seconds * 1000, 4) for stage, seconds in timings.items()}
+        if history_size is not None:
+            result["history_size"] = history_size
+        if batch_size is not None:
+            result["batch_size"] = batch_size
+        METRICS.record_score("error" if "error" in result else "ok",
+                             timings if batch_size is None else {}, history_size)
+    
+    def _build_result(self, risk_score: float, features_used: List[str]) -> Dict[str, Any]:
+        """Turn a fraud probability into the score_return response shape"""
+        # Determine risk level and prediction
+        if risk_score > 0.7:
+            risk_level = "HIGH"
+            prediction = "FRAUD"
+        elif risk_score > 0.4:
+            risk_level = "MEDIUM"
+            prediction = "SUSPICIOUS"
+        else:
+            risk_level = "LOW"
+            prediction = "LEGITIMATE"
+        
+        return {
+            "risk_score": round(risk_score, 3),
+            "risk_level": risk_level,
+            "prediction": prediction,
+            "features_used": features_used,
+            "confidence": max(risk_score, 1 - risk_score),  # Higher of fraud/legitimate probability
+            "model_version": self.model_version
+        }
+    
+    def _error_result(self, error: Exception) -> Dict[str, Any]:
+        """Neutral fallback result used when scoring fails"""
+        return {
+            "risk_score": 0.5,
+            "risk_level": "MEDIUM",
+            "prediction": "SUSPICIOUS",
+            "error": str(error),
+            "model_version": self.model_version
+        }
+
+class HotReloadingPredictor:
+    """Scores with the version LATEST names in a versioned artifact directory, reloading it live.
+
+    A new version is loaded on a background thread, when LATEST changes
+    (polled every poll_seconds) or after request_reload() (e.g. from
+    SIGHUP). It must score SMOKE_RETURN without error before it replaces
+    the current predictor. Attribute access is delegated to the current
+    ReturnFraudPredictor, so each call runs entirely on the version that
+    was current when it started; calls in flight during a swap finish on
+    the old version. A version that fails to load is reported and skipped,
+    and the current one keeps serving.
+    """
+    
+    def __init__(self, versions_dir: Optional[str] = None, poll_seconds: float = 5.0,
+                 score_cache: Optional["ScoreCache"] = None, instrument: Optional[bool] = None):
+        self.versions_dir = versions_dir or os.getenv("FRAUD_MODEL_VERSIONS_DIR") or VERSIONS_DIR
+        self.poll_seconds = poll_seconds
+        # One cache for every version; its keys include the model version
+        self._score_cache = score_cache if score_cache is not None else score_cache_from_env()
+        self._instrument = instrument
+        self._load_lock = threading.Lock()
+        self._reload_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+        self.reloads = 0
+        
+        # Unlike a reload, a first load that fails is fatal
+        self.version = self.latest_version()
+        self.current = self._load_version(self.version)
+    
+    def __getattr__(self, name: str) -> Any:
+        if name == "current":
+            raise AttributeError(name)  # Not loaded yet
+        return getattr(self.current, name)
+    
+    def latest_version(self) -> str:
+        with open(os.path.join(self.versions_dir, LATEST_FILENAME), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+        if not version or os.sep in version or version.startswith("."):
+            raise ValueError(f"{LATEST_FILENAME} in {self.versions_dir} does not name a version: {version!r}")
+        return version
+    
+    def _load_version(self, version: str) -> ReturnFraudPredictor:
+        """Load one version directory and check that it scores the smoke return"""
+        version_dir = os.path.join(self.versions_dir, version)
+        predictor = ReturnFraudPredictor(model_path=os.path.join(version_dir, MODEL_FILENAME),
+                                         scaler_path=os.path.join(version_dir, SCALER_FILENAME),
+                                         features_path=os.path.join(version_dir, FEATURES_FILENAME),
+                                         score_cache=self._score_cache, instrument=self._instrument)
+        smoke = predictor.score_return(SMOKE_RETURN, [])
+        if "error" in smoke:
+            raise ValueError(f"version {version} failed the smoke test: {smoke['error']}")
+        return predictor
+    
+    def reload(self, force: bool = False) -> bool:
+        """Load and swap in the version LATEST names if it is new; returns whether it swapped.
+
+        force retries a version that failed to load before.
+        """
+        with self._load_lock:
+            try:
+                version = self.latest_version()
+            except (OSError, ValueError) as e:
+                print(f"Model reload skipped: {e}", file=sys.stderr)
+                return False
+            if version == self.version or (version == self._failed_version and not force):
+                return False
             
-            return {
-                "risk_score": round(risk_score, 3),
-                "risk_level": risk_level,
-                "prediction": prediction,
-                "features_used": list(features_df.columns),
-                "confidence": max(risk_score, 1 - risk_score)  # Higher of fraud/legitimate probability
-            }
+            try:
+                predictor = self._load_version(version)
+            except Exception as e:
+                self._failed_version = version
+                print(f"Model reload failed, still serving {self.version}: {e}", file=sys.stderr)
+                return False
             
+            # A single reference assignment: new calls see the new version, running ones keep the old
+            self.current = predictor
+            previous, self.version = self.version, version
+            self._failed_version = None
+            self.reloads += 1
+            print(f"Model reloaded: {previous} -> {version} (model version {predictor.model_version})",
+                  file=sys.stderr)
+            return True
+    
+    def request_reload(self):
+        """Ask the watcher thread to reload now; safe to call from a signal handler"""
+        self._reload_requested.set()
+    
+    def start(self) -> "HotReloadingPredictor":
+        """Start the background watcher (poll_seconds <= 0 only reloads on request)"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="model-reloader", daemon=True)
+            self._watcher.start()
+        return self
+    
+    def stop(self):
+        self._stopped.set()
+        self._reload_requested.set()
+    
+    def _watch(self):
+        while not self._stopped.is_set():
+            requested = self._reload_requested.wait(self.poll_seconds if self.poll_seconds > 0 else None)
+            self._reload_requested.clear()
+            if not self._stopped.is_set():
+                self.reload(force=requested)
+
+def handle_request(predictor: ReturnFraudPredictor, request: Dict[str, Any],
+                   parse_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """Score a single server request and tag the result with the request id.
+
+    parse_seconds, when the caller timed the JSON decode, is reported as the
+    "parse" stage of an instrumented result.
+    """
+    if request.get("op") == "cache_stats":
+        stats = predictor.score_cache.stats() if predictor.score_cache else {"backend": None}
+        return {"id": request.get("id"), "cache": stats}
+    if request.get("op") == "metrics":
+        return {"id": request.get("id"), "metrics": METRICS.render(predictor.score_cache)}
+    if request.get("op") == "reload":
+        if not isinstance(predictor, HotReloadingPredictor):
+            return {"id": request.get("id"), "error": "Reloading needs --versions-dir"}
+        reloaded = predictor.reload(force=True)
+        return {"id": request.get("id"), "reloaded": reloaded, "version": predictor.version,
+                "model_version": predictor.model_version}
+    
+    new_return = request.get("new_return")
+    if not isinstance(new_return, dict):
+        response = {"error": "Request must contain a 'new_return' object"}
+    elif "aggregate" in request:
+        response = predictor.score_return_from_aggregate(new_return, request["aggregate"])
+    elif _fetches_history(request):
+        response = score_user_return(predictor, new_return, request["userId"])
+    else:
+        historical_returns = request.get("historical_returns") or []
+        response = predictor.score_return(new_return, historical_returns)
+    
+    if parse_seconds is not None and "timings_ms" in response:
+        response["timings_ms"]["parse"] = round(parse_seconds * 1000, 4)
+        METRICS.observe_stage("parse", parse_seconds)
+    response["id"] = request.get("id")
+    return response
+
+def _fetches_history(request: Dict[str, Any]) -> bool:
+    """Whether a request names a userId for its history instead of passing it"""
+    return "historical_returns" not in request and request.get("userId") is not None
+
+def score_user_return(predictor: ReturnFraudPredictor, new_return: Dict[str, Any], user_id: Any) -> Dict[str, Any]:
+    """Score a return against the user's history, fetched from MongoDB"""
+    from user_history import get_history_fetcher  # Needs pymongo; only this request shape uses it
+    
+    started = time.perf_counter()
+    try:
+        historical_returns = get_history_fetcher().fetch(user_id, exclude_id=new_return.get("_id"))
+    except Exception as e:
+        print(f"Error fetching return history for user {user_id}: {e}", file=sys.stderr)
+        return predictor._error_result(e)
+    fetch_seconds = time.perf_counter() - started
+    
+    response = predictor.score_return(new_return, historical_returns)
+    if "timings_ms" in response:
+        response["timings_ms"]["fetch"] = round(fetch_seconds * 1000, 4)
+        METRICS.observe_stage("fetch", fetch_seconds)
+    return response
+
+def _parse_request_line(line: str) -> Tuple[Optional[Dict[str, Any]], Optional[str], float]:
+    """Decode one framed request, returning (request, error, seconds spent)"""
+    started = time.perf_counter()
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON request: {e}", time.perf_counter() - started
+    
+    if not isinstance(request, dict):
+        return None, "Request must be a JSON object", time.perf_counter() - started
+    return request, None, time.perf_counter() - started
+
+def serve_stdio(predictor: ReturnFraudPredictor, workers: int = 4,
+                input_stream: TextIO = None, output_stream: TextIO = None):
+    """Answer newline-delimited JSON requests from stdin until EOF.
+
+    Requests are scored on a small thread pool, so responses may come back
+    out of order; callers match them up by "id".
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    write_lock = threading.Lock()
+    
+    def respond(response: Dict[str, Any]):
+        line = json.dumps(response, default=str)
+        with write_lock:
+            output_stream.write(line + "\n")
+            output_stream.flush()
+    
+    def process(request: Dict[str, Any], parse_seconds: float):
+        try:
+            respond(handle_request(predictor, request, parse_seconds))
         except Exception as e:
-            print(f"Error scoring return: {e}")
-            return {
-                "risk_score": 0.5,
-                "risk_level": "MEDIUM",
-                "prediction": "SUSPICIOUS",
-                "error": str(e)
-            }
+            respond({"id": request.get("id"), "error": str(e)})
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            
+            request, error, parse_seconds = _parse_request_line(line)
+            if error:
+                respond({"id": None, "error": error})
+                continue
+            
+            pool.submit(process, request, parse_seconds)
+
+class _ScoringRequestHandler(socketserver.StreamRequestHandler):
+    """Serves newline-delimited JSON requests on one socket connection"""
+    
+    def handle(self):
+        predictor = self.server.predictor
+        for raw_line in self.rfile:
+            line = raw_line.decode("utf-8").strip()
+            if not line:
+                continue
+            
+            request, error, parse_seconds = _parse_request_line(line)
+            if error:
+                response = {"id": None, "error": error}
+            else:
+                try:
+                    response = handle_request(predictor, request, parse_seconds)
+                except Exception as e:
+                    response = {"id": request.get("id"), "error": str(e)}
+            
+            self.wfile.write((json.dumps(response, default=str) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class _ScoringSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_socket(predictor: ReturnFraudPredictor, socket_path: str):
+    """Answer newline-delimited JSON requests on a Unix domain socket"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    
+    with _ScoringSocketServer(socket_path, _ScoringRequestHandler) as server:
+        server.predictor = predictor
+        print(f"Fraud scoring server listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves METRICS as Prometheus text on GET /metrics"""
+    
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render(self.server.predictor.score_cache).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # stdout may be the response channel; keep scrapes quiet
+
+def start_metrics_server(predictor: ReturnFraudPredictor, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread for Prometheus to scrape"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    server.predictor = predictor
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available on http://{host}:{server.server_address[1]}/metrics", file=sys.stderr)
+    return server
+
+def _read_batch_requests(input_stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Yield JSON-lines batch requests, turning bad lines into error entries"""
+    for line_number, line in enumerate(input_stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        
+        request, error, _ = _parse_request_line(line)
+        if error:
+            yield {"id": None, "error": f"line {line_number}: {error}"}
+        else:
+            yield request
+
+def score_batch_file(predictor: ReturnFraudPredictor, input_stream: TextIO,
+                     output_stream: TextIO, batch_size: int = 1000) -> int:
+    """Score a JSON-lines request file in chunks and write JSON-lines results.
+
+    Each input line uses the server request shape; each output line is the
+    score_return result plus the request "id". Requests with their history
+    inline are scored together per chunk; aggregate and userId requests,
+    and anything else, are answered one by one through handle_request.
+    Returns the number of lines written.
+    """
+    written = 0
+    
+    def batchable(request: Dict[str, Any]) -> bool:
+        return ("error" not in request and isinstance(request.get("new_return"), dict)
+                and "aggregate" not in request and not _fetches_history(request))
+    
+    def flush(chunk: List[Dict[str, Any]]) -> int:
+        pairs = [(request["new_return"], request.get("historical_returns") or [])
+                 for request in chunk if batchable(request)]
+        
+        scored = iter(predictor.score_returns_batch(pairs))
+        for request in chunk:
+            if "error" in request:
+                response = dict(request)
+            elif batchable(request):
+                response = next(scored)
+                response["id"] = request.get("id")
+            else:
+                response = handle_request(predictor, request)
+            output_stream.write(json.dumps(response, default=str) + "\n")
+        return len(chunk)
+    
+    chunk = []
+    for request in _read_batch_requests(input_stream):
+        chunk.append(request)
+        if len(chunk) >= batch_size:
+            written += flush(chunk)
+            chunk = []
+    if chunk:
+        written += flush(chunk)
+    
+    output_stream.flush()
+    return written
+
+def warmup_report(predictor: ReturnFraudPredictor) -> Dict[str, Any]:
+    """Score the smoke return once and report per-artifact load times"""
+    started = time.perf_counter()
+    result = predictor.score_return(SMOKE_RETURN, [])
+    first_score_ms = (time.perf_counter() - started) * 1000
+    
+    return {
+        "ok": "error" not in result,
+        "model_version": predictor.model_version,
+        "artifacts": {
+            name: {"path": predictor.artifact_paths[name], "load_ms": round(seconds * 1000, 3)}
+            for name, seconds in predictor.load_times.items()
+        },
+        "total_load_ms": round(sum(predictor.load_times.values()) * 1000, 3),
+        "first_score_ms": round(first_score_ms, 3),
+        "cache": predictor.score_cache.stats() if predictor.score_cache else None,
+        "smoke_result": result,
+    }
 
 def main():
     """Main function for CLI usage"""
-    if len(sys.argv) != 3:
+    parser = argparse.ArgumentParser(description="Score returns for fraud risk")
+    parser.add_argument("new_return_json", nargs="?", help="New return as a JSON object")
+    parser.add_argument("historical_returns_json", nargs="?", help="User's previous returns as a JSON array")
+    parser.add_argument("--user-id", help="Fetch the user's previous returns from MongoDB instead of passing them")
+    parser.add_argument("--aggregate", metavar="JSON",
+                        help="Score from the user's return aggregate (return_feature_store.py) instead of history")
+    parser.add_argument("--serve", action="store_true",
+                        help="Load the model once and answer JSON-lines requests on stdin/stdout")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="With --serve, listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="With --serve, number of requests scored concurrently (default: 4)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Score a JSON-lines file of requests ('-' for stdin) and print JSON-lines results")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="With --batch, number of requests scored per predict call (default: 1000)")
+    parser.add_argument("--model", help="Model pickle (default: $FRAUD_MODEL_PATH or return_fraud_model.pkl)")
+    parser.add_argument("--scaler", help="Scaler pickle (default: $FRAUD_SCALER_PATH or return_scaler.pkl)")
+    parser.add_argument("--features", help="Feature columns pickle (default: $FRAUD_FEATURES_PATH or feature_columns.pkl)")
+    parser.add_argument("--bundle", help="Consolidated artifact bundle (default: $FRAUD_MODEL_BUNDLE)")
+    parser.add_argument("--kernel", help="Exported NumPy kernel (.npz) to score with instead of pickles (default: $FRAUD_KERNEL_PATH)")
+    parser.add_argument("--versions-dir", default=os.getenv("FRAUD_MODEL_VERSIONS_DIR"),
+                        help="Versioned artifact directory: score with the version its LATEST file names "
+                             "and reload when that changes (default: $FRAUD_MODEL_VERSIONS_DIR)")
+    parser.add_argument("--reload-interval", type=float, default=5.0,
+                        help="With --versions-dir and --serve, seconds between LATEST checks; 0 reloads only on SIGHUP (default: 5)")
+    parser.add_argument("--export-kernel", metavar="OUTPUT",
+                        help="Export the loaded scaler and model as a NumPy kernel (.npz), check it and exit")
+    parser.add_argument("--build-bundle", metavar="OUTPUT",
+                        help="Write the loaded artifacts to a single bundle file and exit")
+    parser.add_argument("--bundle-version", help="With --build-bundle, version to record in the bundle")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Load the artifacts, score a smoke return and report load times as JSON")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Add per-stage timings_ms and history_size to every result (or set FRAUD_INSTRUMENT=1)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="With --serve, expose Prometheus metrics on this port (implies --instrument)")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="With --metrics-port, address to listen on (default: 127.0.0.1)")
+    args = parser.parse_args()
+    
+    if not (args.serve or args.batch or args.warmup or args.build_bundle or args.export_kernel) and (args.new_return_json is None or (args.historical_returns_json is None and args.user_id is None and args.aggregate is None)):
         print("Usage: python return_fraud_predictor.py <new_return_json> <historical_returns_json>")
+        print("       python return_fraud_predictor.py --user-id <userId> <new_return_json>")
+        print("       python return_fraud_predictor.py --aggregate <aggregate_json> <new_return_json>")
+        print("       python return_fraud_predictor.py --serve [--socket PATH]")
+        print("       python return_fraud_predictor.py --batch <requests.jsonl>")
+        print("       python return_fraud_predictor.py --warmup")
         sys.exit(1)
     
     try:
         # Initialize predictor
-        predictor = ReturnFraudPredictor()
+        instrument = True if args.instrument or args.metrics_port else None
+        if args.versions_dir:
+            predictor = HotReloadingPredictor(args.versions_dir, poll_seconds=args.reload_interval,
+                                              instrument=instrument)
+        else:
+            predictor = ReturnFraudPredictor(model_path=args.model, scaler_path=args.scaler,
+                                             features_path=args.features, bundle_path=args.bundle,
+                                             kernel_path=args.kernel, instrument=instrument)
+        
+        if args.warmup:
+            report = warmup_report(predictor)
+            print(json.dumps(report, indent=2))
+            if not report["ok"]:
+                sys.exit(1)
+            return
+        
+        if args.export_kernel:
+            max_difference = predictor.export_kernel(args.export_kernel)
+            print(f"Kernel written to {args.export_kernel} "
+                  f"(max |predict_proba difference| = {max_difference:.2e})", file=sys.stderr)
+            if max_difference > KERNEL_TOLERANCE:
+                print(f"Kernel differs from the model by more than {KERNEL_TOLERANCE}", file=sys.stderr)
+                sys.exit(1)
+            return
+        
+        if args.build_bundle:
+            predictor.save_bundle(args.build_bundle, version=args.bundle_version)
+            print(f"Bundle written to {args.build_bundle}", file=sys.stderr)
+            return
+        
+        if args.serve:
+            if isinstance(predictor, HotReloadingPredictor):
+                predictor.start()
+                if hasattr(signal, "SIGHUP"):
+                    signal.signal(signal.SIGHUP, lambda signum, frame: predictor.request_reload())
+            if args.metrics_port is not None:
+                start_metrics_server(predictor, args.metrics_port, args.metrics_host)
+            if args.socket:
+                serve_socket(predictor, args.socket)
+            else:
+                serve_stdio(predictor, workers=args.workers)
+            return
+        
+        if args.batch:
+            if args.batch == "-":
+                score_batch_file(predictor, sys.stdin, sys.stdout, batch_size=args.batch_size)
+            else:
+                with open(args.batch, "r", encoding="utf-8") as batch_file:
+                    score_batch_file(predictor, batch_file, sys.stdout, batch_size=args.batch_size)
+            return
         
         # Load input data
-        new_return = json.loads(sys.argv[1])
-        historical_returns = json.loads(sys.argv[2])
+        new_return = json.loads(args.new_return_json)
         
         # Score the return
-        result = predictor.score_return(new_return, historical_returns)
+        if args.aggregate is not None:
+            result = predictor.score_return_from_aggregate(new_return, json.loads(args.aggregate))
+        elif args.historical_returns_json is None:
+            result = score_user_return(predictor, new_return, args.user_id)
+        else:
+            result = predictor.score_return(new_return, json.loads(args.historical_returns_json))
         
         # Output result
         print(json.dumps(result, indent=2))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Parity test for the pandas-free feature extractor
+
+Checks that ReturnFraudPredictor.extract_feature_vector produces the same
+values as the DataFrame-based extract_features, and that scoring from a
+per-user aggregate gives the same features as the full history.
+
+Usage:
+    python test_feature_parity.py
+    python -m pytest test_feature_parity.py
+"""
+
+import os
+import pickle
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from return_feature_store import UserReturnAggregate
+from return_fraud_predictor import FEATURE_COLUMNS, ReturnFraudPredictor
+
+# The model's columns plus one the extractors don't produce, which must stay 0
+TEST_FEATURE_COLUMNS = FEATURE_COLUMNS + ['column_not_produced_by_extractor']
+
+REASONS = ['wrong_size', 'wrong_color', 'defective', 'wrong_item', 'damaged_shipping',
+           'quality_issue', 'not_as_described', 'changed_mind', 'other']
+STATUSES = ['pending', 'approved', 'rejected', 'completed', 'refund_initiated']
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+
+def make_predictor():
+    """Load a predictor with small stand-in artifacts over TEST_FEATURE_COLUMNS"""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(0)
+    X = rng.random((20, len(TEST_FEATURE_COLUMNS)))
+    y = np.arange(20) % 2
+    artifacts = {
+        'model': LogisticRegression().fit(X, y),
+        'scaler': StandardScaler().fit(X),
+        'features': TEST_FEATURE_COLUMNS,
+    }
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        paths = {}
+        for name, value in artifacts.items():
+            paths[name] = os.path.join(artifact_dir, f'{name}.pkl')
+            with open(paths[name], 'wb') as f:
+                pickle.dump(value, f)
+        return ReturnFraudPredictor(model_path=paths['model'], scaler_path=paths['scaler'],
+                                    features_path=paths['features'])
+
+def make_history(rng, size):
+    """Random history that exercises every branch of the extractors"""
+    history = []
+    for _ in range(size):
+        # Keep clear of the exact 30/90-day boundaries
+        days_ago = rng.choice([rng.uniform(0, 29.9), rng.uniform(30.1, 89.9), rng.uniform(90.1, 400)])
+        history.append({
+            'price': rng.choice([rng.randint(100, 20000), rng.uniform(1, 500)]),
+            'reason': rng.choice(REASONS),
+            'description': 'x' * rng.randint(0, 80),
+            'imageUrl': rng.choice(['', 'https://example.com/a.jpg']),
+            'status': rng.choice(STATUSES),
+            'fraudFlag': rng.random() < 0.2,
+            'createdAt': (NOW - timedelta(days=days_ago)).isoformat(),
+        })
+    return history
+
+def assert_parity(predictor, new_return, history):
+    expected = predictor.extract_features(new_return, history, now=NOW).to_numpy(dtype=np.float64)[0]
+    actual = predictor.extract_feature_vector(new_return, history, now=NOW)
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+def test_random_histories_match():
+    predictor = make_predictor()
+    rng = random.Random(42)
+    for size in [0, 1, 2, 3, 10, 100, 1000]:
+        for _ in range(5):
+            new_return = {
+                'price': rng.randint(0, 10000),
+                'reason': rng.choice(REASONS),
+                'description': 'y' * rng.randint(0, 200),
+                'imageUrl': rng.choice(['', 'https://example.com/b.jpg']),
+            }
+            assert_parity(predictor, new_return, make_history(rng, size))
+
+def test_partial_records_match():
+    predictor = make_predictor()
+    new_return = {'price': 250, 'reason': 'defective'}
+
+    # No createdAt or price columns at all
+    assert_parity(predictor, new_return, [
+        {'status': 'approved', 'fraudFlag': False},
+        {'status': 'rejected', 'fraudFlag': True},
+    ])
+
+    # Some rows missing createdAt / price
+    assert_parity(predictor, new_return, [
+        {'status': 'approved', 'fraudFlag': False, 'price': 100, 'createdAt': '2026-02-20T10:00:00'},
+        {'status': 'rejected', 'fraudFlag': True, 'createdAt': '2026-01-05T08:30:00'},
+        {'status': 'pending', 'fraudFlag': False, 'price': 300},
+    ])
+
+    # Single timestamped row among several
+    assert_parity(predictor, new_return, [
+        {'status': 'approved', 'fraudFlag': False, 'price': 100, 'createdAt': '2026-02-20T10:00:00'},
+        {'status': 'pending', 'fraudFlag': False, 'price': 300},
+    ])
+
+def test_point_in_time_matrix_matches_sliced_histories():
+    predictor = make_predictor()
+    rng = random.Random(7)
+    returns = make_history(rng, 200)
+    returns[3].pop('createdAt')
+    returns[5]['price'] = None
+    # Missing dates first, then by date (ISO strings sort chronologically)
+    order = sorted(range(len(returns)), key=lambda i: ('createdAt' in returns[i], returns[i].get('createdAt', '')))
+
+    for as_of in [None, NOW]:
+        matrix = predictor.extract_point_in_time_matrix(returns, as_of=as_of)
+        for position, i in enumerate(order):
+            history = [returns[j] for j in order[:position]]
+            now = as_of or (datetime.fromisoformat(returns[i]['createdAt']) if 'createdAt' in returns[i] else None)
+            if now is None:
+                continue
+            expected = predictor.extract_feature_vector(returns[i], history, now=now)
+            np.testing.assert_allclose(matrix[i], expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+def test_aggregate_matches_full_history():
+    predictor = make_predictor()
+    new_return = {'price': 250, 'reason': 'defective', 'description': 'torn'}
+
+    def dated(days_ago, **fields):
+        # Whole days, so the aggregate's day buckets and exact times agree on the windows
+        return {'createdAt': (NOW - timedelta(days=days_ago)).isoformat(), **fields}
+
+    histories = [
+        # No usable prices
+        [dated(3, price=None, status='approved'), dated(40, price=None, status='rejected', fraudFlag=True)],
+        [dated(3, price=100, status='approved'), dated(40, price=None), dated(200, price=350.5)],
+        [dated(10, price=None)],
+        # Only one usable date
+        [{'createdAt': None, 'price': 80, 'status': 'pending'}, dated(5, price=20)],
+    ]
+    for history in histories:
+        aggregate = UserReturnAggregate()
+        for return_doc in history:
+            aggregate.add_return(return_doc)
+        expected = predictor.extract_feature_vector(new_return, history, now=NOW)
+        actual = predictor.extract_aggregate_vector(new_return, aggregate, now=NOW)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+        np.testing.assert_allclose(predictor.scale_features(actual.reshape(1, -1)),
+                                   predictor.scale_features(expected.reshape(1, -1)))
+
+def test_vector_follows_feature_column_order():
+    predictor = make_predictor()
+    vector = predictor.extract_feature_vector({'price': 42, 'description': 'abcd'}, [], now=NOW)
+    assert vector[TEST_FEATURE_COLUMNS.index('return_amount')] == 42
+    assert vector[TEST_FEATURE_COLUMNS.index('description_length')] == 4
+    assert vector[TEST_FEATURE_COLUMNS.index('column_not_produced_by_extractor')] == 0
+
+if __name__ == "__main__":
+    test_random_histories_match()
+    test_partial_records_match()
+    test_point_in_time_matrix_matches_sliced_histories()
+    test_aggregate_matches_full_history()
+    test_vector_follows_feature_column_order()
+    print("✅ NumPy feature extractor matches the pandas extractor")
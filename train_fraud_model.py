@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Train the return fraud model from db.returns without loading it into memory
+
+Returns are streamed by (userId, createdAt) and every return becomes one
+row: its features against the returns the same user made before it, as
+of its createdAt (FeatureExtractor.extract_point_in_time_matrix, one
+sweep per user), labelled by fraudFlag.
+Rows are appended to a temporary feature file while a StandardScaler is
+fitted with partial_fit. Each epoch then reads the file back in shuffled
+blocks and calls SGDClassifier.partial_fit, so memory depends on the block
+size, not on the number of returns. About --validation-percent of users are
+held out and scored after each epoch; time and peak RSS are logged per
+epoch.
+
+The scaler, model and feature columns are written as the usual pickles
+plus metadata.json to a new directory under --output-dir, which is only
+renamed into place once it is complete and loads and scores correctly.
+The LATEST file there names the newest version. Score with it via
+FRAUD_MODEL_DIR=<output-dir>/<version>, or serve whatever LATEST names
+and pick up new versions live with --versions-dir <output-dir>.
+
+Usage:
+    python train_fraud_model.py
+    python train_fraud_model.py --epochs 10 --block-size 50000 --seed 42
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from mongo_pool import MONGODB_URI, close_client, get_db
+from rescore_returns import iter_user_chunks
+from return_fraud_predictor import (FEATURES_FILENAME, FEATURE_COLUMNS, LATEST_FILENAME, MODEL_FILENAME,
+                                    SCALER_FILENAME, SMOKE_RETURN, VERSIONS_DIR, FeatureExtractor,
+                                    ReturnFraudPredictor, impute_scaled)
+
+DEFAULT_OUTPUT_DIR = VERSIONS_DIR
+METADATA_FILENAME = "metadata.json"
+
+# Score histogram resolution for the streamed validation AUC
+AUC_BINS = 1000
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def is_validation_user(user_id: Any, validation_percent: float) -> bool:
+    """Stable holdout by user, so no user's history is split across train and validation"""
+    digest = hashlib.blake2b(str(user_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % 10000 < validation_percent * 100
+
+def iter_feature_rows(collection, extractor: FeatureExtractor, chunk_size: int,
+                      validation_percent: float) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield (features, labels, validation mask) per chunk of users"""
+    for user_groups, _ in iter_user_chunks(collection, chunk_size):
+        total = sum(len(returns) for returns in user_groups)
+        features = np.zeros((total, len(extractor.feature_columns)), dtype=np.float64)
+        labels = np.zeros(total, dtype=np.uint8)
+        validation = np.zeros(total, dtype=bool)
+        row = 0
+        for returns in user_groups:
+            extractor.extract_point_in_time_matrix(returns, out=features[row:row + len(returns)])
+            labels[row:row + len(returns)] = [bool(return_doc.get("fraudFlag")) for return_doc in returns]
+            validation[row:row + len(returns)] = is_validation_user(returns[0].get("userId"), validation_percent)
+            row += len(returns)
+        yield features, labels, validation
+
+class FeatureFile:
+    """Rows of features, labels and holdout flags appended to flat files on disk"""
+
+    def __init__(self, directory: str, n_features: int):
+        self.n_features = n_features
+        self.paths = {name: os.path.join(directory, f"{name}.bin") for name in ("features", "labels", "validation")}
+        self.files = {name: open(path, "wb") for name, path in self.paths.items()}
+        self.rows = 0
+
+    def append(self, features: np.ndarray, labels: np.ndarray, validation: np.ndarray):
+        self.files["features"].write(features.tobytes())
+        self.files["labels"].write(labels.astype(np.uint8).tobytes())
+        self.files["validation"].write(validation.astype(np.uint8).tobytes())
+        self.rows += len(labels)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def read(self, start: int, count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Rows [start, start + count), read from disk rather than mapped"""
+        width = self.n_features * 8
+        features = np.fromfile(self.paths["features"], dtype=np.float64, count=count * self.n_features,
+                               offset=start * width).reshape(-1, self.n_features)
+        labels = np.fromfile(self.paths["labels"], dtype=np.uint8, count=count, offset=start)
+        validation = np.fromfile(self.paths["validation"], dtype=np.uint8, count=count, offset=start).astype(bool)
+        return features, labels, validation
+
+class StreamingMetrics:
+    """Log loss, precision/recall at 0.5 and a binned ROC AUC, accumulated per block"""
+
+    def __init__(self):
+        self.rows = 0
+        self.log_loss_sum = 0.0
+        self.counts = {"tp": 0, "fp": 0, "fn": 0, "tn": 0}
+        self.histograms = np.zeros((2, AUC_BINS), dtype=np.int64)
+
+    def add(self, probabilities: np.ndarray, labels: np.ndarray):
+        clipped = np.clip(probabilities, 1e-15, 1 - 1e-15)
+        self.log_loss_sum += float(-np.sum(labels * np.log(clipped) + (1 - labels) * np.log(1 - clipped)))
+        self.rows += len(labels)
+        predicted = probabilities >= 0.5
+        positive = labels == 1
+        self.counts["tp"] += int(np.sum(predicted & positive))
+        self.counts["fp"] += int(np.sum(predicted & ~positive))
+        self.counts["fn"] += int(np.sum(~predicted & positive))
+        self.counts["tn"] += int(np.sum(~predicted & ~positive))
+        bins = np.minimum((probabilities * AUC_BINS).astype(np.int64), AUC_BINS - 1)
+        for label in (0, 1):
+            self.histograms[label] += np.bincount(bins[labels == label], minlength=AUC_BINS)
+
+    def auc(self) -> Optional[float]:
+        negatives, positives = self.histograms
+        if not negatives.sum() or not positives.sum():
+            return None
+        # P(score of a positive > score of a negative), ties within a bin count half
+        negatives_below = np.cumsum(negatives) - negatives
+        pairs = np.sum(positives * (negatives_below + negatives / 2))
+        return float(pairs / (negatives.sum() * positives.sum()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        tp, fp, fn = self.counts["tp"], self.counts["fp"], self.counts["fn"]
+        auc = self.auc()
+        return {
+            "rows": self.rows,
+            "log_loss": round(self.log_loss_sum / self.rows, 5) if self.rows else None,
+            "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+            "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+            "auc": round(auc, 4) if auc is not None else None,
+        }
+
+def _scaled(scaler: StandardScaler, features: np.ndarray) -> np.ndarray:
+    # Missing prices and dates leave NaN features; imputed the same way the predictor does
+    return impute_scaled(scaler.transform(features))
+
+def write_version(output_dir: str, model: Any, scaler: Any, feature_columns: List[str],
+                  metadata: Dict[str, Any]) -> str:
+    """Write and verify a complete artifact directory, then move it into place; returns its path"""
+    os.makedirs(output_dir, exist_ok=True)
+    payloads = [(MODEL_FILENAME, pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+                (SCALER_FILENAME, pickle.dumps(scaler, protocol=pickle.HIGHEST_PROTOCOL)),
+                (FEATURES_FILENAME, pickle.dumps(list(feature_columns), protocol=pickle.HIGHEST_PROTOCOL))]
+    # Same content hash the predictor reports as model_version for these files
+    digest = hashlib.sha256()
+    for _, data in payloads:
+        digest.update(data)
+    model_version = digest.hexdigest()[:12]
+    version = f"{datetime.now():%Y%m%d-%H%M%S}-{model_version}"
+
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=output_dir)
+    try:
+        for filename, data in payloads:
+            with open(os.path.join(tmp_dir, filename), "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        with open(os.path.join(tmp_dir, METADATA_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "model_version": model_version, **metadata}, f, indent=2, default=str)
+
+        # Refuse to publish artifacts the predictor can't load and score with
+        predictor = ReturnFraudPredictor(model_path=os.path.join(tmp_dir, MODEL_FILENAME),
+                                         scaler_path=os.path.join(tmp_dir, SCALER_FILENAME),
+                                         features_path=os.path.join(tmp_dir, FEATURES_FILENAME))
+        smoke = predictor.score_return(SMOKE_RETURN, [])
+        if "error" in smoke:
+            raise ValueError(f"trained artifacts failed the smoke test: {smoke['error']}")
+
+        final_dir = os.path.join(output_dir, version)
+        # mkdtemp creates the directory private to this user
+        os.chmod(tmp_dir, 0o755)
+        os.rename(tmp_dir, final_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    latest_path = os.path.join(output_dir, LATEST_FILENAME)
+    with open(latest_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(latest_path + ".tmp", latest_path)
+    return final_dir
+
+def train(epochs: int = 5, chunk_size: int = 5000, block_size: int = 10000, validation_percent: float = 10,
+          alpha: float = 1e-3, seed: int = 42, output_dir: str = DEFAULT_OUTPUT_DIR):
+    """Stream features out of db.returns, fit scaler and model incrementally, write a new version"""
+    try:
+        db = get_db()
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+
+        extractor = FeatureExtractor(FEATURE_COLUMNS)
+        scaler = StandardScaler()
+        label_counts = np.zeros(2, dtype=np.int64)
+
+        with tempfile.TemporaryDirectory(prefix="fraud-train-") as work_dir:
+            feature_file = FeatureFile(work_dir, len(FEATURE_COLUMNS))
+            started = time.perf_counter()
+            try:
+                for features, labels, validation in iter_feature_rows(db.returns, extractor, chunk_size,
+                                                                      validation_percent):
+                    feature_file.append(features, labels, validation)
+                    train_rows = ~validation
+                    if train_rows.any():
+                        scaler.partial_fit(features[train_rows])
+                        label_counts += np.bincount(labels[train_rows], minlength=2)
+                    print(f"   Extracted {feature_file.rows:,} returns - "
+                          f"{feature_file.rows / (time.perf_counter() - started):,.0f} returns/sec")
+            finally:
+                feature_file.close()
+
+            extract_seconds = time.perf_counter() - started
+            print(f"📦 Features: {feature_file.rows:,} returns in {extract_seconds:.1f}s, "
+                  f"peak RSS {peak_rss_mb()} MB")
+            if label_counts.min() == 0:
+                print("❌ Training needs both fraud-flagged and unflagged returns")
+                print("Please generate returns first using generate_returns.py")
+                sys.exit(1)
+
+            # partial_fit can't balance classes itself; weight rows instead
+            class_weights = label_counts.sum() / (2 * label_counts)
+            model = SGDClassifier(loss="log_loss", alpha=alpha, random_state=seed)
+            rng = np.random.default_rng(seed)
+            block_starts = np.arange(0, feature_file.rows, block_size)
+            epoch_log = []
+
+            for epoch in range(1, epochs + 1):
+                epoch_started = time.perf_counter()
+                for start in rng.permutation(block_starts):
+                    features, labels, validation = feature_file.read(int(start), block_size)
+                    order = rng.permutation(np.flatnonzero(~validation))
+                    if len(order):
+                        model.partial_fit(_scaled(scaler, features[order]), labels[order], classes=[0, 1],
+                                          sample_weight=class_weights[labels[order]])
+
+                metrics = StreamingMetrics()
+                for start in block_starts:
+                    features, labels, validation = feature_file.read(int(start), block_size)
+                    if validation.any():
+                        metrics.add(model.predict_proba(_scaled(scaler, features[validation]))[:, 1],
+                                    labels[validation])
+
+                entry = {"epoch": epoch, "seconds": round(time.perf_counter() - epoch_started, 3),
+                         "peak_rss_mb": peak_rss_mb(), "validation": metrics.to_dict()}
+                epoch_log.append(entry)
+                validation_metrics = entry["validation"]
+                print(f"   Epoch {epoch}/{epochs}: {entry['seconds']:.1f}s, peak RSS {entry['peak_rss_mb']} MB, "
+                      f"validation log loss {validation_metrics['log_loss']}, AUC {validation_metrics['auc']}, "
+                      f"precision {validation_metrics['precision']}, recall {validation_metrics['recall']}")
+
+        metadata = {
+            "trained_at": datetime.now().isoformat(),
+            "database": db.name,
+            "rows": feature_file.rows,
+            "train_label_counts": {"not_fraud": int(label_counts[0]), "fraud": int(label_counts[1])},
+            "feature_columns": FEATURE_COLUMNS,
+            "params": {"epochs": epochs, "chunk_size": chunk_size, "block_size": block_size,
+                       "validation_percent": validation_percent, "alpha": alpha, "seed": seed},
+            "extract_seconds": round(extract_seconds, 3),
+            "epochs": epoch_log,
+        }
+        version_dir = write_version(output_dir, model, scaler, FEATURE_COLUMNS, metadata)
+        print(f"\n✅ Model saved to {version_dir}")
+        print(f"   Score with it: FRAUD_MODEL_DIR={version_dir}")
+
+    except Exception as e:
+        print(f"❌ Error training model: {str(e)}")
+        sys.exit(1)
+
+    finally:
+        close_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the return fraud model from db.returns, out of core")
+    parser.add_argument("--epochs", type=int, default=5, help="Passes over the training rows (default: 5)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Returns read from MongoDB per chunk (default: 5000)")
+    parser.add_argument("--block-size", type=int, default=10000, help="Rows per partial_fit call (default: 10000)")
+    parser.add_argument("--validation-percent", type=float, default=10,
+                        help="Percent of users held out for validation (default: 10)")
+    parser.add_argument("--alpha", type=float, default=1e-3, help="SGDClassifier regularization strength (default: 1e-3)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for shuffling and the model (default: 42)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR,
+                        help=f"Directory for versioned artifacts (default: {DEFAULT_OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    print("🚀 Starting fraud model training...")
+    print(f"📍 MongoDB URI: {MONGODB_URI}")
+    print("-" * 50)
+
+    train(max(1, args.epochs), max(1, args.chunk_size), max(1, args.block_size), args.validation_percent,
+          args.alpha, args.seed, args.output_dir)
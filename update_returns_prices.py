@@ -1,105 +1,256 @@
 #!/usr/bin/env python3
 """
 Script to update existing returns with product prices from orders
+
+Unpriced returns are read in _id order, in batches. Each batch fetches its
+orders with one {"_id": {"$in": ...}} query and writes its prices with one
+unordered bulk_write. The last processed _id is checkpointed, so an
+interrupted migration can continue with --resume. With --server-side the
+whole return -> order -> product price match runs inside MongoDB as a
+$lookup + $merge aggregation instead.
+
+Prices feed the per-user return aggregates the app scores new returns
+from, so after a real run the aggregates of the repriced users (every
+user's, with --server-side or --resume) are rebuilt.
+
+Usage:
+    python update_returns_prices.py [--dry-run]
+    python update_returns_prices.py --batch-size 5000 --resume
+    python update_returns_prices.py --server-side [--dry-run]
 """
 
+import argparse
+import json
 import os
 import sys
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from mongo_pool import MONGODB_URI, BulkWriter, close_client, get_db
+from return_feature_store import rebuild_aggregates
+
+# Returns without price field or with price 0 (null equality also matches a
+# missing field, and unlike $exists: false it can use the price index)
+UNPRICED_QUERY = { "price": { "$in": [None, 0] } }
 
-# Load environment variables
-load_dotenv()
+DEFAULT_CHECKPOINT = ".update_prices_checkpoint.json"
 
-# MongoDB connection
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/vector_returns")
-DB_NAME = MONGODB_URI.split("/")[-1] if "/" in MONGODB_URI else "vector_returns"
+def load_checkpoint(path: str) -> Optional[ObjectId]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return ObjectId(json.load(f)["lastId"])
 
-def update_returns_with_prices():
-    """Update existing returns with product prices from orders"""
+def save_checkpoint(path: str, last_id: ObjectId, updated: int, failed: int):
+    """Atomically record the last processed return _id"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"lastId": str(last_id), "updated": updated, "failed": failed,
+                   "updatedAt": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+def find_product_price(order: Dict[str, Any], product_id: Any) -> float:
+    """Price of the first matching product in the order, or 0"""
+    for product in order.get("products", []):
+        if product.get("productId") == product_id:
+            return product.get("price") or 0
+    return 0
+
+def price_batch(orders_collection, returns: List[Dict[str, Any]]) -> Tuple[List[UpdateOne], Dict[str, int], Set[Any]]:
+    """Match one batch of returns to their order prices with a single orders query.
+    
+    Returns (updates, failure counts by reason, userIds of the priced returns).
+    """
+    order_ids = list({return_item["orderId"] for return_item in returns if return_item.get("orderId") is not None})
+    orders = {
+        order["_id"]: order
+        for order in orders_collection.find({"_id": {"$in": order_ids}}, {"products.productId": 1, "products.price": 1})
+    }
+    
+    updates = []
+    failures = {"order_not_found": 0, "product_not_found": 0}
+    user_ids = set()
+    for return_item in returns:
+        order = orders.get(return_item.get("orderId"))
+        if not order:
+            failures["order_not_found"] += 1
+            continue
+        
+        product_price = find_product_price(order, return_item.get("productId"))
+        if product_price == 0:
+            failures["product_not_found"] += 1
+            continue
+        
+        updates.append(UpdateOne({"_id": return_item["_id"]}, {"$set": {"price": product_price}}))
+        user_ids.add(return_item.get("userId"))
+    
+    return updates, failures, user_ids
+
+def update_returns_with_prices(batch_size: int = 1000, checkpoint_path: str = DEFAULT_CHECKPOINT,
+                               resume: bool = False, dry_run: bool = False):
+    """Update existing returns with product prices from orders, batch by batch"""
     try:
         # Connect to MongoDB
-        client = MongoClient(MONGODB_URI)
-        db = client[DB_NAME]
+        db = get_db()
         
         print(f"Connected to MongoDB: {MONGODB_URI}")
         
-        # Get all returns that don't have a price
         returns_collection = db.returns
         orders_collection = db.orders
+        writer = BulkWriter(returns_collection, max_ops=batch_size)
+        
+        query = dict(UNPRICED_QUERY)
+        last_id = load_checkpoint(checkpoint_path) if resume else None
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+            print(f"⏩ Resuming after return {last_id}")
+        
+        cursor = returns_collection.find(query, {"orderId": 1, "productId": 1, "userId": 1},
+                                         sort=[("_id", 1)], batch_size=batch_size)
         
-        # Find returns without price field or with price 0
-        returns_to_update = list(returns_collection.find({
-            "$or": [
-                { "price": { "$exists": False } },
-                { "price": 0 }
-            ]
-        }))
+        seen = updated_count = 0
+        failures = {"order_not_found": 0, "product_not_found": 0}
+        repriced_users = set()
+        started = time.perf_counter()
         
-        if not returns_to_update:
+        def flush(batch: List[Dict[str, Any]]):
+            nonlocal updated_count
+            updates, batch_failures, user_ids = price_batch(orders_collection, batch)
+            for reason, count in batch_failures.items():
+                failures[reason] += count
+            repriced_users.update(user_ids)
+            
+            if dry_run:
+                updated_count += len(updates)
+                return
+            
+            for update in updates:
+                writer.add(update)
+            writer.flush()
+            updated_count = writer.counts["modified"]
+            save_checkpoint(checkpoint_path, batch[-1]["_id"], updated_count, sum(failures.values()))
+            elapsed = time.perf_counter() - started
+            print(f"   Processed {seen:,} returns ({updated_count:,} updated) - {seen / elapsed:,.0f} returns/sec")
+        
+        batch = []
+        for return_item in cursor:
+            batch.append(return_item)
+            seen += 1
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        
+        if seen == 0:
+            print("✅ All returns already have prices. No updates needed.")
+        else:
+            failed_count = sum(failures.values())
+            print(f"\n🎉 Migration {'dry run ' if dry_run else ''}completed!")
+            print(f"   📊 Returns without a price: {seen}")
+            print(f"   ✅ {'Would update' if dry_run else 'Successfully updated'}: {updated_count} returns")
+            print(f"   ❌ Failed updates: {failed_count} returns "
+                  f"({failures['order_not_found']} order not found, {failures['product_not_found']} product not found)")
+            print(f"   📊 Success rate: {(updated_count / seen * 100):.1f}%")
+        
+        if not dry_run and (updated_count or last_id is not None):
+            # Users repriced before an interrupted run aren't known, so a resumed run rebuilds everyone
+            rebuilt = rebuild_aggregates(db, batch_size, None if last_id is not None else repriced_users)
+            print(f"   🔄 Rebuilt return aggregates for {rebuilt} users")
+        
+        # A finished run starts from scratch next time
+        if not dry_run and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    
+    except Exception as e:
+        print(f"❌ Error during migration: {str(e)}")
+        sys.exit(1)
+    
+    finally:
+        close_client()
+
+def server_side_pipeline(dry_run: bool = False) -> List[Dict[str, Any]]:
+    """$lookup each unpriced return's order, pick the product price and $merge it back"""
+    pipeline = [
+        {"$match": UNPRICED_QUERY},
+        {"$project": {"orderId": 1, "productId": 1}},
+        {"$lookup": {
+            "from": "orders",
+            "localField": "orderId",
+            "foreignField": "_id",
+            "as": "order",
+        }},
+        {"$set": {"price": {"$let": {
+            "vars": {"product": {"$arrayElemAt": [{"$filter": {
+                "input": {"$ifNull": [{"$arrayElemAt": ["$order.products", 0]}, []]},
+                "cond": {"$eq": ["$$this.productId", "$productId"]},
+            }}, 0]}},
+            "in": "$$product.price",
+        }}}},
+        {"$match": {"price": {"$gt": 0}}},
+        {"$project": {"price": 1}},
+    ]
+    if dry_run:
+        return pipeline + [{"$count": "matched"}]
+    return pipeline + [{"$merge": {"into": "returns", "on": "_id",
+                                   "whenMatched": "merge", "whenNotMatched": "discard"}}]
+
+def update_returns_server_side(dry_run: bool = False):
+    """Price all unpriced returns with one aggregation (MongoDB 4.4+)"""
+    try:
+        db = get_db()
+        
+        print(f"Connected to MongoDB: {MONGODB_URI}")
+        
+        returns_collection = db.returns
+        before = returns_collection.count_documents(UNPRICED_QUERY)
+        if before == 0:
             print("✅ All returns already have prices. No updates needed.")
             return
         
-        print(f"📊 Found {len(returns_to_update)} returns to update")
-        
-        updated_count = 0
-        failed_count = 0
-        
-        for return_item in returns_to_update:
-            try:
-                # Get the order for this return
-                order = orders_collection.find_one({"_id": return_item["orderId"]})
-                
-                if not order:
-                    print(f"⚠️  Order not found for return {return_item['_id']}")
-                    failed_count += 1
-                    continue
-                
-                # Find the product in the order
-                product_price = 0
-                for product in order.get("products", []):
-                    if product["productId"] == return_item["productId"]:
-                        product_price = product["price"]
-                        break
-                
-                if product_price == 0:
-                    print(f"⚠️  Product not found in order for return {return_item['_id']}")
-                    failed_count += 1
-                    continue
-                
-                # Update the return with the price
-                result = returns_collection.update_one(
-                    {"_id": return_item["_id"]},
-                    {"$set": {"price": product_price}}
-                )
-                
-                if result.modified_count > 0:
-                    updated_count += 1
-                    print(f"✅ Updated return {return_item['_id']} with price ₹{product_price}")
-                else:
-                    print(f"⚠️  No changes made to return {return_item['_id']}")
-                    failed_count += 1
-                    
-            except Exception as e:
-                print(f"❌ Error updating return {return_item['_id']}: {str(e)}")
-                failed_count += 1
-        
-        print(f"\n🎉 Migration completed!")
-        print(f"   ✅ Successfully updated: {updated_count} returns")
-        print(f"   ❌ Failed updates: {failed_count} returns")
-        print(f"   📊 Success rate: {(updated_count / len(returns_to_update) * 100):.1f}%")
+        started = time.perf_counter()
+        result = list(returns_collection.aggregate(server_side_pipeline(dry_run), allowDiskUse=True))
+        elapsed = time.perf_counter() - started
         
+        if dry_run:
+            updated_count = result[0]["matched"] if result else 0
+        else:
+            updated_count = before - returns_collection.count_documents(UNPRICED_QUERY)
+        
+        print(f"\n🎉 Server-side migration {'dry run ' if dry_run else ''}completed in {elapsed:.1f}s!")
+        print(f"   📊 Returns without a price: {before}")
+        print(f"   ✅ {'Would update' if dry_run else 'Successfully updated'}: {updated_count} returns")
+        print(f"   ❌ Failed updates: {before - updated_count} returns")
+        
+        if not dry_run and updated_count:
+            # The merge doesn't report which returns it priced
+            print(f"   🔄 Rebuilt return aggregates for {rebuild_aggregates(db)} users")
+    
     except Exception as e:
         print(f"❌ Error during migration: {str(e)}")
         sys.exit(1)
     
     finally:
-        if 'client' in locals():
-            client.close()
+        close_client()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill in missing return prices from their orders")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Returns per orders query and bulk write (default: 1000)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help=f"Checkpoint file (default: {DEFAULT_CHECKPOINT})")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last checkpointed return")
+    parser.add_argument("--dry-run", action="store_true", help="Report how many returns would be updated without writing")
+    parser.add_argument("--server-side", action="store_true",
+                        help="Match and write prices inside MongoDB with $lookup/$merge (MongoDB 4.4+)")
+    args = parser.parse_args()
+    
     print("🚀 Starting returns price migration...")
     print(f"📍 MongoDB URI: {MONGODB_URI}")
     print("-" * 50)
     
-    update_returns_with_prices()
+    if args.server_side:
+        update_returns_server_side(args.dry_run)
+    else:
+        update_returns_with_prices(max(1, args.batch_size), args.checkpoint, args.resume, args.dry_run)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Fetch a user's return history for scoring by userId
+
+The scoring server accepts {"new_return": {...}, "userId": "..."} and looks
+the history up itself instead of receiving it from the caller. Queries run
+on a pooled AsyncMongoClient, driven by an event loop on a background
+thread, so the scoring threads only wait on the result. A query only asks
+for the fields extract_features reads, newest first. By default it reads
+the whole history, as training does. It can be bounded by:
+
+    FRAUD_HISTORY_LOOKBACK_DAYS   only returns created this recently (default: 0 = no limit)
+    FRAUD_HISTORY_MAX_RETURNS     at most this many returns (default: 0 = no limit)
+
+A bound changes total_returns, the status and fraud counts and the amount
+features of long histories. Those then differ from the full-history
+features the model was trained on, so only set one if that skew is
+acceptable.
+
+Requests for a user whose history is already being fetched wait for that
+query instead of sending another. The result isn't cached after it arrives.
+"""
+
+import asyncio
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from mongo_pool import DB_NAME, get_async_client
+
+# Only the fields extract_features reads (plus _id, to leave out the return being scored)
+HISTORY_PROJECTION = {
+    "_id": 1, "price": 1, "reason": 1, "description": 1, "imageUrl": 1,
+    "status": 1, "fraudFlag": 1, "createdAt": 1,
+}
+
+def parse_id(value: Any) -> Any:
+    """ObjectId for 24-hex strings (as ids arrive in JSON), anything else unchanged"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+class UserHistoryFetcher:
+    """Fetches users' returns on a background event loop, one query per user at a time"""
+
+    def __init__(self, lookback_days: Optional[float] = None, max_returns: Optional[int] = None,
+                 timeout_seconds: float = 5.0):
+        self.lookback_days = float(os.getenv("FRAUD_HISTORY_LOOKBACK_DAYS", "0")) \
+            if lookback_days is None else lookback_days
+        self.max_returns = int(os.getenv("FRAUD_HISTORY_MAX_RETURNS", "0")) if max_returns is None else max_returns
+        self.timeout_seconds = timeout_seconds
+        self.stats = Counter()
+        self._client = None
+        self._in_flight: Dict[Any, asyncio.Future] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="history-fetcher", daemon=True)
+        self._thread.start()
+
+    def fetch(self, user_id: Any, exclude_id: Any = None) -> List[Dict[str, Any]]:
+        """The user's returns, newest first, without the one whose _id is exclude_id"""
+        future = asyncio.run_coroutine_threadsafe(self._fetch(parse_id(user_id)), self._loop)
+        history = future.result(self.timeout_seconds)
+        exclude_id = parse_id(exclude_id)
+        return [return_doc for return_doc in history if exclude_id is None or return_doc.get("_id") != exclude_id]
+
+    async def _fetch(self, user_id: Any) -> List[Dict[str, Any]]:
+        query = self._in_flight.get(user_id)
+        if query is None:
+            query = asyncio.ensure_future(self._query(user_id))
+            self._in_flight[user_id] = query
+            query.add_done_callback(lambda _: self._in_flight.pop(user_id, None))
+        else:
+            self.stats["coalesced"] += 1
+        # A caller that times out must not cancel the query others are waiting on
+        return await asyncio.shield(query)
+
+    async def _query(self, user_id: Any) -> List[Dict[str, Any]]:
+        if self._client is None:
+            # Created on the loop thread, which the async client stays bound to
+            self._client = get_async_client()
+        query: Dict[str, Any] = {"userId": user_id}
+        if self.lookback_days > 0:
+            query["createdAt"] = {"$gte": datetime.now(timezone.utc) - timedelta(days=self.lookback_days)}
+        cursor = self._client[DB_NAME].returns.find(query, HISTORY_PROJECTION, sort=[("createdAt", -1)],
+                                                    limit=max(self.max_returns, 0))
+        history = await cursor.to_list()
+        self.stats["queries"] += 1
+        self.stats["returns"] += len(history)
+        return history
+
+    def close(self):
+        async def shutdown():
+            if self._client is not None:
+                await self._client.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(self.timeout_seconds)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(self.timeout_seconds)
+
+_fetcher: Optional[UserHistoryFetcher] = None
+_fetcher_lock = threading.Lock()
+
+def get_history_fetcher() -> UserHistoryFetcher:
+    """The process-wide fetcher, started on first use"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = UserHistoryFetcher()
+        return _fetcher